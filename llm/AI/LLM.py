@@ -10,8 +10,7 @@ import os
 
 from AI.image_process import generate_from_image
 from AI.models import ConversationStage
-from embeddings_handler import CustomEmbeddings
-from pdf_processor import load_and_process_pdfs
+from retrieval_client import RETRIEVAL_SIDECAR_URL, ADMIN_TOKEN_HEADER, get_retrieval_client, is_valid_admin_token
 from context_manager import get_relevant_context
 from managers.conversation_manager import ConversationManager
 from logging_config import setup_logger
@@ -44,9 +43,30 @@ client = OpenAI(
     base_url="https://api.proxyapi.ru/openai/v1/chat/completions",
 )
 
-# Загрузка векторных данных и обработка PDF
-embeddings = CustomEmbeddings()
-vector_stores = load_and_process_pdfs()
+# Загрузка готовой версии индексов (сборка выполняется отдельно: AI/build_index.py);
+# новые версии подхватываются без перезапуска сервера. Если задан RETRIEVAL_SIDECAR_URL,
+# модель и индексы загружает сервис поиска (AI/retrieval_service.py), общий для всех процессов API
+if RETRIEVAL_SIDECAR_URL:
+    index_registry = None
+else:
+    from embeddings_handler import CustomEmbeddings
+    from index_registry import IndexRegistry
+    embeddings = CustomEmbeddings()
+    index_registry = IndexRegistry()
+    index_registry.reload()
+    index_registry.start_watcher()
+    index_registry.install_signal_handler()
+
+
+def retrieve_context(query: str) -> str:
+    """Контекст из активной версии индексов; версия не освобождается до окончания поиска"""
+    if index_registry is None:
+        return get_relevant_context(query)  # Запрос к сервису поиска
+    with index_registry.acquire() as bundle:
+        if bundle is None:
+            return get_relevant_context(query, {})
+        return get_relevant_context(query, bundle.stores, unified_index=bundle.unified, router=bundle.router)
+
 
 @app.route('/check-uc', methods=['POST'])
 def process_data():
@@ -102,7 +122,7 @@ def process_data():
         # Добавление релевантного контекста на этапе диагностики
         if conversation_state['current_stage'] == 'DIAGNOSIS':
             rag_logger.info("Получение релевантного контекста из базы знаний")
-            context = get_relevant_context(last_user_message, vector_stores)
+            context = retrieve_context(last_user_message)
             system_message["content"] += f"\n\nКонтекст из медицинской литературы:\n{context}"
             rag_logger.info("Контекст успешно получен")
 
@@ -176,7 +196,7 @@ def process_data_sync():
         # Добавляем RAG контекст для диагностики
         if conversation_state['current_stage'] == 'DIAGNOSIS':
             rag_logger.info("Получение контекста для синхронного запроса")
-            context = get_relevant_context(last_user_message, vector_stores)
+            context = retrieve_context(last_user_message)
             system_message["content"] += f"\n\nКонтекст из медицинской литературы:\n{context}"
 
         full_messages = [system_message] + messages
@@ -357,6 +377,62 @@ def get_welcome_messages():
             mimetype='application/json'
         )
 
+@app.route('/index-version', methods=['GET'])
+def get_index_version():
+    """Возвращает активную версию индексов и количество выполняющихся поисков"""
+    try:
+        status = index_registry.status() if index_registry else get_retrieval_client().status()
+        return Response(
+            json.dumps(status, ensure_ascii=False),
+            status=200,
+            mimetype='application/json'
+        )
+    except Exception as e:
+        api_logger.error(f"Ошибка в get_index_version: {str(e)}")
+        return Response(
+            json.dumps({"error": "Internal server error"}),
+            status=500,
+            mimetype='application/json'
+        )
+
+@app.route('/reload-index', methods=['POST'])
+def reload_index():
+    """Загружает указанную (или активную по указателю CURRENT) версию индексов без перезапуска сервера"""
+    if not is_valid_admin_token(request.headers.get(ADMIN_TOKEN_HEADER)):
+        api_logger.error("Запрос на перезагрузку индексов без верного токена")
+        return Response(
+            json.dumps({"error": "Forbidden"}),
+            status=403,
+            mimetype='application/json'
+        )
+    try:
+        data = request.get_json(silent=True) or {}
+        version, force = data.get('version'), bool(data.get('force', False))
+        if index_registry is None:
+            result = get_retrieval_client().reload(version=version, force=force,
+                                                   admin_token=request.headers.get(ADMIN_TOKEN_HEADER))
+        else:
+            result = index_registry.reload(version=version, force=force)
+        return Response(
+            json.dumps(result, ensure_ascii=False),
+            status=200 if result["error"] is None else 409,
+            mimetype='application/json'
+        )
+    except PermissionError as e:
+        api_logger.error(f"Ошибка в reload_index: {str(e)}")
+        return Response(
+            json.dumps({"error": "Forbidden"}),
+            status=403,
+            mimetype='application/json'
+        )
+    except Exception as e:
+        api_logger.error(f"Ошибка в reload_index: {str(e)}")
+        return Response(
+            json.dumps({"error": "Internal server error"}),
+            status=500,
+            mimetype='application/json'
+        )
+
 def get_system_prompt(conversation_state: dict) -> dict:
     """Возвращает системный промпт в зависимости от текущей стадии разговора"""
     current_stage = conversation_state['current_stage']
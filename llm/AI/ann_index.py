@@ -0,0 +1,171 @@
+import os
+import math
+import faiss
+import numpy as np
+from typing import Optional
+from logging_config import setup_logger
+
+# Инициализация логгера
+rag_logger = setup_logger('ann_index', 'RAG_LOGGING')
+
+# Тип общего индекса, выбирается при сборке: flat (точный поиск), hnsw, ivf_flat
+# или сжатые ivf_pq, opq_ivf_pq, pca_ivf_pq (с точным переранжированием по полным векторам)
+RAG_INDEX_TYPE = os.getenv('RAG_INDEX_TYPE', 'flat')
+RAG_HNSW_M = int(os.getenv('RAG_HNSW_M', '32'))  # Количество связей вершины графа HNSW
+RAG_HNSW_EF_CONSTRUCTION = int(os.getenv('RAG_HNSW_EF_CONSTRUCTION', '200'))
+RAG_HNSW_EF_SEARCH = int(os.getenv('RAG_HNSW_EF_SEARCH', '64'))  # Ширина поиска HNSW (настраивается при загрузке)
+RAG_IVF_NLIST = int(os.getenv('RAG_IVF_NLIST', '0'))  # Количество кластеров IVF (0 - автоподбор)
+RAG_IVF_NPROBE = int(os.getenv('RAG_IVF_NPROBE', '16'))  # Просматриваемых кластеров IVF (настраивается при загрузке)
+RAG_PQ_M = int(os.getenv('RAG_PQ_M', '48'))  # Количество подвекторов PQ (байт на вектор при 8 битах)
+RAG_PQ_NBITS = int(os.getenv('RAG_PQ_NBITS', '8'))  # Бит на код подвектора
+RAG_PCA_DIM = int(os.getenv('RAG_PCA_DIM', '128'))  # Размерность после PCA для pca_ivf_pq
+RAG_RERANK_FACTOR = int(os.getenv('RAG_RERANK_FACTOR', '4'))  # Кандидатов на переранжирование: k * factor
+
+COMPRESSED_INDEX_TYPES = ('ivf_pq', 'opq_ivf_pq', 'pca_ivf_pq')
+INDEX_TYPES = ('flat', 'hnsw', 'ivf_flat') + COMPRESSED_INDEX_TYPES
+MIN_POINTS_PER_CENTROID = 39  # Меньше точек на кластер faiss считает недостаточным для обучения
+
+
+def resolve_nlist(vector_count: int) -> int:
+    """Количество кластеров IVF: около 4·√N, но не больше, чем позволяет объем обучающей выборки"""
+    if RAG_IVF_NLIST > 0:
+        return RAG_IVF_NLIST
+    return max(1, min(int(4 * math.sqrt(vector_count)), vector_count // MIN_POINTS_PER_CENTROID))
+
+
+def resolve_pq_m(dim: int) -> int:
+    """Количество подвекторов PQ: наибольший делитель размерности, не превышающий RAG_PQ_M"""
+    return max(m for m in range(1, min(RAG_PQ_M, dim) + 1) if dim % m == 0)
+
+
+def resolve_pq_nbits(vector_count: int) -> int:
+    """Бит на код PQ: на малом корпусе уменьшается, чтобы хватило точек для обучения кодовой книги"""
+    return max(1, min(RAG_PQ_NBITS, int(math.log2(max(2, vector_count // MIN_POINTS_PER_CENTROID)))))
+
+
+def is_compressed(index_type: str) -> bool:
+    """Сжатый индекс возвращает приближенные расстояния и требует переранжирования"""
+    return index_type in COMPRESSED_INDEX_TYPES
+
+
+def create_index(vectors: np.ndarray, index_type: str = RAG_INDEX_TYPE, params: Optional[dict] = None) -> faiss.Index:
+    """
+    Создает пустой индекс выбранного типа; IVF и PQ обучаются на переданных векторах.
+
+    Аргументы:
+    - vectors: Векторы корпуса (для обучения IVF и определения размерности).
+    - index_type: Один из INDEX_TYPES.
+    - params: Параметры построения (m, ef_construction, nlist, factory); по умолчанию из переменных окружения.
+
+    Возвращает:
+    - Индекс faiss, в который можно добавлять векторы по порядку (идентификаторы 0..N-1).
+    """
+    dim = vectors.shape[1]
+    params = {**get_index_params(index_type, len(vectors), dim), **(params or {})}
+    rag_logger.info(f"Создание индекса {index_type} для {len(vectors)} векторов, параметры: {params}")
+    if index_type == 'flat':
+        return faiss.IndexFlatL2(dim)
+    if index_type == 'hnsw':
+        index = faiss.IndexHNSWFlat(dim, params["m"])
+        index.hnsw.efConstruction = params["ef_construction"]
+        return index
+    if index_type == 'ivf_flat':
+        quantizer = faiss.IndexFlatL2(dim)
+        index = faiss.IndexIVFFlat(quantizer, dim, params["nlist"], faiss.METRIC_L2)
+        index.train(np.ascontiguousarray(vectors, dtype=np.float32))
+        return index
+    if is_compressed(index_type):
+        # Суффикс np отключает полисемантическое обучение PQ: оно долгое и не нужно для поиска по IVF
+        index = faiss.index_factory(dim, params["factory"], faiss.METRIC_L2)
+        index.train(np.ascontiguousarray(vectors, dtype=np.float32))
+        return index
+    raise ValueError(f"Неизвестный тип индекса: {index_type} (допустимы: {', '.join(INDEX_TYPES)})")
+
+
+def get_index_params(index_type: str, vector_count: int, dim: int = None) -> dict:
+    """Параметры построения индекса (записываются в манифест версии)"""
+    if index_type == 'hnsw':
+        return {"m": RAG_HNSW_M, "ef_construction": RAG_HNSW_EF_CONSTRUCTION}
+    if index_type == 'ivf_flat':
+        return {"nlist": resolve_nlist(vector_count)}
+    if is_compressed(index_type):
+        nlist = resolve_nlist(vector_count)
+        nbits = resolve_pq_nbits(vector_count)
+        if index_type == 'pca_ivf_pq':
+            pca_dim = min(RAG_PCA_DIM, dim)
+            m = resolve_pq_m(pca_dim)
+            factory = f"PCA{pca_dim},IVF{nlist},PQ{m}x{nbits}np"
+        else:
+            m = resolve_pq_m(dim)
+            prefix = f"OPQ{m}," if index_type == 'opq_ivf_pq' else ""
+            factory = f"{prefix}IVF{nlist},PQ{m}x{nbits}np"
+        return {"factory": factory, "nlist": nlist, "m": m, "nbits": nbits}
+    return {}
+
+
+def _extract_ivf(index: faiss.Index):
+    """IVF-часть индекса (в том числе за предварительным преобразованием OPQ/PCA) или None"""
+    try:
+        return faiss.extract_index_ivf(index)
+    except RuntimeError:
+        return None
+
+
+def configure_search(index: faiss.Index, ef_search: int = None, nprobe: int = None):
+    """Устанавливает параметры поиска: efSearch для HNSW, nprobe для IVF"""
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = ef_search or RAG_HNSW_EF_SEARCH
+        return
+    ivf = _extract_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = nprobe or RAG_IVF_NPROBE
+
+
+def is_ivf_index(index: faiss.Index) -> bool:
+    """Индекс содержит IVF-часть (в том числе за предварительным преобразованием)"""
+    return _extract_ivf(index) is not None
+
+
+def is_index_mapped(index: faiss.Index) -> bool:
+    """
+    Данные индекса читаются из отображенного файла, а не из памяти процесса.
+
+    Коды Flat/HNSW, отображенные флагом IO_FLAG_MMAP_IFC, отмечаются при чтении (index_mmap.read_index).
+    """
+    if getattr(index, 'codes_mapped', False):
+        return True
+    ivf = _extract_ivf(index)
+    return ivf is not None and isinstance(faiss.downcast_InvertedLists(ivf.invlists), faiss.OnDiskInvertedLists)
+
+
+def search_parameters(index: faiss.Index, selector: faiss.IDSelector) -> faiss.SearchParameters:
+    """
+    Параметры поиска с фильтром идентификаторов.
+
+    Тип параметров должен соответствовать типу индекса: IVF не принимает базовый SearchParameters,
+    а HNSW с базовыми параметрами игнорировал бы настроенный efSearch.
+    """
+    if isinstance(index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=index.hnsw.efSearch)
+    ivf = _extract_ivf(index)
+    if ivf is not None:
+        return faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nprobe)
+    return faiss.SearchParameters(sel=selector)
+
+
+def rerank_exact(query: np.ndarray, ids: np.ndarray, candidate_vectors: np.ndarray, k: int):
+    """
+    Точное переранжирование кандидатов сжатого индекса по полным векторам.
+
+    Аргументы:
+    - query: Вектор запроса.
+    - ids: Идентификаторы кандидатов.
+    - candidate_vectors: Полные векторы кандидатов в том же порядке.
+    - k: Количество результатов.
+
+    Возвращает:
+    - Точные расстояния L2 и идентификаторы top-k по возрастанию расстояния.
+    """
+    distances = ((np.asarray(candidate_vectors, dtype=np.float32) - query.reshape(1, -1)) ** 2).sum(axis=1)
+    order = np.argsort(distances, kind='stable')[:k]
+    return distances[order], ids[order]
@@ -0,0 +1,125 @@
+"""
+Сравнение типов общего индекса: точный Flat, HNSW, IVF-Flat и сжатые IVF-PQ (в том числе с OPQ/PCA).
+
+Для каждой конфигурации измеряются время построения, размер индекса в байтах на вектор,
+recall@k относительно точного поиска и задержка одиночного запроса (p50/p99). Сжатые индексы
+измеряются без переранжирования и с точным переранжированием k * RAG_RERANK_FACTOR кандидатов.
+Корпус берется из активной версии индексов; параметр --scale размножает его с небольшим шумом,
+чтобы оценить поведение на всей библиотеке.
+
+Запуск (из каталога llm):
+    PYTHONPATH=. python AI/benchmark_ann_index.py --k 10 --ef-search 16 32 64 128 --nprobe 1 4 16 64 --scale 10
+"""
+import argparse
+import re
+import time
+import faiss
+import numpy as np
+from embeddings_handler import CustomEmbeddings
+from index_bundle import load_index_bundle
+from ann_index import (
+    INDEX_TYPES, RAG_RERANK_FACTOR, create_index, configure_search, get_index_params, is_compressed, rerank_exact
+)
+
+QUERY_WORDS = 12  # Длина запроса, составленного из начала чанка
+NOISE_SCALE = 0.05  # Шум при размножении корпуса относительно разброса координат
+
+
+def load_corpus(scale: int, seed: int):
+    """Векторы и тексты корпуса из активной версии индексов (хранилища категорий — точные Flat)"""
+    bundle = load_index_bundle(search_mode='category')
+    if bundle is None:
+        raise SystemExit("Активная версия индексов не найдена: сначала выполните AI/build_index.py")
+    vectors, texts = [], []
+    for store in bundle.stores.values():
+        vectors.append(store.index.reconstruct_n(0, store.index.ntotal))
+        texts.extend(store.docstore.search(store.index_to_docstore_id[i]).page_content for i in range(store.index.ntotal))
+    corpus = np.ascontiguousarray(np.vstack(vectors), dtype=np.float32)
+    if scale > 1:
+        generator = np.random.default_rng(seed)
+        noise = corpus.std(axis=0) * NOISE_SCALE
+        copies = [corpus + generator.normal(size=corpus.shape).astype(np.float32) * noise for _ in range(scale - 1)]
+        corpus = np.ascontiguousarray(np.vstack([corpus, *copies]), dtype=np.float32)
+    return corpus, texts
+
+
+def make_queries(texts: list, count: int, seed: int) -> np.ndarray:
+    """Запросы: начало случайных чанков корпуса, закодированное моделью эмбеддингов"""
+    generator = np.random.default_rng(seed)
+    chosen = generator.choice(len(texts), size=min(count, len(texts)), replace=False)
+    queries = [' '.join(re.findall(r'\w+', texts[i])[:QUERY_WORDS]) for i in chosen]
+    return CustomEmbeddings().generate_embeddings(queries)
+
+
+def measure(index, queries: np.ndarray, k: int, corpus: np.ndarray = None):
+    """Результаты и задержки одиночных запросов в миллисекундах (с переранжированием, если передан корпус)"""
+    ids = np.full((len(queries), k), -1, dtype=np.int64)
+    latencies = []
+    for i, query in enumerate(queries):
+        start = time.perf_counter()
+        if corpus is None:
+            _, ids[i:i + 1] = index.search(query.reshape(1, -1), k)
+        else:
+            _, candidates = index.search(query.reshape(1, -1), k * RAG_RERANK_FACTOR)
+            candidates = np.sort(candidates[0][candidates[0] >= 0])
+            _, found = rerank_exact(query, candidates, corpus[candidates], k)
+            ids[i, :len(found)] = found
+        latencies.append((time.perf_counter() - start) * 1000)
+    return ids, np.array(latencies)
+
+
+def bytes_per_vector(index) -> float:
+    """Размер сериализованного индекса в байтах на вектор"""
+    return faiss.serialize_index(index).nbytes / max(index.ntotal, 1)
+
+
+def recall_at_k(found: np.ndarray, exact: np.ndarray) -> float:
+    """Доля точных ближайших соседей, найденных приближенным поиском"""
+    return float(np.mean([len(set(f) & set(e)) / len(e) for f, e in zip(found, exact)]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение типов индекса FAISS: recall@k и задержка поиска")
+    parser.add_argument('--k', type=int, default=10, help="Количество соседей")
+    parser.add_argument('--queries', type=int, default=200, help="Количество запросов")
+    parser.add_argument('--ef-search', type=int, nargs='+', default=[16, 32, 64, 128], help="Значения efSearch для HNSW")
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 4, 16, 64], help="Значения nprobe для IVF")
+    parser.add_argument('--types', nargs='+', default=list(INDEX_TYPES), choices=INDEX_TYPES, help="Типы индекса")
+    parser.add_argument('--scale', type=int, default=1, help="Во сколько раз размножить корпус")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    corpus, texts = load_corpus(args.scale, args.seed)
+    queries = make_queries(texts, args.queries, args.seed)
+    print(f"Корпус: {len(corpus)} векторов размерности {corpus.shape[1]}, запросов: {len(queries)}")
+
+    exact_index = create_index(corpus, 'flat')
+    exact_index.add(corpus)
+    exact, _ = measure(exact_index, queries, args.k)
+
+    runs = []
+    for index_type in args.types:
+        start = time.perf_counter()
+        index = create_index(corpus, index_type)
+        index.add(corpus)
+        params = get_index_params(index_type, len(corpus), corpus.shape[1])
+        print(f"{index_type}: построение {time.perf_counter() - start:.2f} сек, параметры {params}")
+        if index_type == 'hnsw':
+            runs += [(index_type, index, {'ef_search': ef}) for ef in args.ef_search]
+        elif index_type == 'flat':
+            runs.append((index_type, index, {}))
+        else:
+            runs += [(index_type, index, {'nprobe': nprobe}) for nprobe in args.nprobe if nprobe <= params['nlist']]
+
+    print(f"{'индекс':<14}{'параметры':<16}{'байт/вектор':>13}{f'recall@{args.k}':>12}{'rerank':>8}{'p50, мс':>10}{'p99, мс':>10}")
+    for index_type, index, params in runs:
+        configure_search(index, **params)
+        label = ', '.join(f"{name}={value}" for name, value in params.items())
+        for rerank in ([False, True] if is_compressed(index_type) else [False]):
+            found, latencies = measure(index, queries, args.k, corpus if rerank else None)
+            print(f"{index_type:<14}{label:<16}{bytes_per_vector(index):>13.1f}{recall_at_k(found, exact):>12.3f}"
+                  f"{'да' if rerank else 'нет':>8}{np.percentile(latencies, 50):>10.3f}{np.percentile(latencies, 99):>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
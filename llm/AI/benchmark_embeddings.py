@@ -0,0 +1,125 @@
+"""
+Сравнение движков инференса модели эмбеддингов.
+
+Для каждого движка измеряются задержка одиночного запроса, пропускная способность пакетной
+генерации и совпадение с эталонными векторами fp32 (косинусная близость и пересечение
+ближайших соседей), чтобы выбрать самый быстрый движок без потери качества поиска.
+
+Запуск (из каталога llm):
+    PYTHONPATH=. python AI/benchmark_embeddings.py --backends torch torch_int8 onnx --limit 512
+"""
+import argparse
+import glob
+import os
+import time
+import numpy as np
+import fitz
+from embeddings_handler import CustomEmbeddings
+from embedding_backends import BACKENDS, TorchBackend, create_embedding_backend
+from text_preprocessing import clean_text, create_medical_text_splitter
+from logging_config import setup_logger
+
+# Инициализация логгера
+bench_logger = setup_logger('benchmark_embeddings', 'EMBEDDINGS_LOGGING')
+
+MEDICAL_BOOKS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'medical_books')
+
+
+def load_sample_texts(tokenizer, limit: int) -> list:
+    """Собирает выборку чанков из медицинских книг для сравнения"""
+    splitter = create_medical_text_splitter(tokenizer)
+    texts = []
+    for pdf_path in sorted(glob.glob(os.path.join(MEDICAL_BOOKS_DIR, '**', '*.pdf'), recursive=True)):
+        with fitz.open(pdf_path) as document:
+            for page in document:
+                texts.extend(splitter.split_text(clean_text(page.get_text("text"))))
+                if len(texts) >= limit:
+                    return texts[:limit]
+    return texts
+
+
+def top_k_neighbours(vectors: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    """Возвращает индексы k ближайших соседей (L2) для каждого запроса"""
+    distances = (
+        (queries ** 2).sum(axis=1)[:, None]
+        - 2 * queries @ vectors.T
+        + (vectors ** 2).sum(axis=1)[None, :]
+    )
+    return np.argsort(distances, axis=1)[:, :k]
+
+
+def benchmark_backend(embeddings: CustomEmbeddings, backend, texts: list, repeats: int) -> dict:
+    """Измеряет задержку и пропускную способность одного движка"""
+    query = texts[0]
+    embeddings.generate_embeddings([query], backend=backend) # Прогрев
+
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        embeddings.generate_embeddings([query], backend=backend)
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    vectors = embeddings.generate_embeddings(texts, backend=backend)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "vectors": vectors,
+        "p50_ms": float(np.percentile(latencies, 50) * 1000),
+        "p95_ms": float(np.percentile(latencies, 95) * 1000),
+        "texts_per_sec": len(texts) / max(elapsed, 1e-9),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение движков инференса модели эмбеддингов")
+    parser.add_argument('--backends', nargs='+', default=list(BACKENDS), help="Движки для сравнения")
+    parser.add_argument('--limit', type=int, default=512, help="Количество чанков в выборке")
+    parser.add_argument('--repeats', type=int, default=50, help="Количество замеров одиночного запроса")
+    parser.add_argument('--threads', type=int, default=None, help="Количество потоков внутри операций")
+    parser.add_argument('--k', type=int, default=10, help="Количество соседей для проверки поиска")
+    args = parser.parse_args()
+
+    embeddings = CustomEmbeddings()
+    texts = load_sample_texts(embeddings.tokenizer, args.limit)
+    bench_logger.info(f"Выборка для сравнения: {len(texts)} чанков")
+
+    # Эталон — модель PyTorch в fp32
+    reference_backend = create_embedding_backend(embeddings.model_name, TorchBackend.name, args.threads)
+    reference = benchmark_backend(embeddings, reference_backend, texts, args.repeats)
+    reference_vectors = reference["vectors"]
+    queries = reference_vectors[: min(100, len(reference_vectors))]
+    reference_neighbours = top_k_neighbours(reference_vectors, queries, args.k)
+
+    report = []
+    for backend_name in args.backends:
+        if backend_name == TorchBackend.name:
+            result = reference
+        else:
+            backend = create_embedding_backend(embeddings.model_name, backend_name, args.threads)
+            if backend.name != backend_name: # Движок недоступен, создан запасной torch
+                bench_logger.error(f"Движок {backend_name} недоступен, пропуск")
+                continue
+            result = benchmark_backend(embeddings, backend, texts, args.repeats)
+
+        vectors = result["vectors"]
+        cosine = (vectors * reference_vectors).sum(axis=1) / (
+            np.linalg.norm(vectors, axis=1) * np.linalg.norm(reference_vectors, axis=1) + 1e-12
+        )
+        neighbours = top_k_neighbours(vectors, vectors[: len(queries)], args.k)
+        overlap = np.mean([
+            len(set(found) & set(expected)) / args.k
+            for found, expected in zip(neighbours, reference_neighbours)
+        ])
+        report.append((backend_name, result, float(cosine.mean()), float(cosine.min()), float(overlap)))
+
+    print(f"{'движок':<12}{'p50, мс':>10}{'p95, мс':>10}{'текстов/с':>12}{'cos ср.':>10}{'cos мин.':>10}{'top-k':>8}")
+    for backend_name, result, cos_mean, cos_min, overlap in report:
+        print(
+            f"{backend_name:<12}{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}"
+            f"{result['texts_per_sec']:>12.1f}{cos_mean:>10.4f}{cos_min:>10.4f}{overlap:>8.3f}"
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""
+Память рабочих процессов и задержка первого запроса при обычной загрузке индексов и загрузке через mmap.
+
+Запускается несколько процессов (как рабочие процессы сервера), каждый загружает активную версию
+индексов и выполняет первый и повторный поиск. Для каждого процесса выводятся RSS, PSS (разделяемые
+страницы поделены между процессами) и прирост RSS от загрузки индексов. Холодный запуск измеряется после
+вытеснения файлов версии из кеша страниц без прогрева, теплый — с прогревом INDEX_WARMUP.
+
+Запуск (из каталога llm):
+    PYTHONPATH=. python AI/benchmark_index_memory.py --workers 4 --mmap 0 1
+"""
+import os
+import json
+import time
+import argparse
+import multiprocessing
+import numpy as np
+from embeddings_handler import CustomEmbeddings
+from index_bundle import BUNDLE_MANIFEST_NAME, INDEX_BUNDLES_DIR, get_current_version, load_index_bundle, verify_bundle
+from index_mmap import INDEX_WARMUP, WARMUP_MODES, evict_from_page_cache, process_memory
+
+DEFAULT_QUERY = "лечение артериальной гипертензии"
+
+
+def _search(bundle, query: np.ndarray, k: int):
+    """Поиск в загруженной версии (общий индекс или все категории)"""
+    if bundle.unified is not None:
+        return bundle.unified.search(query, k)
+    return [store.similarity_search_with_score_by_vector(query.tolist(), k=k) for store in bundle.stores.values()]
+
+
+def _worker(use_mmap: bool, warmup: str, query_text: str, k: int, barrier, results):
+    """Рабочий процесс: загрузка версии, первый и повторный запрос, замер памяти после загрузки всеми процессами"""
+    query = CustomEmbeddings().embed_query_vector(query_text)
+    before = process_memory()
+
+    # Контрольные суммы проверяются один раз до замеров: их чтение вернуло бы файлы в кеш страниц
+    start = time.perf_counter()
+    bundle = load_index_bundle(verify=False, use_mmap=use_mmap, warmup=warmup)
+    load_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    _search(bundle, query, k)
+    first_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    _search(bundle, query, k)
+    second_ms = (time.perf_counter() - start) * 1000
+
+    # Память измеряется, когда все процессы загрузили индексы, чтобы PSS учитывал разделение страниц
+    barrier.wait()
+    after = process_memory()
+    results.put({
+        "pid": os.getpid(),
+        "mapped": len(bundle.mapped_files),
+        "load": load_seconds,
+        "first": first_ms,
+        "second": second_ms,
+        "rss": after["rss"],
+        "pss": after["pss"],
+        "shared": after["shared"],
+        "index_rss": after["rss"] - before["rss"],
+    })
+    barrier.wait()
+
+
+def run_workers(workers: int, use_mmap: bool, warmup: str, query_text: str, k: int) -> list:
+    """Запускает рабочие процессы одновременно и собирает их замеры"""
+    context = multiprocessing.get_context('spawn')
+    barrier = context.Barrier(workers)
+    results = context.Queue()
+    processes = [
+        context.Process(target=_worker, args=(use_mmap, warmup, query_text, k, barrier, results))
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    measurements = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    return measurements
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Память и задержка первого запроса при загрузке индексов")
+    parser.add_argument('--workers', type=int, default=2, help="Количество рабочих процессов")
+    parser.add_argument('--mmap', type=int, nargs='+', default=[0, 1], choices=[0, 1], help="Загрузка через mmap")
+    parser.add_argument('--warmup', default=INDEX_WARMUP if INDEX_WARMUP != 'none' else 'madvise',
+                        choices=[mode for mode in WARMUP_MODES if mode != 'none'], help="Прогрев для теплого запуска")
+    parser.add_argument('--query', default=DEFAULT_QUERY, help="Текст запроса")
+    parser.add_argument('--k', type=int, default=5)
+    args = parser.parse_args()
+
+    version = get_current_version()
+    if version is None:
+        raise SystemExit("Активная версия индексов не найдена: сначала выполните AI/build_index.py")
+    bundle_path = os.path.join(INDEX_BUNDLES_DIR, version)
+    bundle_files = [os.path.join(bundle_path, name) for name in os.listdir(bundle_path)]
+    with open(os.path.join(bundle_path, BUNDLE_MANIFEST_NAME), 'r', encoding='utf-8') as f:
+        if not verify_bundle(bundle_path, json.load(f)):
+            raise SystemExit(f"Версия {version} не прошла проверку контрольных сумм")
+
+    print(f"Версия {version}, рабочих процессов: {args.workers}")
+    print(f"{'mmap':<6}{'запуск':<18}{'файлов mmap':>12}{'загрузка, с':>13}{'1-й, мс':>10}{'2-й, мс':>10}"
+          f"{'RSS, МБ':>10}{'PSS, МБ':>10}{'общая, МБ':>11}{'индексы, МБ':>13}")
+    for use_mmap in args.mmap:
+        for label, warmup in (('холодный', 'none'), (f'теплый ({args.warmup})', args.warmup)):
+            if warmup == 'none':
+                evict_from_page_cache(bundle_files)
+            for m in run_workers(args.workers, bool(use_mmap), warmup, args.query, args.k):
+                print(f"{'да' if use_mmap else 'нет':<6}{label:<18}{m['mapped']:>12}{m['load']:>13.2f}{m['first']:>10.2f}"
+                      f"{m['second']:>10.2f}{m['rss'] / 1024:>10.1f}{m['pss'] / 1024:>10.1f}{m['shared'] / 1024:>11.1f}"
+                      f"{m['index_rss'] / 1024:>13.1f}")
+
+
+if __name__ == '__main__':
+    main()
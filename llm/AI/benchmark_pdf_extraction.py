@@ -0,0 +1,40 @@
+"""
+Сравнение скорости извлечения текста из PDF: pypdf и PyMuPDF (последовательно и в нескольких процессах).
+
+Запуск (из каталога llm):
+    PYTHONPATH=. python AI/benchmark_pdf_extraction.py medical_books/cardiology/*.pdf --workers 1 4
+"""
+import argparse
+import time
+from pdf_extraction import extract_pages_pymupdf, extract_pages_pypdf
+
+
+def measure(pages) -> tuple:
+    """Возвращает количество страниц, символов и время извлечения"""
+    start = time.perf_counter()
+    page_count = 0
+    char_count = 0
+    for page in pages:
+        page_count += 1
+        char_count += len(page.page_content)
+    return page_count, char_count, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение способов извлечения текста из PDF")
+    parser.add_argument('pdf_paths', nargs='+', help="PDF файлы для сравнения")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4], help="Количество процессов PyMuPDF")
+    args = parser.parse_args()
+
+    print(f"{'файл / способ':<50}{'страниц':>9}{'символов':>12}{'сек':>9}{'стр/сек':>10}")
+    for pdf_path in args.pdf_paths:
+        runs = [("pypdf", extract_pages_pypdf(pdf_path))]
+        runs += [(f"pymupdf x{workers}", extract_pages_pymupdf(pdf_path, workers)) for workers in args.workers]
+        for name, pages in runs:
+            page_count, char_count, elapsed = measure(pages)
+            label = f"{pdf_path[-35:]} / {name}"
+            print(f"{label:<50}{page_count:>9}{char_count:>12}{elapsed:>9.2f}{page_count / max(elapsed, 1e-9):>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
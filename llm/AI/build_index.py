@@ -0,0 +1,56 @@
+"""
+Офлайн-сборка индексов: medical_books/ → версия индексов в index_bundles/.
+
+Шарды в vector_stores/ служат кешем сборки: перестраиваются только новые и измененные книги.
+Сервер загружает только готовую версию: сборка выполняется на отдельной машине, а версия
+поставляется на сервер архивом (--archive) или общим томом с каталогом index_bundles/.
+
+Запуск (из каталога llm):
+    PYTHONPATH=. python AI/build_index.py --keep 3 --archive dist
+
+Архив dist/<версия>.tar.gz публикуется там, откуда его может скачать сервер; при запуске сервер
+устанавливает его командой AI/fetch_index_bundle.py (адрес архива задается в INDEX_BUNDLE_URL).
+"""
+import argparse
+from pdf_processor import (
+    PDF_CATEGORIES, load_and_process_pdfs, load_category_manifest, get_build_params, get_category_index_name
+)
+from index_bundle import INDEX_BUNDLES_DIR, build_bundle, activate_version, prune_bundles, archive_bundle
+
+
+def collect_build_info(categories) -> dict:
+    """Параметры сборки и хеши исходных файлов каждой категории"""
+    build_info = {"params": get_build_params(), "categories": {}}
+    for category in categories:
+        manifest = load_category_manifest(category)
+        build_info["categories"][category] = {
+            "index_name": get_category_index_name(category),
+            "sources": {file_name: entry["hash"] for file_name, entry in sorted(manifest["shards"].items())},
+        }
+    return build_info
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сборка версии индексов из medical_books/")
+    parser.add_argument('--output', default=INDEX_BUNDLES_DIR, help="Каталог версий индексов")
+    parser.add_argument('--keep', type=int, default=0, help="Сколько последних версий хранить (0 - все)")
+    parser.add_argument('--no-activate', action='store_true', help="Не делать собранную версию активной")
+    parser.add_argument('--archive', metavar='DIR', help="Упаковать версию в DIR/<версия>.tar.gz для поставки на сервер")
+    args = parser.parse_args()
+
+    vector_stores = load_and_process_pdfs()
+    if not vector_stores:
+        raise SystemExit("Нет данных для сборки: PDF файлы не найдены или не содержат текста")
+
+    version = build_bundle(vector_stores, collect_build_info(PDF_CATEGORIES), args.output)
+    if not args.no_activate:
+        activate_version(version, args.output)
+    if args.keep:
+        prune_bundles(args.keep, args.output)
+    if args.archive:
+        print(archive_bundle(version, args.archive, args.output))
+    print(version)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+import os
+import numpy as np
+from typing import Dict, Iterable, List, Optional
+from logging_config import setup_logger
+
+# Инициализация логгера
+rag_logger = setup_logger('category_router', 'RAG_LOGGING')
+
+# Маршрутизация запроса: поиск только в категориях, наиболее близких к запросу
+RAG_ROUTE_TOP_M = int(os.getenv('RAG_ROUTE_TOP_M', '3'))  # Сколько категорий искать (0 - без ограничения)
+# Категории, сходство которых с запросом ниже лучшей больше чем на порог, не ищутся (0 - не используется)
+RAG_ROUTE_THRESHOLD = float(os.getenv('RAG_ROUTE_THRESHOLD', '0'))
+RAG_ROUTE_EXEMPLARS = int(os.getenv('RAG_ROUTE_EXEMPLARS', '16'))  # Векторов-образцов на категорию (центры k-means)
+
+ROUTES_FILE_NAME = "category_routes.npy"  # Центроиды и образцы категорий подряд, в порядке категорий
+KMEANS_ITERATIONS = 20
+KMEANS_SEED = 1
+KMEANS_MAX_POINTS_PER_CENTER = 256  # Больше точек на центр для обучения не берется (как в faiss)
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    """L2-нормализация строк (сходство считается косинусное независимо от EMBEDDINGS_NORMALIZE)"""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return (vectors / np.maximum(norms, 1e-12)).astype(np.float32)
+
+
+def spherical_kmeans(vectors: np.ndarray, k: int, iterations: int = KMEANS_ITERATIONS,
+                     seed: int = KMEANS_SEED) -> np.ndarray:
+    """Сферический k-means по нормализованным векторам; возвращает нормализованные центры"""
+    generator = np.random.default_rng(seed)
+    if len(vectors) > k * KMEANS_MAX_POINTS_PER_CENTER:
+        vectors = vectors[generator.choice(len(vectors), size=k * KMEANS_MAX_POINTS_PER_CENTER, replace=False)]
+    centers = vectors[generator.choice(len(vectors), size=k, replace=False)]
+    for _ in range(iterations):
+        assignment = np.argmax(vectors @ centers.T, axis=1)
+        sums = np.zeros_like(centers)
+        np.add.at(sums, assignment, vectors)
+        empty = np.bincount(assignment, minlength=k) == 0
+        sums[empty] = centers[empty]  # Пустой кластер сохраняет прежний центр
+        centers = _normalize(sums)
+    return centers
+
+
+def build_category_routes(matrix: np.ndarray, ranges: Dict[str, List[int]],
+                          exemplars: int = RAG_ROUTE_EXEMPLARS) -> Dict[str, np.ndarray]:
+    """
+    Вычисляет при сборке векторы маршрутизации каждой категории: центроид и образцы.
+
+    Образцы — центры сферического k-means по векторам категории: они покрывают разные темы
+    категории, которые усредненный центроид смазывает.
+
+    Аргументы:
+    - matrix: Векторы общего индекса.
+    - ranges: Диапазоны идентификаторов категорий {категория: [начало, конец)}.
+    - exemplars: Количество образцов на категорию.
+
+    Возвращает:
+    - Векторы маршрутизации по категориям {категория: матрица, первая строка — центроид}.
+    """
+    routes = {}
+    for category, (start, end) in ranges.items():
+        vectors = _normalize(matrix[start:end])
+        if not len(vectors):
+            continue
+        centroid = _normalize(vectors.mean(axis=0, keepdims=True))
+        samples = spherical_kmeans(vectors, exemplars) if len(vectors) > exemplars else vectors
+        routes[category] = np.vstack([centroid, samples])
+    rag_logger.info(f"Векторы маршрутизации: {len(routes)} категорий, до {exemplars} образцов в каждой")
+    return routes
+
+
+def save_category_routes(routes: Dict[str, np.ndarray], directory: str) -> dict:
+    """Сохраняет векторы маршрутизации; возвращает описание для манифеста версии"""
+    np.save(os.path.join(directory, ROUTES_FILE_NAME), np.vstack(list(routes.values())))
+    return {
+        "file": ROUTES_FILE_NAME,
+        "counts": {category: len(vectors) for category, vectors in routes.items()},
+    }
+
+
+class CategoryRouter:
+    """
+        Выбор категорий для поиска по сходству запроса с центроидами и образцами категорий.
+
+        Сходство запроса с категорией — наибольшее косинусное сходство с ее векторами; ищутся
+        RAG_ROUTE_TOP_M лучших категорий, дополнительно отсекаются категории, отстающие от лучшей
+        больше чем на RAG_ROUTE_THRESHOLD.
+    """
+
+    def __init__(self, routes: Dict[str, np.ndarray], top_m: int = RAG_ROUTE_TOP_M,
+                 threshold: float = RAG_ROUTE_THRESHOLD):
+        self.categories = list(routes)
+        self.vectors = np.vstack(list(routes.values())) if routes else np.zeros((0, 0), dtype=np.float32)
+        self.labels = np.repeat(np.arange(len(routes)), [len(vectors) for vectors in routes.values()])
+        self.top_m = top_m
+        self.threshold = threshold
+
+    @classmethod
+    def load(cls, directory: str, routing_info: dict, **kwargs) -> 'CategoryRouter':
+        """Загружает векторы маршрутизации версии индексов"""
+        vectors = np.load(os.path.join(directory, routing_info["file"]))
+        routes, start = {}, 0
+        for category, count in routing_info["counts"].items():
+            routes[category] = vectors[start:start + count]
+            start += count
+        return cls(routes, **kwargs)
+
+    @property
+    def enabled(self) -> bool:
+        return len(self.categories) > 0 and (self.top_m > 0 or self.threshold > 0)
+
+    def scores(self, query_vector: np.ndarray) -> Dict[str, float]:
+        """Сходство запроса с каждой категорией"""
+        similarities = self.vectors @ _normalize(np.asarray(query_vector, dtype=np.float32).reshape(1, -1))[0]
+        best = np.full(len(self.categories), -np.inf, dtype=np.float32)
+        np.maximum.at(best, self.labels, similarities)
+        return {category: float(best[i]) for i, category in enumerate(self.categories)}
+
+    def route(self, query_vector: np.ndarray, categories: Optional[Iterable[str]] = None) -> List[str]:
+        """
+        Категории для поиска по убыванию сходства с запросом.
+
+        Аргументы:
+        - query_vector: Эмбеддинг запроса.
+        - categories: Доступные категории (по умолчанию все). Категории без векторов маршрутизации
+          (например, добавленные без пересборки) ищутся всегда.
+        """
+        categories = list(categories) if categories is not None else self.categories
+        if not self.enabled:
+            return categories
+        scores = self.scores(query_vector)
+        known = sorted((c for c in categories if c in scores), key=lambda category: scores[category], reverse=True)
+        if not known:
+            return categories
+        selected = known[:self.top_m] if self.top_m > 0 else known
+        if self.threshold > 0:
+            best = scores[known[0]]
+            selected = [category for category in selected if best - scores[category] <= self.threshold]
+        return selected + [category for category in categories if category not in scores]
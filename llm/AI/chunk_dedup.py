@@ -0,0 +1,144 @@
+import os
+import re
+import zlib
+import numpy as np
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Iterable, Iterator, List, Tuple
+from langchain_core.documents import Document
+from logging_config import setup_logger
+
+# Инициализация логгера
+pdf_logger = setup_logger('chunk_dedup', 'PDF_PROCESSING_LOGGING')
+
+# Параметры поиска почти одинаковых чанков (MinHash + LSH)
+CHUNK_DEDUP_ENABLED = bool(int(os.getenv('CHUNK_DEDUP_ENABLED', '1')))
+CHUNK_DEDUP_THRESHOLD = float(os.getenv('CHUNK_DEDUP_THRESHOLD', '0.85'))  # Порог сходства Жаккара
+CHUNK_DEDUP_NUM_PERM = int(os.getenv('CHUNK_DEDUP_NUM_PERM', '64'))  # Количество хеш-функций MinHash
+CHUNK_DEDUP_SHINGLE_WORDS = int(os.getenv('CHUNK_DEDUP_SHINGLE_WORDS', '3'))  # Длина шингла в словах
+
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+MINHASH_SEED = 1  # Фиксированное зерно: подписи совпадают во всех процессах и запусках
+
+
+def get_dedup_params() -> dict:
+    """Параметры дедупликации (входят в параметры сборки индекса)"""
+    return {
+        "enabled": CHUNK_DEDUP_ENABLED,
+        "threshold": CHUNK_DEDUP_THRESHOLD,
+        "num_perm": CHUNK_DEDUP_NUM_PERM,
+        "shingle_words": CHUNK_DEDUP_SHINGLE_WORDS,
+    }
+
+
+def shingle_hashes(text: str, shingle_words: int = CHUNK_DEDUP_SHINGLE_WORDS) -> np.ndarray:
+    """Хеши шинглов (последовательностей слов) текста без учета регистра"""
+    words = re.findall(r'\w+', text.lower())
+    if len(words) <= shingle_words:
+        shingles = {' '.join(words)}
+    else:
+        shingles = {' '.join(words[i:i + shingle_words]) for i in range(len(words) - shingle_words + 1)}
+    return np.fromiter((zlib.crc32(s.encode('utf-8')) for s in shingles), dtype=np.uint64, count=len(shingles))
+
+
+def lsh_params(threshold: float, num_perm: int) -> Tuple[int, int]:
+    """
+    Подбирает количество полос и строк LSH.
+
+    Пара кандидатов попадает в одну корзину с вероятностью 1 - (1 - s^r)^b; порог этой
+    S-образной кривой примерно равен (1/b)^(1/r) и подбирается ближайшим к заданному.
+    """
+    candidates = [(bands, num_perm // bands) for bands in range(1, num_perm + 1)]
+    return min(candidates, key=lambda params: abs((1 / params[0]) ** (1 / params[1]) - threshold))
+
+
+class NearDuplicateFilter:
+    """
+        Фильтр почти одинаковых текстов: MinHash-подписи и LSH-корзины по полосам подписи.
+
+        Кандидаты из общих корзин проверяются по оценке сходства Жаккара (доля совпавших
+        значений подписи); текст считается дубликатом, если оценка не ниже порога.
+    """
+
+    def __init__(self, threshold: float = CHUNK_DEDUP_THRESHOLD, num_perm: int = CHUNK_DEDUP_NUM_PERM,
+                 shingle_words: int = CHUNK_DEDUP_SHINGLE_WORDS):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_words = shingle_words
+        self.bands, self.rows = lsh_params(threshold, num_perm)
+        generator = np.random.RandomState(MINHASH_SEED)
+        self._a = generator.randint(1, 1 << 32, size=num_perm, dtype=np.uint64)
+        self._b = generator.randint(0, 1 << 32, size=num_perm, dtype=np.uint64)
+        self._buckets = defaultdict(list)
+        self._signatures: List[np.ndarray] = []
+
+    def signature(self, text: str) -> np.ndarray:
+        """MinHash-подпись текста"""
+        hashes = shingle_hashes(text, self.shingle_words)
+        permuted = (hashes[:, None] * self._a + self._b) % MERSENNE_PRIME & MAX_HASH
+        return permuted.min(axis=0)
+
+    def _band_keys(self, signature: np.ndarray) -> Iterator[Tuple[int, bytes]]:
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def find_duplicate(self, signature: np.ndarray) -> int:
+        """Индекс ранее добавленного почти одинакового текста (-1, если такого нет)"""
+        checked = set()
+        for key in self._band_keys(signature):
+            for index in self._buckets.get(key, ()):
+                if index in checked:
+                    continue
+                checked.add(index)
+                if np.mean(self._signatures[index] == signature) >= self.threshold:
+                    return index
+        return -1
+
+    def add(self, signature: np.ndarray):
+        """Добавляет подпись в индекс LSH"""
+        index = len(self._signatures)
+        self._signatures.append(signature)
+        for key in self._band_keys(signature):
+            self._buckets[key].append(index)
+
+    def is_duplicate(self, text: str) -> bool:
+        """Проверяет текст; уникальный текст добавляется в индекс"""
+        signature = self.signature(text)
+        if self.find_duplicate(signature) >= 0:
+            return True
+        self.add(signature)
+        return False
+
+
+@dataclass
+class DedupStats:
+    """Счетчики дедупликации чанков"""
+    seen: int = 0
+    dropped: int = 0
+    dropped_tokens: int = 0
+    dropped_text_bytes: int = 0
+
+
+def dedup_chunks(chunks: Iterable[Document], dedup_filter: NearDuplicateFilter, stats: DedupStats) -> Iterator[Document]:
+    """Этап конвейера: пропускает дальше только чанки, не похожие на уже пропущенные"""
+    for chunk in chunks:
+        stats.seen += 1
+        if dedup_filter.is_duplicate(chunk.page_content):
+            stats.dropped += 1
+            stats.dropped_tokens += chunk.metadata.get('token_count', 0)
+            stats.dropped_text_bytes += len(chunk.page_content.encode('utf-8'))
+            continue
+        yield chunk
+
+
+def log_dedup_savings(source: str, stats: DedupStats, dim: int, tokens_per_second: float):
+    """Логирует экономию: размер индекса и время вычисления эмбеддингов отброшенных чанков"""
+    if not stats.seen:
+        return
+    index_bytes = stats.dropped * dim * 4
+    pdf_logger.info(
+        f"{source}: отброшено {stats.dropped} из {stats.seen} чанков ({stats.dropped / stats.seen:.1%}) как почти одинаковые; "
+        f"экономия индекса ~{(index_bytes + stats.dropped_text_bytes) / 2**20:.2f} МБ, "
+        f"времени эмбеддингов ~{stats.dropped_tokens / max(tokens_per_second, 1e-9):.1f} сек"
+    )
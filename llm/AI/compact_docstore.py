@@ -0,0 +1,220 @@
+import os
+import json
+import mmap
+import pickle
+import numpy as np
+from collections.abc import Mapping
+import itertools
+from typing import Dict, Iterable, Iterator, List, Tuple, Union
+from langchain_community.docstore.base import Docstore
+from langchain_core.documents import Document
+from logging_config import setup_logger
+
+# Инициализация логгера
+file_logger = setup_logger('compact_docstore', 'FILE_OPERATIONS_LOGGING')
+
+COMPACT_DOCSTORE_FORMAT = 1
+HEADER_SUFFIX = ".docs.json"  # Схема таблицы: количество чанков, столбцы метаданных и их словари
+TABLE_SUFFIX = ".docs.npy"  # Таблица int64 по столбцам: смещение, длина, столбцы метаданных
+TEXT_SUFFIX = ".text"  # Тексты страниц UTF-8, каждая страница один раз
+SPAN_COLUMNS = 2  # Первые строки таблицы: смещение и длина чанка в байтах
+MISSING_CODE = -1  # Код отсутствующего значения в словарном столбце
+OVERLAP_PROBE_CHARS = 64  # Длина начала чанка, по которому ищется перекрытие с предыдущим
+_MISSING = object()  # Ключ отсутствует в метаданных документа
+
+
+def compact_docstore_files(name: str) -> List[str]:
+    """Имена файлов компактного хранилища"""
+    return [name + HEADER_SUFFIX, name + TABLE_SUFFIX, name + TEXT_SUFFIX]
+
+
+def has_compact_docstore(directory: str, name: str) -> bool:
+    return os.path.exists(os.path.join(directory, name + HEADER_SUFFIX))
+
+
+def _find_overlap(text: str, chunk: str, search_from: int) -> int:
+    """Первая позиция не раньше search_from, с которой текст совпадает с началом чанка (-1, если такой нет)"""
+    probe = chunk[:OVERLAP_PROBE_CHARS]
+    position = text.find(probe, search_from)
+    while position >= 0:
+        if chunk.startswith(text[position:position + len(chunk)]):
+            return position
+        position = text.find(probe, position + 1)
+    # Хвост текста короче начала чанка
+    for position in range(max(search_from, len(text) - len(probe) + 1), len(text)):
+        if probe.startswith(text[position:]):
+            return position
+    return -1
+
+
+def pack_page(chunks: List[str]) -> Tuple[str, List[int]]:
+    """
+    Восстанавливает текст страницы из чанков, совмещая перекрытия соседних чанков.
+
+    Возвращает:
+    - Текст страницы и позиции начала чанков в нем (в символах). Если чанк не продолжает
+      текст (например, соседний чанк отброшен дедупликацией), он дописывается целиком.
+    """
+    text = ''
+    starts = []
+    search_from = 0
+    for chunk in chunks:
+        start = _find_overlap(text, chunk, search_from)
+        if start < 0:
+            start = len(text)
+        if start + len(chunk) > len(text):
+            text += chunk[len(text) - start:]
+        starts.append(start)
+        search_from = start
+    return text, starts
+
+
+def _encode_column(values: List) -> Tuple[np.ndarray, dict]:
+    """Столбец метаданных: целые значения хранятся как есть, остальные — кодами словаря JSON-значений"""
+    if all(type(value) is int for value in values):
+        return np.asarray(values, dtype=np.int64), {"type": "int"}
+    dictionary, codes = {}, []
+    for value in values:
+        if value is _MISSING:
+            codes.append(MISSING_CODE)
+            continue
+        key = json.dumps(value, ensure_ascii=False, sort_keys=True)
+        codes.append(dictionary.setdefault(key, len(dictionary)))
+    return np.asarray(codes, dtype=np.int64), {"type": "dict", "values": [json.loads(key) for key in dictionary]}
+
+
+def write_compact_docstore(directory: str, name: str, documents: Iterable[Document]) -> List[str]:
+    """
+    Записывает документы в компактное хранилище; порядок документов задает идентификаторы 0..N-1.
+
+    Чанки одной страницы (соседние документы с одинаковыми source и page) хранятся как участки
+    (смещение, длина) одного текста страницы, поэтому перекрытия не дублируются.
+
+    Возвращает:
+    - Имена записанных файлов.
+    """
+    unpaged = itertools.count()
+
+    def page_key(doc: Document):
+        # Документы без номера страницы не объединяются
+        page = doc.metadata.get('page')
+        return (doc.metadata.get('source'), page) if page is not None else next(unpaged)
+
+    offsets, lengths, metadatas = [], [], []
+    with open(os.path.join(directory, name + TEXT_SUFFIX), 'wb') as blob:
+        position = 0
+        for _, page_documents in itertools.groupby(documents, key=page_key):
+            page_documents = list(page_documents)
+            text, starts = pack_page([doc.page_content for doc in page_documents])
+            for doc, start in zip(page_documents, starts):
+                offsets.append(position + len(text[:start].encode('utf-8')))
+                lengths.append(len(doc.page_content.encode('utf-8')))
+                metadatas.append(doc.metadata)
+            encoded = text.encode('utf-8')
+            blob.write(encoded)
+            position += len(encoded)
+
+    keys = sorted({key for metadata in metadatas for key in metadata})
+    columns, schema = [np.asarray(offsets, dtype=np.int64), np.asarray(lengths, dtype=np.int64)], {}
+    for key in keys:
+        column, schema[key] = _encode_column([metadata.get(key, _MISSING) for metadata in metadatas])
+        columns.append(column)
+    table = np.vstack(columns) if metadatas else np.zeros((len(columns), 0), dtype=np.int64)
+    np.save(os.path.join(directory, name + TABLE_SUFFIX), np.ascontiguousarray(table))
+
+    header = {"format": COMPACT_DOCSTORE_FORMAT, "count": len(metadatas), "text_bytes": position, "columns": schema}
+    with open(os.path.join(directory, name + HEADER_SUFFIX), 'w', encoding='utf-8') as f:
+        json.dump(header, f, ensure_ascii=False)
+    file_logger.info(f"Компактное хранилище {name}: {len(metadatas)} чанков, текст {position / 2**20:.2f} МБ")
+    return compact_docstore_files(name)
+
+
+class PositionIds(Mapping):
+    """Отображение позиции вектора в идентификатор документа без словаря: идентификатор равен позиции"""
+
+    def __init__(self, count: int):
+        self.count = count
+
+    def __getitem__(self, position: int) -> int:
+        if not 0 <= position < self.count:
+            raise KeyError(position)
+        return position
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(range(self.count))
+
+    def __len__(self) -> int:
+        return self.count
+
+
+class CompactDocstore(Docstore):
+    """
+        Хранилище чанков только для чтения без pickle.
+
+        Тексты страниц и таблица отображаются в память, поэтому загрузка не создает объектов
+        для каждого чанка, а страницы разделяются рабочими процессами через кеш страниц.
+        Документ собирается только при обращении по идентификатору вектора.
+    """
+
+    def __init__(self, directory: str, name: str):
+        with open(os.path.join(directory, name + HEADER_SUFFIX), 'r', encoding='utf-8') as f:
+            header = json.load(f)
+        if header.get("format") != COMPACT_DOCSTORE_FORMAT:
+            raise ValueError(f"Неподдерживаемый формат компактного хранилища {name}: {header.get('format')}")
+        self.count = header["count"]
+        self.columns: Dict[str, dict] = header["columns"]
+        self._rows = {key: SPAN_COLUMNS + i for i, key in enumerate(self.columns)}
+        self.table = np.load(os.path.join(directory, name + TABLE_SUFFIX), mmap_mode='r')
+        self.text_path = os.path.join(directory, name + TEXT_SUFFIX)
+        self._blob = b''
+        if header["text_bytes"]:
+            with open(self.text_path, 'rb') as f:
+                self._blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._blob)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def text_bytes(self, position: int) -> memoryview:
+        """Текст чанка в UTF-8 без копирования"""
+        offset, length = int(self.table[0, position]), int(self.table[1, position])
+        return self._view[offset:offset + length]
+
+    def metadata(self, position: int) -> dict:
+        metadata = {}
+        for key, schema in self.columns.items():
+            value = int(self.table[self._rows[key], position])
+            if schema["type"] == "int":
+                metadata[key] = value
+            elif value != MISSING_CODE:
+                metadata[key] = schema["values"][value]
+        return metadata
+
+    def search(self, search) -> Union[str, Document]:
+        """Документ по идентификатору (позиции вектора в индексе); как в InMemoryDocstore, строка, если его нет"""
+        position = int(search)
+        if not 0 <= position < self.count:
+            return f"ID {search} not found."
+        return Document(page_content=str(self.text_bytes(position), 'utf-8'), metadata=self.metadata(position))
+
+
+def migrate_pickle_docstore(directory: str, name: str) -> Tuple[int, int]:
+    """
+    Переводит хранилище <name>.pkl (формат FAISS.save_local) в компактный формат и проверяет,
+    что все документы восстанавливаются без изменений.
+
+    Возвращает:
+    - Размеры хранилища до и после перевода в байтах.
+    """
+    pickle_path = os.path.join(directory, f"{name}.pkl")
+    with open(pickle_path, 'rb') as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    documents = [docstore.search(index_to_docstore_id[position]) for position in range(len(index_to_docstore_id))]
+    files = write_compact_docstore(directory, name, documents)
+
+    compact = CompactDocstore(directory, name)
+    for position, doc in enumerate(documents):
+        restored = compact.search(position)
+        if restored.page_content != doc.page_content or restored.metadata != doc.metadata:
+            raise ValueError(f"Документ {position} хранилища {name} восстановлен с изменениями")
+    return os.path.getsize(pickle_path), sum(os.path.getsize(os.path.join(directory, file)) for file in files)
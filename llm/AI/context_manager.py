@@ -1,85 +1,257 @@
-from typing import Dict
+import os
+import heapq
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
 from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
 from medical_analyzer import MedicalContextAnalyzer, SearchResult
 from text_preprocessing import clean_text
+from chunk_dedup import NearDuplicateFilter
+from category_router import CategoryRouter
+from retrieval_client import RETRIEVAL_SIDECAR_URL, get_retrieval_client
 from logging_config import setup_logger
 
+if TYPE_CHECKING:
+    from unified_index import UnifiedIndex
+
 # Инициализация логгеров
 rag_logger = setup_logger('context_manager', 'RAG_LOGGING')
 file_logger = setup_logger('context_manager_file', 'FILE_OPERATIONS_LOGGING')
 
-def get_relevant_context(query: str, vector_stores: Dict[str, FAISS], n_results: int = 5) -> str:
+# Потоков для параллельного поиска по хранилищам категорий (FAISS освобождает GIL на время поиска)
+RAG_SEARCH_THREADS = int(os.getenv('RAG_SEARCH_THREADS', '8'))
+
+# Общий пул поиска процесса: одновременные запросы не создают собственных потоков
+_search_pool = ThreadPoolExecutor(max_workers=max(RAG_SEARCH_THREADS, 1), thread_name_prefix='rag-search')
+
+def _embed_query(clean_query: str):
+    """Эмбеддинг запроса (модель импортируется при первом локальном поиске: процессы API,
+    работающие через сервис поиска, не загружают torch)"""
+    from embeddings_handler import CustomEmbeddings
+    return CustomEmbeddings().embed_query_vector(clean_query)
+
+def _embed_queries(clean_queries: List[str]) -> np.ndarray:
+    """Эмбеддинги пакета запросов одним проходом модели"""
+    from embeddings_handler import CustomEmbeddings
+    return CustomEmbeddings().embed_queries_matrix(clean_queries)
+
+def _search_category(category: str, store: FAISS, query_vector, k: int) -> List[Tuple[Document, float, str]]:
+    """Поиск в хранилище одной категории по готовому эмбеддингу запроса"""
+    try:
+        results = store.similarity_search_with_score_by_vector(query_vector, k=k)
+        rag_logger.info(f"Поиск в категории '{category}': получено {len(results)} результатов")
+        return [(doc, score, category) for doc, score in results]
+    except Exception as e:
+        rag_logger.error(f"Ошибка при поиске в категории {category}: {e}")
+        return []
+
+def _search_per_category(clean_query: str, vector_stores: Dict[str, FAISS], k: int) -> List[Tuple[Document, float, str]]:
+    """
+    Поиск во всех хранилищах категорий: эмбеддинг запроса вычисляется один раз, категории
+    ищутся параллельно в общем пуле, частичные результаты объединяются в глобальный top-k.
+    """
+    if not vector_stores:
+        return []
+    try:
+        query_vector = _embed_query(clean_query)
+    except Exception as e:
+        rag_logger.error(f"Ошибка при вычислении эмбеддинга запроса: {e}")
+        return []
+    futures = [_search_pool.submit(_search_category, category, store, query_vector, k)
+               for category, store in vector_stores.items()]
+    # Результаты каждой категории уже упорядочены по расстоянию: слияние через кучу
+    merged = heapq.merge(*(future.result() for future in futures), key=lambda candidate: candidate[1])
+    return [candidate for _, candidate in zip(range(k), merged)]
+
+def _search_unified(clean_query: str, unified_index: 'UnifiedIndex', k: int,
+                    categories: Optional[List[str]] = None) -> List[Tuple[Document, float, str]]:
+    """Один эмбеддинг запроса и один поиск по общему индексу (всех или выбранных категорий)"""
+    try:
+        query_vector = _embed_query(clean_query)
+        candidates = unified_index.search(query_vector, k, categories=categories)
+        rag_logger.info(f"Поиск по общему индексу: получено {len(candidates)} результатов")
+        return candidates
+    except Exception as e:
+        rag_logger.error(f"Ошибка при поиске по общему индексу: {e}")
+        return []
+
+def _route_categories(clean_query: str, router: Optional[CategoryRouter], categories: List[str]) -> List[str]:
+    """Категории, наиболее близкие к запросу (при ошибке маршрутизации — все категории)"""
+    if router is None or not router.enabled:
+        return categories
+    try:
+        # Эмбеддинг запроса кешируется и повторно используется при поиске
+        selected = router.route(_embed_query(clean_query), categories)
+        rag_logger.info(f"Маршрутизация: поиск в {len(selected)} из {len(categories)} категорий: {', '.join(selected)}")
+        return selected
+    except Exception as e:
+        rag_logger.error(f"Ошибка при выборе категорий для поиска: {e}")
+        return categories
+
+def search_chunks(clean_query: str, k: int, vector_stores: Optional[Dict[str, FAISS]] = None,
+                  unified_index: Optional['UnifiedIndex'] = None,
+                  categories: Optional[List[str]] = None) -> List[Tuple[Document, float, str]]:
+    """
+    Кандидаты поиска: (документ, расстояние L2, категория).
+
+    Возвращается глобальный top-k по возрастанию расстояния (и по общему индексу, и по хранилищам категорий).
+    """
+    if unified_index is not None:
+        return _search_unified(clean_query, unified_index, k, categories)
+    stores = vector_stores or {}
+    if categories is not None:
+        stores = {category: stores[category] for category in categories if category in stores}
+    return _search_per_category(clean_query, stores, k)
+
+def _search_category_batch(category: str, store: FAISS, query_vectors: np.ndarray,
+                           k: int) -> List[List[Tuple[Document, float, str]]]:
+    """Один поиск в хранилище категории по матрице запросов; для каждого запроса — результаты по возрастанию расстояния"""
+    try:
+        queries = np.ascontiguousarray(query_vectors, dtype=np.float32)
+        all_distances, all_ids = store.index.search(queries, k)
+        batch_results = []
+        for distances, ids in zip(all_distances, all_ids):
+            results = []
+            for distance, position in zip(distances, ids):
+                if position < 0:
+                    continue
+                doc = store.docstore.search(store.index_to_docstore_id[int(position)])
+                if isinstance(doc, Document):
+                    results.append((doc, float(distance), category))
+            batch_results.append(results)
+        rag_logger.info(f"Пакетный поиск в категории '{category}': {len(queries)} запросов")
+        return batch_results
+    except Exception as e:
+        rag_logger.error(f"Ошибка при пакетном поиске в категории {category}: {e}")
+        return [[] for _ in range(len(query_vectors))]
+
+def search_chunks_batch(clean_queries: List[str], k: int, vector_stores: Optional[Dict[str, FAISS]] = None,
+                        unified_index: Optional['UnifiedIndex'] = None,
+                        categories: Optional[List[str]] = None) -> List[List[Tuple[Document, float, str]]]:
+    """
+    Пакетный поиск для оценки и массовой обработки запросов.
+
+    Эмбеддинги всех запросов вычисляются одним проходом модели, каждый индекс ищется один раз
+    матрицей запросов (nq × d). Маршрутизация по категориям не выполняется: категории общие для пакета.
+
+    Аргументы:
+    - clean_queries: Очищенные запросы (clean_text).
+    - k: Количество результатов на запрос.
+    - vector_stores: Хранилища категорий (используются, если не задан общий индекс).
+    - unified_index: Общий индекс всех категорий.
+    - categories: Категории для поиска (по умолчанию все).
+
+    Возвращает:
+    - Для каждого запроса глобальный top-k (документ, расстояние L2, категория) по возрастанию расстояния.
+    """
+    if not clean_queries:
+        return []
+    try:
+        query_vectors = _embed_queries(clean_queries)
+    except Exception as e:
+        rag_logger.error(f"Ошибка при вычислении эмбеддингов пакета запросов: {e}")
+        return [[] for _ in clean_queries]
+    rag_logger.info(f"Пакетный поиск: {len(clean_queries)} запросов, k={k}")
+
+    if unified_index is not None:
+        try:
+            return unified_index.search_batch(query_vectors, k, categories=categories)
+        except Exception as e:
+            rag_logger.error(f"Ошибка при пакетном поиске по общему индексу: {e}")
+            return [[] for _ in clean_queries]
+
+    stores = vector_stores or {}
+    if categories is not None:
+        stores = {category: stores[category] for category in categories if category in stores}
+    futures = [_search_pool.submit(_search_category_batch, category, store, query_vectors, k)
+               for category, store in stores.items()]
+    per_category = [future.result() for future in futures]
+    return [
+        [candidate for _, candidate in zip(range(k), heapq.merge(*(results[i] for results in per_category),
+                                                                  key=lambda candidate: candidate[1]))]
+        for i in range(len(clean_queries))
+    ]
+
+def _score_candidate(doc: Document, score: float, category: str, analyzer: MedicalContextAnalyzer,
+                     clean_query: str, query_terms: List[str]) -> SearchResult:
+    """Вычисляет итоговую релевантность найденного фрагмента"""
+    # Нормализуем score из FAISS (меньше = лучше) в релевантность (больше = лучше)
+    base_relevance = 1 / (1 + score)  # Преобразование значения из диапазона (0, ∞) в (0, 1]
+
+    # Извлечение медицинских терминов из текста документа
+    medical_terms = analyzer.find_medical_terms(doc.page_content)
+    medical_relevance = analyzer.calculate_medical_relevance(
+        doc.page_content, clean_query, # Оценка релевантности текста запросу
+        text_terms=medical_terms, query_terms=query_terms # Термины уже найдены: текст не сканируется повторно
+    )
+
+    # Итоговая оценка релевантности как взвешенная сумма
+    final_score = (base_relevance * 0.7) + (medical_relevance * 0.3)
+
+    rag_logger.info(
+        f"\nНайден релевантный фрагмент:"
+        f"\nКатегория: {category}"
+        f"\nБазовая релевантность: {base_relevance:.2%}"
+        f"\nМедицинская релевантность: {medical_relevance:.2%}"
+        f"\nИтоговая релевантность: {final_score:.2%}"
+        f"\nНайденные термины: {', '.join(medical_terms)}"
+        f"\nИсточник: стр. {doc.metadata.get('page', 'н/д')}"
+    )
+
+    # Создание объекта результата
+    return SearchResult(
+        category=category,
+        content=doc.page_content,
+        metadata=doc.metadata,
+        score=final_score,
+        medical_terms=medical_terms
+    )
+
+def get_relevant_context(query: str, vector_stores: Optional[Dict[str, FAISS]] = None, n_results: int = 5,
+                         unified_index: Optional['UnifiedIndex'] = None,
+                         router: Optional[CategoryRouter] = None) -> str:
     """
     Получает релевантный контекст из векторных хранилищ.
 
     Аргументы:
     - query: Запрос пользователя.
     - vector_stores: Словарь векторных хранилищ, где ключ — категория, значение — объект FAISS.
+      Если индексы не переданы и задан RETRIEVAL_SIDECAR_URL, контекст запрашивается у сервиса поиска.
     - n_results: Количество релевантных результатов для возврата.
+    - unified_index: Общий индекс всех категорий; если задан, выполняется один поиск с глобальным top-k.
+    - router: Выбор категорий по сходству запроса с их центроидами; если задан, ищутся только ближайшие категории.
 
     Возвращает:
     - Итоговый текст релевантного контекста.
     """
+    if vector_stores is None and unified_index is None:
+        if RETRIEVAL_SIDECAR_URL:
+            try:
+                return get_retrieval_client().context(query, n_results)
+            except Exception as e:
+                rag_logger.error(f"Ошибка при запросе контекста у сервиса поиска: {e}")
+                return ""
+        vector_stores = {}
+
     analyzer = MedicalContextAnalyzer() # Инициализация анализатора медицинского контекста
-    all_results = [] # Список всех найденных результатов
-    
+    categories = unified_index.categories if unified_index is not None else list(vector_stores.keys())
+
     rag_logger.info(f"\n{'='*50}\nПоиск контекста для запроса: {query}")
     rag_logger.info(f"Количество запрашиваемых результатов: {n_results}")
-    rag_logger.info(f"Доступные категории: {', '.join(vector_stores.keys())}")
-    
+    rag_logger.info(f"Доступные категории: {', '.join(categories)}")
+
     # Очистка и предобработка запроса
     clean_query = clean_text(query)  # Удаление лишних символов и приведение к стандартному виду
     query_terms = analyzer.find_medical_terms(clean_query) # Извлечение медицинских терминов из запроса
     rag_logger.info(f"Очищенный запрос: {clean_query}")
     rag_logger.info(f"Найденные медицинские термины: {', '.join(query_terms)}")
 
-    # Поиск контекста в каждой категории
-    for category, store in vector_stores.items():
-        try:
-            rag_logger.info(f"\nПоиск в категории '{category}':")
-            # Получение кандидатов результатов (с запасом для фильтрации)
-            results = store.similarity_search_with_score(clean_query, k=n_results * 2)
-            rag_logger.info(f"Получено {len(results)} результатов")
-
-            # Обработка каждого результата
-            for doc, score in results:
-                # Нормализуем score из FAISS (меньше = лучше) в релевантность (больше = лучше)
-                base_relevance = 1 / (1 + score)  # Преобразование значения из диапазона (0, ∞) в (0, 1]
-                
-                # Извлечение медицинских терминов из текста документа
-                medical_terms = analyzer.find_medical_terms(doc.page_content)
-                medical_relevance = analyzer.calculate_medical_relevance(
-                    doc.page_content, clean_query # Оценка релевантности текста запросу
-                )
-                
-                # Итоговая оценка релевантности как взвешенная сумма
-                final_score = (base_relevance * 0.7) + (medical_relevance * 0.3)
-
-                # Создание объекта результата
-                result = SearchResult(
-                    category=category,
-                    content=doc.page_content,
-                    metadata=doc.metadata,
-                    score=final_score,
-                    medical_terms=medical_terms
-                )
-                
-                rag_logger.info(
-                    f"\nНайден релевантный фрагмент:"
-                    f"\nБазовая релевантность: {base_relevance:.2%}"
-                    f"\nМедицинская релевантность: {medical_relevance:.2%}"
-                    f"\nИтоговая релевантность: {final_score:.2%}"
-                    f"\nНайденные термины: {', '.join(medical_terms)}"
-                    f"\nИсточник: стр. {doc.metadata.get('page', 'н/д')}"
-                )
-
-                # Добавление результата в общий список
-                all_results.append(result)
-                
-        except Exception as e:
-            rag_logger.error(f"Ошибка при поиске в категории {category}: {e}")
-            continue
-    
+    # Поиск кандидатов (с запасом для фильтрации) только в категориях, близких к запросу
+    categories = _route_categories(clean_query, router, categories)
+    candidates = search_chunks(clean_query, n_results * 2, vector_stores, unified_index, categories)
+    all_results = [_score_candidate(doc, score, category, analyzer, clean_query, query_terms) for doc, score, category in candidates]
+
     # Сортировка результатов по релевантности (по убыванию)
     all_results.sort(key=lambda x: x.score, reverse=True)
     
@@ -87,8 +259,19 @@ def get_relevant_context(query: str, vector_stores: Dict[str, FAISS], n_results:
     context = "\n\nРелевантная информация из медицинской литературы:\n"
     rag_logger.info(f"\n{'='*50}\nИтоговый контекст:")
 
+    # Один и тот же фрагмент может найтись в нескольких категориях: почти одинаковые пропускаем
+    duplicates_filter = NearDuplicateFilter()
+    selected_results = []
+    for result in all_results:
+        if len(selected_results) >= n_results:
+            break
+        if duplicates_filter.is_duplicate(result.content):
+            rag_logger.info(f"Пропущен повторяющийся фрагмент из раздела {result.category}")
+            continue
+        selected_results.append(result)
+
     # Добавление релевантных фрагментов в текст
-    for i, result in enumerate(all_results[:n_results], 1):
+    for i, result in enumerate(selected_results, 1):
         medical_terms_str = ', '.join(result.medical_terms) if result.medical_terms else 'не найдены'
 
         # Форматирование текста результата
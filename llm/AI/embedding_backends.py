@@ -0,0 +1,164 @@
+import os
+import multiprocessing
+import torch
+from typing import Dict
+from transformers import AutoModel
+from logging_config import setup_logger
+
+# Инициализация логгеров
+emb_logger = setup_logger('embedding_backends', 'EMBEDDINGS_LOGGING')
+file_logger = setup_logger('embedding_backends_file', 'FILE_OPERATIONS_LOGGING')
+
+# Выбор движка инференса: torch (fp32), torch_int8 (динамическая квантизация), onnx (ONNX Runtime)
+EMBEDDINGS_BACKEND = os.getenv('EMBEDDINGS_BACKEND', 'torch')
+EMBEDDINGS_NUM_THREADS = int(os.getenv('EMBEDDINGS_NUM_THREADS', '0'))  # Потоки внутри операций (0 - все ядра)
+ONNX_MODEL_DIR = os.getenv(
+    'ONNX_MODEL_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), 'onnx_models')
+)
+
+
+def set_default_num_threads(num_threads: int):
+    """Задает количество потоков для движков, создаваемых в текущем процессе (например, в процессе ингестии)"""
+    global EMBEDDINGS_NUM_THREADS
+    EMBEDDINGS_NUM_THREADS = num_threads
+
+
+def resolve_num_threads(num_threads: int = None) -> int:
+    """Определяет количество потоков для инференса (явное значение или число ядер)"""
+    num_threads = EMBEDDINGS_NUM_THREADS if num_threads is None else num_threads
+    return num_threads if num_threads > 0 else multiprocessing.cpu_count()
+
+
+class TorchBackend:
+    """Базовый движок: модель PyTorch в fp32"""
+    name = 'torch'
+
+    def __init__(self, model_name: str, num_threads: int):
+        """
+        Аргументы:
+        - model_name: Название модели HuggingFace.
+        - num_threads: Количество потоков внутри операций PyTorch.
+        """
+        torch.set_num_threads(num_threads)
+        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu") # Определение устройства (GPU/CPU)
+        self.model = AutoModel.from_pretrained(model_name) # Загрузка модели
+        self.model.to(self.device) # Перенос модели на выбранное устройство
+        self.model.eval() # Установка модели в режим оценки
+        self.hidden_size = self.model.config.hidden_size
+
+    def __call__(self, batch: Dict[str, torch.Tensor]) -> torch.Tensor:
+        """Возвращает скрытые состояния последнего слоя для пакета"""
+        with torch.no_grad(): # Отключение градиентов для ускорения
+            return self.model(**batch).last_hidden_state
+
+
+class QuantizedTorchBackend(TorchBackend):
+    """Модель PyTorch с динамической int8-квантизацией линейных слоев (только CPU)"""
+    name = 'torch_int8'
+
+    def __init__(self, model_name: str, num_threads: int):
+        torch.set_num_threads(num_threads)
+        self.device = torch.device("cpu")
+        model = AutoModel.from_pretrained(model_name)
+        model.eval()
+        self.model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.hidden_size = model.config.hidden_size
+
+
+class OnnxBackend:
+    """Модель, экспортированная в ONNX и исполняемая в ONNX Runtime (только CPU)"""
+    name = 'onnx'
+
+    def __init__(self, model_name: str, num_threads: int):
+        import onnxruntime as ort # Необязательная зависимость, нужна только для этого движка
+
+        self.device = torch.device("cpu")
+        model_path = self._export(model_name)
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = num_threads
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.input_names = [node.name for node in self.session.get_inputs()]
+        self.hidden_size = self.session.get_outputs()[0].shape[-1]
+
+    @staticmethod
+    def _export(model_name: str) -> str:
+        """Экспортирует модель в ONNX (один раз) и возвращает путь к файлу"""
+        model_dir = os.path.join(ONNX_MODEL_DIR, model_name.replace('/', '__'))
+        model_path = os.path.join(model_dir, 'model.onnx')
+        if os.path.exists(model_path):
+            return model_path
+
+        file_logger.info(f"Экспорт модели {model_name} в ONNX: {model_path}")
+        os.makedirs(model_dir, exist_ok=True)
+        model = AutoModel.from_pretrained(model_name)
+        model.eval()
+        dummy = {
+            'input_ids': torch.ones((1, 8), dtype=torch.long),
+            'attention_mask': torch.ones((1, 8), dtype=torch.long),
+            'token_type_ids': torch.zeros((1, 8), dtype=torch.long),
+        }
+        dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in dummy}
+        dynamic_axes['last_hidden_state'] = {0: 'batch', 1: 'sequence'}
+
+        # Запись во временный файл и атомарная замена, чтобы не оставить битый экспорт
+        tmp_path = model_path + '.tmp'
+        with torch.no_grad():
+            torch.onnx.export(
+                model,
+                (dummy,),
+                tmp_path,
+                input_names=list(dummy),
+                output_names=['last_hidden_state'],
+                dynamic_axes=dynamic_axes,
+                opset_version=14,
+            )
+        os.replace(tmp_path, model_path)
+        file_logger.info("Экспорт в ONNX завершен")
+        return model_path
+
+    def __call__(self, batch: Dict[str, torch.Tensor]) -> torch.Tensor:
+        """Возвращает скрытые состояния последнего слоя для пакета"""
+        feeds = {name: batch[name].cpu().numpy() for name in self.input_names if name in batch}
+        last_hidden_state = self.session.run(['last_hidden_state'], feeds)[0]
+        return torch.from_numpy(last_hidden_state)
+
+
+BACKENDS = {
+    TorchBackend.name: TorchBackend,
+    QuantizedTorchBackend.name: QuantizedTorchBackend,
+    OnnxBackend.name: OnnxBackend,
+}
+
+
+def create_embedding_backend(model_name: str, backend_name: str = None, num_threads: int = None):
+    """
+    Создает движок инференса модели эмбеддингов.
+
+    Аргументы:
+    - model_name: Название модели HuggingFace.
+    - backend_name: torch, torch_int8 или onnx (по умолчанию EMBEDDINGS_BACKEND).
+    - num_threads: Количество потоков внутри операций (по умолчанию EMBEDDINGS_NUM_THREADS).
+
+    Возвращает:
+    - Экземпляр движка. При ошибке создания выбранного движка используется torch.
+    """
+    backend_name = backend_name or EMBEDDINGS_BACKEND
+    num_threads = resolve_num_threads(num_threads)
+    backend_cls = BACKENDS.get(backend_name)
+    if backend_cls is None:
+        emb_logger.error(f"Неизвестный движок эмбеддингов '{backend_name}', используется {TorchBackend.name}")
+        backend_cls = TorchBackend
+
+    try:
+        backend = backend_cls(model_name, num_threads)
+    except Exception as e:
+        if backend_cls is TorchBackend:
+            raise
+        emb_logger.error(f"Не удалось создать движок {backend_cls.name}: {e}. Используется {TorchBackend.name}")
+        backend = TorchBackend(model_name, num_threads)
+
+    emb_logger.info(f"Движок эмбеддингов: {backend.name}, потоков: {num_threads}, устройство: {backend.device}")
+    return backend
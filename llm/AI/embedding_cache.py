@@ -0,0 +1,277 @@
+import os
+import atexit
+import sqlite3
+import hashlib
+import threading
+import time
+import numpy as np
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+from logging_config import setup_logger
+
+# Инициализация логгеров
+cache_logger = setup_logger('embedding_cache', 'EMBEDDINGS_LOGGING')
+
+# Параметры дискового кеша эмбеддингов
+EMBEDDING_CACHE_ENABLED = bool(int(os.getenv('EMBEDDING_CACHE_ENABLED', '1')))
+EMBEDDING_CACHE_PATH = os.getenv(
+    'EMBEDDING_CACHE_PATH',
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), 'embedding_cache', 'embeddings.sqlite')
+)
+EMBEDDING_CACHE_MAX_MB = int(os.getenv('EMBEDDING_CACHE_MAX_MB', '2048'))  # Максимальный объем векторов в кеше
+
+# Параметры кеша эмбеддингов запросов в памяти процесса
+QUERY_CACHE_SIZE = int(os.getenv('QUERY_CACHE_SIZE', '1024'))  # Максимальное число запросов в кеше (0 - отключен)
+QUERY_CACHE_TTL_SECONDS = float(os.getenv('QUERY_CACHE_TTL_SECONDS', '3600'))  # Время жизни записи
+
+SQLITE_MAX_VARIABLES = 500  # Количество параметров в одном запросе (ограничение SQLite)
+ACCESS_FLUSH_KEYS = 1024  # Накопленные времена использования записываются при таком числе ключей
+ACCESS_FLUSH_SECONDS = 30  # и не реже, чем раз в указанное время, сек
+
+# Суммарный размер векторов хранится в служебной таблице и поддерживается триггерами, поэтому
+# проверка лимита не сканирует таблицу и учитывает записи всех процессов, работающих с файлом
+SIZE_TRACKING_SQL = """
+CREATE TABLE IF NOT EXISTS cache_meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+CREATE TRIGGER IF NOT EXISTS embeddings_size_insert AFTER INSERT ON embeddings BEGIN
+    UPDATE cache_meta SET value = value + LENGTH(NEW.vector) WHERE name = 'total_bytes';
+END;
+CREATE TRIGGER IF NOT EXISTS embeddings_size_delete AFTER DELETE ON embeddings BEGIN
+    UPDATE cache_meta SET value = value - LENGTH(OLD.vector) WHERE name = 'total_bytes';
+END;
+CREATE TRIGGER IF NOT EXISTS embeddings_size_update AFTER UPDATE OF vector ON embeddings BEGIN
+    UPDATE cache_meta SET value = value + LENGTH(NEW.vector) - LENGTH(OLD.vector) WHERE name = 'total_bytes';
+END;
+-- Для кеша, созданного до появления счетчика, размер считается один раз
+INSERT OR IGNORE INTO cache_meta (name, value)
+    SELECT 'total_bytes', COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings;
+"""
+
+
+class EmbeddingCache:
+    """
+        Дисковый кеш эмбеддингов с адресацией по содержимому.
+
+        Ключ записи — хеш пары (пространство имен модели, текст чанка), поэтому неизменившиеся
+        чанки при повторной сборке хранилищ не проходят через модель. При превышении лимита
+        размера удаляются давно не использовавшиеся записи. Время использования обновляется
+        пакетами: чтение из кеша не выполняет запись в базу на каждый вызов.
+    """
+
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH, max_bytes: int = EMBEDDING_CACHE_MAX_MB * 1024 * 1024):
+        """
+        Открытие (или создание) файла кеша.
+
+        Аргументы:
+        - path: Путь к файлу базы SQLite.
+        - max_bytes: Максимальный суммарный размер хранимых векторов в байтах.
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Одно соединение на процесс; доступ из потоков синхронизируется блокировкой
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")  # Параллельное чтение из нескольких процессов
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY,"
+            " vector BLOB NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used)")
+        self._conn.commit()
+        self._conn.executescript(SIZE_TRACKING_SQL)
+
+        self._accessed: Dict[str, float] = {}  # Ключи, прочитанные после последней записи времени использования
+        self._last_access_flush = time.monotonic()
+        atexit.register(self._flush_on_exit)
+        cache_logger.info(f"Кеш эмбеддингов открыт: {path} (лимит {max_bytes / 1024 / 1024:.0f} МБ)")
+
+    @staticmethod
+    def make_key(namespace: str, text: str) -> str:
+        """Создает ключ записи по пространству имен модели и тексту"""
+        hasher = hashlib.sha256()
+        hasher.update(namespace.encode('utf-8'))
+        hasher.update(b'\0')
+        hasher.update(text.encode('utf-8'))
+        return hasher.hexdigest()
+
+    @staticmethod
+    def _batches(items: List, size: int = SQLITE_MAX_VARIABLES) -> Iterable[List]:
+        """Разбивает список на части, укладывающиеся в лимит параметров SQLite"""
+        for start in range(0, len(items), size):
+            yield items[start:start + size]
+
+    def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        """
+        Получение сохраненных эмбеддингов.
+
+        Аргументы:
+        - keys: Список ключей.
+
+        Возвращает:
+        - Словарь {ключ: вектор float32} только для найденных записей.
+        """
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        with self._lock:
+            for batch in self._batches(unique_keys):
+                placeholders = ','.join('?' * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+
+            # Время использования для вытеснения по давности запоминается и записывается пакетом
+            if found:
+                now = time.time()
+                self._accessed.update((key, now) for key in found)
+                if (len(self._accessed) >= ACCESS_FLUSH_KEYS
+                        or time.monotonic() - self._last_access_flush >= ACCESS_FLUSH_SECONDS):
+                    self._flush_access_times()
+                    self._conn.commit()
+        return found
+
+    def _flush_access_times(self):
+        """Записывает накопленные времена использования (вызывается под блокировкой, без commit)"""
+        if self._accessed:
+            self._conn.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                [(last_used, key) for key, last_used in self._accessed.items()]
+            )
+            self._accessed = {}
+        self._last_access_flush = time.monotonic()
+
+    def put_many(self, items: List[Tuple[str, np.ndarray]]):
+        """
+        Сохранение эмбеддингов в кеш.
+
+        Аргументы:
+        - items: Список пар (ключ, вектор).
+        """
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            # Времена использования записываются до вытеснения, чтобы недавно прочитанные записи не удалялись
+            self._flush_access_times()
+            # UPSERT вместо INSERT OR REPLACE: замена строки вызывает триггер обновления, и счетчик размера верен
+            self._conn.executemany(
+                "INSERT INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)"
+                " ON CONFLICT(key) DO UPDATE SET vector = excluded.vector, last_used = excluded.last_used",
+                [(key, np.asarray(vector, dtype=np.float32).tobytes(), now) for key, vector in items]
+            )
+            self._conn.commit()
+            self._evict()
+
+    def _evict(self):
+        """Удаляет самые старые записи, если размер кеша превышает лимит (вызывается под блокировкой)"""
+        total_bytes = self._conn.execute("SELECT value FROM cache_meta WHERE name = 'total_bytes'").fetchone()[0]
+        if total_bytes <= self.max_bytes:
+            return
+
+        # Освобождаем место с запасом, чтобы не запускать вытеснение на каждой записи
+        target_bytes = int(self.max_bytes * 0.9)
+        removed = 0
+        freed = 0
+        rows = self._conn.execute("SELECT key, LENGTH(vector) FROM embeddings ORDER BY last_used")
+        stale_keys = []
+        for key, size in rows:
+            if total_bytes - freed <= target_bytes:
+                break
+            stale_keys.append(key)
+            freed += size
+            removed += 1
+        rows.close()
+        for batch in self._batches(stale_keys):
+            placeholders = ','.join('?' * len(batch))
+            self._conn.execute(f"DELETE FROM embeddings WHERE key IN ({placeholders})", batch)
+        self._conn.commit()
+        cache_logger.info(f"Вытеснено {removed} записей из кеша эмбеддингов ({freed / 1024 / 1024:.1f} МБ)")
+
+    def _flush_on_exit(self):
+        """Сохраняет накопленные времена использования при завершении процесса"""
+        try:
+            self.close()
+        except sqlite3.Error as e:
+            cache_logger.error(f"Ошибка при закрытии кеша эмбеддингов: {e}")
+
+    def close(self):
+        """Записывает накопленные времена использования и закрывает соединение с базой"""
+        with self._lock:
+            if self._conn is None:
+                return
+            self._flush_access_times()
+            self._conn.commit()
+            self._conn.close()
+            self._conn = None
+            atexit.unregister(self._flush_on_exit)
+
+
+class QueryEmbeddingCache:
+    """
+        Потокобезопасный LRU-кеш эмбеддингов запросов с ограничением времени жизни записей.
+
+        Хранится в памяти процесса и разделяется всеми потоками сервера.
+    """
+
+    def __init__(self, max_size: int = QUERY_CACHE_SIZE, ttl_seconds: float = QUERY_CACHE_TTL_SECONDS):
+        """
+        Аргументы:
+        - max_size: Максимальное количество записей.
+        - ttl_seconds: Время жизни записи в секундах.
+        """
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # ключ -> (время записи, вектор)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """Возвращает вектор из кеша или None, если записи нет или она устарела"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, vector = entry
+                if time.monotonic() - stored_at <= self.ttl_seconds:
+                    self._entries.move_to_end(key)  # Отмечаем запись как недавно использованную
+                    self.hits += 1
+                    return vector
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: str, vector: np.ndarray):
+        """Сохраняет вектор в кеш, вытесняя самую давнюю запись при переполнении"""
+        if self.max_size <= 0:
+            return
+        vector = np.array(vector, dtype=np.float32)
+        vector.setflags(write=False)  # Общий объект для всех потоков не должен изменяться
+        with self._lock:
+            self._entries[key] = (time.monotonic(), vector)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Очищает кеш и счетчики"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict[str, float]:
+        """Возвращает счетчики попаданий и промахов"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
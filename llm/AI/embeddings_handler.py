@@ -2,17 +2,27 @@ import os
 os.environ['KMP_DUPLICATE_LIB_OK']='TRUE'
 
 import fitz
-from transformers import AutoTokenizer, AutoModel
+from transformers import AutoTokenizer
 import torch
+import numpy as np
 from typing import List
 from langchain.embeddings.base import Embeddings
 from logging_config import setup_logger
+from embedding_backends import create_embedding_backend
+from embedding_cache import EmbeddingCache, QueryEmbeddingCache, EMBEDDING_CACHE_ENABLED
+from query_batcher import QueryMicroBatcher, EMBEDDINGS_BATCH_WINDOW_MS
 import threading
+import time
 
 # Инициализация логгеров
 emb_logger = setup_logger('embeddings', 'EMBEDDINGS_LOGGING')
 file_logger = setup_logger('embeddings_file', 'FILE_OPERATIONS_LOGGING')
 
+# Параметры пакетной генерации эмбеддингов
+EMBEDDINGS_BATCH_SIZE = int(os.getenv('EMBEDDINGS_BATCH_SIZE', '32'))  # Количество текстов в одном проходе модели
+EMBEDDINGS_MAX_LENGTH = int(os.getenv('EMBEDDINGS_MAX_LENGTH', '512'))  # Максимальная длина текста в токенах
+EMBEDDINGS_NORMALIZE = bool(int(os.getenv('EMBEDDINGS_NORMALIZE', '0')))  # L2-нормализация векторов
+
 class CustomEmbeddings(Embeddings):
     """
         Класс для создания и управления эмбеддингами. Реализует паттерн Singleton для загрузки модели.
@@ -38,12 +48,35 @@ class CustomEmbeddings(Embeddings):
                     self.model_name = "sentence-transformers/all-MiniLM-L6-v2"
                     emb_logger.info(f"Инициализация модели {self.model_name}")
                     self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)  # Загрузка токенизатора
-                    self.model = AutoModel.from_pretrained(self.model_name) # Загрузка модели
-                    self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu") # Определение устройства (GPU/CPU)
-                    self.model.to(self.device) # Перенос модели на выбранное устройство
+                    # Быстрый токенизатор не допускает одновременных вызовов ("Already borrowed"), а эмбеддинги
+                    # считаются из потоков сервера, потока объединения запросов и пакетного поиска
+                    self._tokenizer_lock = threading.Lock()
+                    self.backend = create_embedding_backend(self.model_name) # Загрузка модели в выбранный движок
+                    self.device = self.backend.device
                     emb_logger.info(f"Модель загружена на устройство: {self.device}")
+                    # Пространство имен кеша: векторы разных моделей, движков и настроек не смешиваются
+                    self.cache_namespace = (
+                        f"{self.model_name}|backend={self.backend.name}"
+                        f"|max_length={EMBEDDINGS_MAX_LENGTH}|normalize={int(EMBEDDINGS_NORMALIZE)}"
+                    )
+                    self.document_cache = self._open_document_cache()
+                    self.query_cache = QueryEmbeddingCache()
+                    # Одновременные запросы из потоков сервера объединяются в общий проход модели
+                    self.query_batcher = QueryMicroBatcher(self.generate_embeddings) if EMBEDDINGS_BATCH_WINDOW_MS > 0 else None
                     self._initialized = True # Установка флага инициализации
 
+    @staticmethod
+    def _open_document_cache():
+        """Открывает дисковый кеш эмбеддингов документов (None, если кеш отключен или недоступен)"""
+        if not EMBEDDING_CACHE_ENABLED:
+            emb_logger.info("Дисковый кеш эмбеддингов отключен")
+            return None
+        try:
+            return EmbeddingCache()
+        except Exception as e:
+            emb_logger.error(f"Не удалось открыть кеш эмбеддингов: {e}")
+            return None
+
     def extract_text_from_pdf(self, pdf_path: str) -> str:
         """
         Извлечение текста из PDF файла.
@@ -56,74 +89,169 @@ class CustomEmbeddings(Embeddings):
         """
         try:
             file_logger.info(f"Извлечение текста из PDF: {pdf_path}")
-            document = fitz.open(pdf_path) # Открытие PDF файла
-            text = ""
-            for page_num in range(len(document)): # Итерация по страницам PDF
-                page = document.load_page(page_num) # Загрузка страницы
-                text += page.get_text("text") # Извлечение текста со страницы
-            file_logger.info(f"Успешно извлечен текст из {len(document)} страниц")
+            with fitz.open(pdf_path) as document: # Открытие PDF файла
+                # Текст страниц собирается одним join вместо конкатенации в цикле
+                text = "".join(page.get_text("text") for page in document)
+                file_logger.info(f"Успешно извлечен текст из {len(document)} страниц")
             return text
         except Exception as e:
             file_logger.error(f"Ошибка при извлечении текста из PDF {pdf_path}: {e}")
             return ""
 
-    def generate_embeddings(self, texts: List[str]) -> List[List[float]]:
+    @staticmethod
+    def _mean_pooling(last_hidden_state: torch.Tensor, attention_mask: torch.Tensor) -> torch.Tensor:
+        """
+        Усреднение скрытых состояний с учетом маски внимания (паддинг не влияет на вектор).
+
+        Аргументы:
+        - last_hidden_state: Скрытые состояния модели размерности (batch, seq_len, dim).
+        - attention_mask: Маска внимания размерности (batch, seq_len).
+
+        Возвращает:
+        - Тензор эмбеддингов размерности (batch, dim).
         """
-        Генерация эмбеддингов для списка текстов.
+        mask = attention_mask.unsqueeze(-1).to(last_hidden_state.dtype)
+        summed = (last_hidden_state * mask).sum(dim=1)
+        counts = mask.sum(dim=1).clamp(min=1e-9)  # Защита от деления на ноль
+        return summed / counts
+
+    def generate_embeddings(self, texts: List[str], batch_size: int = None, normalize: bool = None,
+                            backend=None) -> np.ndarray:
+        """
+        Пакетная генерация эмбеддингов для списка текстов.
+
+        Тексты сортируются по длине в токенах и группируются в пакеты, поэтому паддинг
+        внутри пакета минимален. Результат возвращается в исходном порядке текстов.
 
         Аргументы:
         - texts: Список текстов для преобразования в эмбеддинги.
+        - batch_size: Размер пакета (по умолчанию EMBEDDINGS_BATCH_SIZE).
+        - normalize: Выполнять ли L2-нормализацию (по умолчанию EMBEDDINGS_NORMALIZE).
+        - backend: Движок инференса (по умолчанию движок экземпляра; используется при сравнении движков).
 
         Возвращает:
-        - Список эмбеддингов в виде списков чисел.
+        - Непрерывную матрицу float32 размерности (len(texts), dim).
         """
+        batch_size = max(1, batch_size or EMBEDDINGS_BATCH_SIZE)
+        normalize = EMBEDDINGS_NORMALIZE if normalize is None else normalize
+        backend = backend or self.backend
+        dim = backend.hidden_size
         try:
-            emb_logger.info(f"Генерация эмбеддингов для {len(texts)} текстов")
-            self.model.eval() # Установка модели в режим оценки
-            all_embeddings = [] # Список для хранения эмбеддингов
-            
-            for i, text in enumerate(texts, 1):  # Итерация по текстам с индексацией
-                inputs = self.tokenizer(
-                    text, 
-                    return_tensors="pt",  # Преобразование текста в формат тензоров
+            emb_logger.info(f"Генерация эмбеддингов для {len(texts)} текстов (размер пакета {batch_size})")
+            if not texts:
+                return np.empty((0, dim), dtype=np.float32)
+
+            # Токенизация без паддинга: длины нужны для группировки текстов по размеру
+            with self._tokenizer_lock:
+                encodings = self.tokenizer(
+                    list(texts),
                     truncation=True,  # Обрезка длинных текстов
-                    padding=True,   # Добавление паддинга
-                    max_length=512 # Максимальная длина текста
-                ).to(self.device) # Перенос данных на устройство (CPU/GPU)
-                
-                with torch.no_grad(): # Отключение градиентов для ускорения
-                    outputs = self.model(**inputs) # Пропуск текста через модель
-                
-                embeddings = outputs.last_hidden_state.mean(dim=1) # Усреднение скрытых состояний
-                embeddings = embeddings.cpu().numpy()[0].tolist() # Перевод тензора в список чисел
-                all_embeddings.append(embeddings) # Добавление эмбеддинга в список
-                
-                if i % 100 == 0: # Логирование каждые 100 текстов
-                    emb_logger.info(f"Обработано {i}/{len(texts)} текстов")
-            
-            emb_logger.info("Генерация эмбеддингов завершена")
-            return all_embeddings
+                    max_length=EMBEDDINGS_MAX_LENGTH # Максимальная длина текста
+                )
+            lengths = [len(ids) for ids in encodings['input_ids']]
+            order = np.argsort(lengths, kind='stable') # Индексы текстов по возрастанию длины
+
+            result = np.empty((len(texts), dim), dtype=np.float32) # Итоговая матрица эмбеддингов
+            total_start = time.perf_counter()
+
+            for start in range(0, len(texts), batch_size):
+                batch_idx = order[start:start + batch_size]
+                batch_start = time.perf_counter()
+
+                # Динамический паддинг до самого длинного текста в пакете
+                with self._tokenizer_lock:
+                    batch = self.tokenizer.pad(
+                        {key: [values[i] for i in batch_idx] for key, values in encodings.items()},
+                        return_tensors="pt"
+                    )
+                batch = batch.to(backend.device) # Перенос данных на устройство (CPU/GPU)
+
+                last_hidden_state = backend(batch) # Пропуск пакета через модель
+                embeddings = self._mean_pooling(last_hidden_state, batch['attention_mask'].to(last_hidden_state.device))
+                if normalize:
+                    embeddings = torch.nn.functional.normalize(embeddings, p=2, dim=1)
+                result[batch_idx] = embeddings.cpu().numpy()
+
+                elapsed = time.perf_counter() - batch_start
+                emb_logger.info(
+                    f"Пакет {start // batch_size + 1}: {len(batch_idx)} текстов, "
+                    f"{len(batch_idx) / max(elapsed, 1e-9):.1f} текстов/сек"
+                )
+
+            total_elapsed = time.perf_counter() - total_start
+            emb_logger.info(
+                f"Генерация эмбеддингов завершена: {len(texts)} текстов за {total_elapsed:.2f} сек "
+                f"({len(texts) / max(total_elapsed, 1e-9):.1f} текстов/сек)"
+            )
+            return np.ascontiguousarray(result)
         except Exception as e:
             emb_logger.error(f"Ошибка при генерации эмбеддингов: {e}")
-            return []
+            return np.empty((0, dim), dtype=np.float32)
 
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
         """
-                Обязательный метод из интерфейса Embeddings для обработки списка документов.
+        Обязательный метод из интерфейса Embeddings для обработки списка документов.
+        Перед запуском модели проверяет дисковый кеш эмбеддингов.
 
-                Аргументы:
-                - texts: Список текстов.
+        Аргументы:
+        - texts: Список текстов.
 
-                Возвращает:
-                - Эмбеддинги текстов.
-                """
-        """Обязательный метод из интерфейса Embeddings"""
+        Возвращает:
+        - Эмбеддинги текстов.
+        """
         emb_logger.info(f"Запрос на эмбеддинг {len(texts)} документов")
-        return self.generate_embeddings(texts)
+        return self.embed_documents_matrix(texts).tolist()
+
+    def embed_documents_matrix(self, texts: List[str]) -> np.ndarray:
+        """
+        Генерация эмбеддингов с использованием дискового кеша: модель вызывается только для новых текстов.
+
+        Аргументы:
+        - texts: Список текстов.
+
+        Возвращает:
+        - Матрицу float32 размерности (len(texts), dim).
+        """
+        if self.document_cache is None or not texts:
+            return self.generate_embeddings(texts)
+
+        try:
+            keys = [self.document_cache.make_key(self.cache_namespace, text) for text in texts]
+            cached = self.document_cache.get_many(keys)
+        except Exception as e:
+            emb_logger.error(f"Ошибка чтения кеша эмбеддингов: {e}")
+            return self.generate_embeddings(texts)
+
+        missing = [i for i, key in enumerate(keys) if key not in cached]
+        emb_logger.info(f"Кеш эмбеддингов: найдено {len(texts) - len(missing)}/{len(texts)}, к расчету {len(missing)}")
+
+        result = np.empty((len(texts), self.backend.hidden_size), dtype=np.float32)
+        for i, key in enumerate(keys):
+            if key in cached:
+                result[i] = cached[key]
+
+        if missing:
+            vectors = self.generate_embeddings([texts[i] for i in missing])
+            if len(vectors) != len(missing): # Ошибка генерации уже залогирована
+                return vectors
+            result[missing] = vectors
+            try:
+                self.document_cache.put_many([(keys[i], vectors[j]) for j, i in enumerate(missing)])
+            except Exception as e:
+                emb_logger.error(f"Ошибка записи в кеш эмбеддингов: {e}")
+        return result
+
+    def _normalize_query(self, text: str) -> str:
+        """Приводит запрос к каноническому виду, не меняющему результат токенизации"""
+        text = ' '.join(text.split())
+        if getattr(self.tokenizer, 'do_lower_case', False): # Для uncased-моделей регистр не влияет на вектор
+            text = text.lower()
+        return text
 
     def embed_query(self, text: str) -> List[float]:
         """
         Обязательный метод из интерфейса Embeddings для обработки одиночного текста.
+        Повторные запросы обслуживаются из кеша без обращения к модели.
 
         Аргументы:
         - text: Одиночный текст.
@@ -131,5 +259,55 @@ class CustomEmbeddings(Embeddings):
         Возвращает:
         - Эмбеддинг текста.
         """
+        return self.embed_query_vector(text).tolist()
+
+    def embed_query_vector(self, text: str) -> np.ndarray:
+        """Эмбеддинг запроса в виде вектора float32 (для прямого поиска в индексе FAISS)"""
         emb_logger.info("Запрос на эмбеддинг одиночного текста")
-        return self.generate_embeddings([text])[0] 
\ No newline at end of file
+        query = self._normalize_query(text)
+        vector = self.query_cache.get(query)
+        if vector is None:
+            if self.query_batcher is not None:
+                vector = self.query_batcher.submit(query)
+            else:
+                vector = self.generate_embeddings([query])[0]
+            self.query_cache.put(query, vector)
+        else:
+            emb_logger.info("Эмбеддинг запроса получен из кеша")
+        return vector
+
+    def embed_queries_matrix(self, texts: List[str]) -> np.ndarray:
+        """
+        Эмбеддинги пакета запросов одним проходом модели (для пакетного поиска).
+        Запросы из кеша и повторяющиеся запросы через модель не пропускаются.
+
+        Аргументы:
+        - texts: Список запросов.
+
+        Возвращает:
+        - Матрицу float32 размерности (len(texts), dim) в порядке запросов.
+          Если эмбеддинги вычислить не удалось, выбрасывается RuntimeError.
+        """
+        emb_logger.info(f"Запрос на эмбеддинг {len(texts)} запросов")
+        queries = [self._normalize_query(text) for text in texts]
+        vectors = {}
+        for query in queries:
+            if query not in vectors:
+                vectors[query] = self.query_cache.get(query)
+        missing = [query for query, vector in vectors.items() if vector is None]
+        if missing:
+            generated = self.generate_embeddings(missing)
+            if len(generated) != len(missing): # Причина ошибки уже залогирована в generate_embeddings
+                raise RuntimeError(f"Не удалось вычислить эмбеддинги {len(missing)} запросов")
+            for query, vector in zip(missing, generated):
+                vectors[query] = vector
+                self.query_cache.put(query, vector)
+        emb_logger.info(f"Кеш запросов: найдено {len(vectors) - len(missing)}/{len(vectors)} уникальных запросов")
+        result = np.empty((len(queries), self.backend.hidden_size), dtype=np.float32)
+        for i, query in enumerate(queries):
+            result[i] = vectors[query]
+        return result
+
+    def query_cache_stats(self) -> dict:
+        """Возвращает статистику кеша эмбеддингов запросов (размер, попадания, промахи)"""
+        return self.query_cache.stats()
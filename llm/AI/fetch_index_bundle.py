@@ -0,0 +1,71 @@
+"""
+Установка готовой версии индексов на сервер перед запуском (индексы на сервере не собираются).
+
+Архив версии собирается на отдельной машине (AI/build_index.py --archive) и публикуется по адресу
+INDEX_BUNDLE_URL (http(s):// или путь к файлу). Архив скачивается, проверяется (INDEX_BUNDLE_SHA256
+и контрольные суммы файлов из манифеста) и становится активной версией. Если INDEX_BUNDLE_URL
+не задан, версия должна уже находиться в INDEX_BUNDLES_DIR (например, на подключенном томе).
+
+Запуск (из каталога llm):
+    INDEX_BUNDLE_URL=https://.../<версия>.tar.gz PYTHONPATH=. python AI/fetch_index_bundle.py
+"""
+import os
+import shutil
+import hashlib
+import argparse
+import tempfile
+import urllib.request
+from urllib.parse import urlparse
+from index_bundle import (
+    INDEX_BUNDLES_DIR, CHECKSUM_BLOCK_SIZE, activate_version, get_current_version, install_bundle_archive
+)
+
+INDEX_BUNDLE_URL = os.getenv('INDEX_BUNDLE_URL')  # Адрес архива версии индексов
+INDEX_BUNDLE_SHA256 = os.getenv('INDEX_BUNDLE_SHA256')  # Ожидаемая контрольная сумма архива (необязательно)
+DOWNLOAD_TIMEOUT = 60  # Таймаут соединения при скачивании, сек
+
+
+def download(url: str, destination: str):
+    """Скачивает архив (или копирует локальный файл) в destination"""
+    if urlparse(url).scheme in ('http', 'https'):
+        with urllib.request.urlopen(url, timeout=DOWNLOAD_TIMEOUT) as response, open(destination, 'wb') as f:
+            shutil.copyfileobj(response, f, CHECKSUM_BLOCK_SIZE)
+    else:
+        shutil.copyfile(url[len('file://'):] if url.startswith('file://') else url, destination)
+
+
+def sha256_of(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(CHECKSUM_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Установка готовой версии индексов из архива")
+    parser.add_argument('--url', default=INDEX_BUNDLE_URL, help="Адрес архива версии (по умолчанию INDEX_BUNDLE_URL)")
+    parser.add_argument('--sha256', default=INDEX_BUNDLE_SHA256, help="Ожидаемая контрольная сумма архива")
+    parser.add_argument('--bundles-dir', default=INDEX_BUNDLES_DIR, help="Каталог версий индексов")
+    args = parser.parse_args()
+
+    if not args.url:
+        current = get_current_version(args.bundles_dir)
+        if current is None:
+            raise SystemExit(f"INDEX_BUNDLE_URL не задан, и в {args.bundles_dir} нет активной версии индексов")
+        print(f"INDEX_BUNDLE_URL не задан, используется версия {current} из {args.bundles_dir}")
+        return
+
+    os.makedirs(args.bundles_dir, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=args.bundles_dir, prefix='.download-') as tmp_dir:
+        archive_path = os.path.join(tmp_dir, 'bundle.tar.gz')
+        download(args.url, archive_path)
+        if args.sha256 and sha256_of(archive_path) != args.sha256.lower():
+            raise SystemExit(f"Контрольная сумма архива {args.url} не совпадает с ожидаемой")
+        version = install_bundle_archive(archive_path, args.bundles_dir)
+    activate_version(version, args.bundles_dir)
+    print(version)
+
+
+if __name__ == '__main__':
+    main()
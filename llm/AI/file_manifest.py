@@ -0,0 +1,111 @@
+import os
+import json
+import mmap
+import hashlib
+from typing import Iterable
+from logging_config import setup_logger
+
+# Инициализация логгера
+file_logger = setup_logger('file_manifest', 'FILE_OPERATIONS_LOGGING')
+
+# Режим доверия манифесту (неизменяемые развертывания): файлы из манифеста не проверяются через stat
+INGESTION_TRUST_MANIFEST = bool(int(os.getenv('INGESTION_TRUST_MANIFEST', '0')))
+
+HASH_DIGEST_SIZE = 16  # Размер хеша blake2b в байтах
+
+
+def hash_file(file_path: str) -> str:
+    """
+    Вычисляет хеш содержимого файла (blake2b по отображенному в память файлу).
+
+    Аргументы:
+    - file_path: Путь к файлу.
+
+    Возвращает:
+    - Хеш в шестнадцатеричном виде.
+    """
+    hasher = hashlib.blake2b(digest_size=HASH_DIGEST_SIZE)
+    with open(file_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size > 0: # Пустой файл нельзя отобразить в память
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                hasher.update(mapped)
+    return hasher.hexdigest()
+
+
+class FileManifest:
+    """
+        Манифест исходных файлов: путь, размер, время изменения, inode и хеш содержимого.
+
+        Хеш пересчитывается только для файлов, у которых изменились данные stat. В режиме доверия
+        хеш файла из манифеста используется без проверки.
+    """
+
+    def __init__(self, path: str, base_dir: str, trust: bool = INGESTION_TRUST_MANIFEST):
+        """
+        Аргументы:
+        - path: Путь к файлу манифеста (JSON).
+        - base_dir: Каталог, относительно которого записываются пути файлов.
+        - trust: Использовать хеши из манифеста без проверки stat.
+        """
+        self.path = path
+        self.base_dir = base_dir
+        self.trust = trust
+        self.entries = {}
+        self._dirty = False
+        self.rehashed = 0
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f)
+            except Exception as e:
+                file_logger.error(f"Ошибка при чтении манифеста файлов {path}: {e}")
+
+    def _key(self, file_path: str) -> str:
+        """Ключ записи — путь относительно базового каталога"""
+        return os.path.relpath(os.path.abspath(file_path), self.base_dir)
+
+    def file_hash(self, file_path: str) -> str:
+        """
+        Возвращает хеш содержимого файла, пересчитывая его только при изменении stat.
+
+        Аргументы:
+        - file_path: Путь к файлу.
+
+        Возвращает:
+        - Хеш в шестнадцатеричном виде.
+        """
+        key = self._key(file_path)
+        entry = self.entries.get(key)
+        if entry is not None and self.trust:
+            return entry["hash"]
+
+        stat = os.stat(file_path)
+        signature = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "inode": stat.st_ino}
+        if entry is not None and all(entry.get(name) == value for name, value in signature.items()):
+            return entry["hash"]
+
+        file_logger.info(f"Вычисление хеша файла: {file_path}")
+        self.entries[key] = {**signature, "hash": hash_file(file_path)}
+        self._dirty = True
+        self.rehashed += 1
+        return self.entries[key]["hash"]
+
+    def retain(self, file_paths: Iterable[str]):
+        """Удаляет из манифеста записи файлов, которых больше нет"""
+        keys = {self._key(file_path) for file_path in file_paths}
+        for key in list(self.entries):
+            if key not in keys:
+                del self.entries[key]
+                self._dirty = True
+
+    def save(self):
+        """Атомарно сохраняет манифест, если он изменился"""
+        if not self._dirty:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+        self._dirty = False
+        file_logger.info(f"Манифест файлов сохранен: {self.path} ({len(self.entries)} файлов)")
@@ -0,0 +1,403 @@
+import os
+import json
+import faiss
+import pickle
+import shutil
+import hashlib
+import tarfile
+import numpy as np
+from datetime import datetime, timezone
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+from langchain_community.vectorstores import FAISS
+from embeddings_handler import CustomEmbeddings, EMBEDDINGS_NORMALIZE
+from unified_index import (
+    RAG_SEARCH_MODE, UNIFIED_INDEX_NAME, UNIFIED_VECTORS_FILE_NAME, UnifiedIndex, build_unified_store
+)
+from category_router import CategoryRouter, build_category_routes, save_category_routes
+from ann_index import RAG_INDEX_TYPE, get_index_params, is_compressed, is_index_mapped
+from index_mmap import INDEX_MMAP, INDEX_WARMUP, read_index, warm_up_files, process_memory
+from compact_docstore import (
+    TABLE_SUFFIX, TEXT_SUFFIX, CompactDocstore, PositionIds, compact_docstore_files, has_compact_docstore,
+    migrate_pickle_docstore, write_compact_docstore
+)
+from logging_config import setup_logger
+
+# Инициализация логгеров
+bundle_logger = setup_logger('index_bundle', 'RAG_LOGGING')
+file_logger = setup_logger('index_bundle_file', 'FILE_OPERATIONS_LOGGING')
+
+# Каталог версий собранных индексов и проверка контрольных сумм при загрузке
+INDEX_BUNDLES_DIR = os.getenv(
+    'INDEX_BUNDLES_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), 'index_bundles')
+)
+INDEX_BUNDLE_VERIFY = bool(int(os.getenv('INDEX_BUNDLE_VERIFY', '1')))
+
+BUNDLE_MANIFEST_NAME = "manifest.json"
+CURRENT_POINTER_NAME = "CURRENT"  # Файл с именем активной версии
+BUNDLE_FORMAT_VERSION = 1
+DOCSTORE_FORMAT = "compact"  # Хранилище чанков версии: compact (без pickle) или pickle (старые версии)
+CHECKSUM_BLOCK_SIZE = 1 << 20  # Размер блока чтения при подсчете контрольной суммы
+
+
+@dataclass
+class IndexBundle:
+    """Загруженная версия индексов: общий индекс, хранилища категорий и манифест сборки"""
+    version: str
+    path: str
+    manifest: dict
+    stores: Dict[str, FAISS] = field(default_factory=dict)
+    unified: Optional[UnifiedIndex] = None
+    router: Optional[CategoryRouter] = None
+    mapped_files: List[str] = field(default_factory=list)  # Файлы, данные которых отображены в память
+
+
+def file_checksum(file_path: str) -> str:
+    """Вычисляет sha256 файла"""
+    hasher = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(CHECKSUM_BLOCK_SIZE), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def _write_json_atomic(path: str, data):
+    """Атомарно записывает JSON файл"""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def get_current_version(bundles_dir: str = INDEX_BUNDLES_DIR) -> Optional[str]:
+    """Возвращает имя активной версии (None, если версий нет)"""
+    pointer_path = os.path.join(bundles_dir, CURRENT_POINTER_NAME)
+    if not os.path.exists(pointer_path):
+        return None
+    with open(pointer_path, 'r', encoding='utf-8') as f:
+        return f.read().strip() or None
+
+
+def activate_version(version: str, bundles_dir: str = INDEX_BUNDLES_DIR):
+    """Делает версию активной (атомарная замена указателя)"""
+    pointer_path = os.path.join(bundles_dir, CURRENT_POINTER_NAME)
+    tmp_path = pointer_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(version)
+    os.replace(tmp_path, pointer_path)
+    bundle_logger.info(f"Активная версия индексов: {version}")
+
+
+def save_store(vector_store: FAISS, directory: str, index_name: str):
+    """Сохраняет индекс хранилища и его чанки в компактном формате (<index_name>.faiss, .docs.*, .text)"""
+    faiss.write_index(vector_store.index, os.path.join(directory, f"{index_name}.faiss"))
+    documents = (
+        vector_store.docstore.search(vector_store.index_to_docstore_id[position])
+        for position in range(vector_store.index.ntotal)
+    )
+    write_compact_docstore(directory, index_name, documents)
+
+
+def build_bundle(vector_stores: Dict[str, FAISS], build_info: dict,
+                 bundles_dir: str = INDEX_BUNDLES_DIR) -> str:
+    """
+    Сохраняет хранилища категорий в новую версию (каталог с индексами, docstore и манифестом).
+
+    Аргументы:
+    - vector_stores: Хранилища по категориям.
+    - build_info: Параметры сборки и источники: {"params": ..., "categories": {категория: {"index_name", "sources"}}}.
+    - bundles_dir: Каталог версий.
+
+    Возвращает:
+    - Имя созданной версии.
+    """
+    embeddings = CustomEmbeddings()
+    os.makedirs(bundles_dir, exist_ok=True)
+
+    # Версия определяется временем сборки и содержимым источников
+    content_hash = hashlib.sha256(
+        json.dumps([build_info["params"], build_info["categories"]], ensure_ascii=False, sort_keys=True).encode('utf-8')
+    ).hexdigest()
+    version = f"{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}-{content_hash[:8]}"
+    tmp_dir = os.path.join(bundles_dir, f".{version}.tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    categories = {}
+    for category, vector_store in vector_stores.items():
+        category_info = build_info["categories"][category]
+        index_name = category_info["index_name"]
+        save_store(vector_store, tmp_dir, index_name)
+        categories[category] = {
+            "index_name": index_name,
+            "vectors": vector_store.index.ntotal,
+            "sources": category_info["sources"],
+        }
+        bundle_logger.info(f"В версию {version} добавлена категория {category} ({vector_store.index.ntotal} векторов)")
+
+    unified_store, ranges, unified_vectors = build_unified_store(vector_stores)
+    save_store(unified_store, tmp_dir, UNIFIED_INDEX_NAME)
+    if is_compressed(RAG_INDEX_TYPE):
+        np.save(os.path.join(tmp_dir, UNIFIED_VECTORS_FILE_NAME), unified_vectors)
+    routing = save_category_routes(build_category_routes(unified_vectors, ranges), tmp_dir)
+
+    manifest = {
+        "format": BUNDLE_FORMAT_VERSION,
+        "version": version,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "model": embeddings.model_name,
+        "normalize": EMBEDDINGS_NORMALIZE,
+        "backend": embeddings.backend.name,
+        "build_params": build_info["params"],
+        "docstore": DOCSTORE_FORMAT,
+        "categories": categories,
+        "unified": {
+            "index_name": UNIFIED_INDEX_NAME,
+            "vectors": unified_store.index.ntotal,
+            "ranges": ranges,
+            "index_type": RAG_INDEX_TYPE,
+            "index_params": get_index_params(RAG_INDEX_TYPE, unified_store.index.ntotal, unified_vectors.shape[1]),
+        },
+        "routing": routing,
+        "files": {name: file_checksum(os.path.join(tmp_dir, name)) for name in sorted(os.listdir(tmp_dir))},
+    }
+    _write_json_atomic(os.path.join(tmp_dir, BUNDLE_MANIFEST_NAME), manifest)
+    os.rename(tmp_dir, os.path.join(bundles_dir, version))
+    file_logger.info(f"Версия индексов {version} сохранена в {bundles_dir}")
+    return version
+
+
+def prune_bundles(keep: int, bundles_dir: str = INDEX_BUNDLES_DIR):
+    """Удаляет старые версии, оставляя последние keep и активную"""
+    current = get_current_version(bundles_dir)
+    versions = sorted(
+        name for name in os.listdir(bundles_dir)
+        if not name.startswith('.') and os.path.isdir(os.path.join(bundles_dir, name))
+    )
+    for version in versions[:-keep] if keep > 0 else []:
+        if version != current:
+            shutil.rmtree(os.path.join(bundles_dir, version), ignore_errors=True)
+            file_logger.info(f"Удалена старая версия индексов: {version}")
+
+
+def verify_bundle(bundle_path: str, manifest: dict) -> bool:
+    """Проверяет контрольные суммы файлов версии"""
+    for name, checksum in manifest["files"].items():
+        file_path = os.path.join(bundle_path, name)
+        if not os.path.exists(file_path) or file_checksum(file_path) != checksum:
+            bundle_logger.error(f"Контрольная сумма не совпадает: {file_path}")
+            return False
+    return True
+
+
+def is_valid_version_name(version: str) -> bool:
+    """Имя версии — один каталог внутри каталога версий (имя может прийти из запроса или архива)"""
+    return bool(version) and os.path.basename(version) == version and not version.startswith('.')
+
+
+def archive_bundle(version: str, output_dir: str, bundles_dir: str = INDEX_BUNDLES_DIR) -> str:
+    """
+    Упаковывает версию в архив для поставки на сервер (см. AI/fetch_index_bundle.py).
+
+    Возвращает:
+    - Путь к архиву <output_dir>/<version>.tar.gz (внутри — каталог версии).
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    archive_path = os.path.join(output_dir, f"{version}.tar.gz")
+    with tarfile.open(archive_path, 'w:gz') as archive:
+        archive.add(os.path.join(bundles_dir, version), arcname=version)
+    file_logger.info(f"Версия индексов {version} упакована в {archive_path}")
+    return archive_path
+
+
+def install_bundle_archive(archive_path: str, bundles_dir: str = INDEX_BUNDLES_DIR) -> str:
+    """
+    Распаковывает архив версии (archive_bundle) в каталог версий и проверяет контрольные суммы.
+    Уже установленная версия повторно не распаковывается.
+
+    Возвращает:
+    - Имя установленной версии.
+    """
+    with tarfile.open(archive_path, 'r:gz') as archive:
+        members = archive.getmembers()
+        versions = {member.name.split('/', 1)[0] for member in members}
+        if len(versions) != 1 or not is_valid_version_name(next(iter(versions))):
+            raise ValueError(f"Архив {archive_path} должен содержать один каталог версии")
+        version = versions.pop()
+        for member in members:
+            # Только обычные файлы и каталоги внутри каталога версии
+            if not (member.isfile() or member.isdir()) or '..' in member.name.split('/') or member.name.startswith('/'):
+                raise ValueError(f"Недопустимый элемент архива {archive_path}: {member.name}")
+
+        bundle_path = os.path.join(bundles_dir, version)
+        if os.path.isdir(bundle_path):
+            file_logger.info(f"Версия индексов {version} уже установлена")  # Проверяется при загрузке
+            return version
+        os.makedirs(bundles_dir, exist_ok=True)
+        tmp_dir = os.path.join(bundles_dir, f".{version}.install")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        try:
+            archive.extractall(tmp_dir, members=members)
+            # Версия становится видимой только после проверки контрольных сумм
+            _check_bundle_files(os.path.join(tmp_dir, version), archive_path)
+            os.rename(os.path.join(tmp_dir, version), bundle_path)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    file_logger.info(f"Версия индексов {version} установлена в {bundles_dir}")
+    return version
+
+
+def _check_bundle_files(bundle_path: str, archive_path: str):
+    with open(os.path.join(bundle_path, BUNDLE_MANIFEST_NAME), 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    if not verify_bundle(bundle_path, manifest):
+        raise ValueError(f"Версия индексов {os.path.basename(bundle_path)} из {archive_path} повреждена")
+
+
+def load_store(bundle_path: str, index_name: str, embeddings: CustomEmbeddings,
+               use_mmap: bool = INDEX_MMAP) -> FAISS:
+    """
+    Загружает хранилище версии (аналог FAISS.load_local с отображением индекса в память).
+
+    Аргументы:
+    - bundle_path: Каталог версии.
+    - index_name: Имя индекса (файлы <index_name>.faiss и компактное хранилище чанков или <index_name>.pkl).
+    - embeddings: Модель эмбеддингов хранилища.
+    - use_mmap: Отображать данные индекса из файла вместо чтения в память процесса.
+    """
+    index = read_index(os.path.join(bundle_path, f"{index_name}.faiss"), use_mmap)
+    if has_compact_docstore(bundle_path, index_name):
+        docstore = CompactDocstore(bundle_path, index_name)
+        index_to_docstore_id = PositionIds(len(docstore))
+    else:
+        # Версии до перехода на компактный формат (см. AI/migrate_docstore.py); файл .pkl создается
+        # только при сборке версии и проверяется по контрольной сумме
+        with open(os.path.join(bundle_path, f"{index_name}.pkl"), 'rb') as f:
+            docstore, index_to_docstore_id = pickle.load(f)
+    return FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id=index_to_docstore_id,
+    )
+
+
+def migrate_bundle_docstore(bundle_path: str, remove_pickle: bool = False) -> Dict[str, tuple]:
+    """
+    Переводит хранилища чанков версии из pickle в компактный формат и обновляет манифест.
+
+    Аргументы:
+    - bundle_path: Каталог версии.
+    - remove_pickle: Удалить файлы .pkl после проверки перенесенных документов.
+
+    Возвращает:
+    - Размеры до и после перевода по именам индексов {имя: (байт pkl, байт компактного формата)}.
+    """
+    with open(os.path.join(bundle_path, BUNDLE_MANIFEST_NAME), 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    index_names = [info["index_name"] for info in manifest["categories"].values()]
+    if manifest.get("unified"):
+        index_names.append(manifest["unified"]["index_name"])
+
+    sizes = {}
+    for index_name in index_names:
+        if not os.path.exists(os.path.join(bundle_path, f"{index_name}.pkl")):
+            continue
+        sizes[index_name] = migrate_pickle_docstore(bundle_path, index_name)
+        for name in compact_docstore_files(index_name):
+            manifest["files"][name] = file_checksum(os.path.join(bundle_path, name))
+        bundle_logger.info(f"Хранилище {index_name} версии {manifest['version']} переведено в компактный формат")
+
+    manifest["docstore"] = DOCSTORE_FORMAT
+    manifest["files"] = dict(sorted(manifest["files"].items()))
+    if remove_pickle:
+        for index_name in sizes:
+            manifest["files"].pop(f"{index_name}.pkl", None)
+    # Манифест обновляется до удаления .pkl: прерванный перевод оставляет рабочую версию
+    _write_json_atomic(os.path.join(bundle_path, BUNDLE_MANIFEST_NAME), manifest)
+    if remove_pickle:
+        for index_name in sizes:
+            os.remove(os.path.join(bundle_path, f"{index_name}.pkl"))
+            file_logger.info(f"Удален файл {index_name}.pkl версии {manifest['version']}")
+    return sizes
+
+
+def mapped_store_files(bundle_path: str, index_name: str, vector_store: FAISS) -> List[str]:
+    """Файлы хранилища, отображенные в память (прогреваются при загрузке)"""
+    files = []
+    if is_index_mapped(vector_store.index):
+        files.append(f"{index_name}.faiss")
+    if isinstance(vector_store.docstore, CompactDocstore):
+        files.extend([index_name + TABLE_SUFFIX, index_name + TEXT_SUFFIX])
+    return [os.path.join(bundle_path, name) for name in files]
+
+
+def load_index_bundle(version: str = None, bundles_dir: str = INDEX_BUNDLES_DIR,
+                      verify: bool = INDEX_BUNDLE_VERIFY, search_mode: str = RAG_SEARCH_MODE,
+                      use_mmap: bool = INDEX_MMAP, warmup: str = INDEX_WARMUP) -> Optional[IndexBundle]:
+    """
+    Загружает собранную версию индексов.
+
+    Аргументы:
+    - version: Имя версии (по умолчанию активная).
+    - bundles_dir: Каталог версий.
+    - verify: Проверять контрольные суммы файлов.
+    - search_mode: unified - загружается общий индекс, category - хранилища категорий.
+    - use_mmap: Отображать индексы в память (страницы разделяются рабочими процессами).
+    - warmup: Прогрев отображенных файлов: none, madvise или touch.
+
+    Возвращает:
+    - IndexBundle или None, если версия не найдена или не прошла проверку.
+    """
+    version = version or get_current_version(bundles_dir)
+    if version is None:
+        bundle_logger.error(f"Собранные индексы не найдены в {bundles_dir}. "
+                            f"Соберите их командой: PYTHONPATH=. python AI/build_index.py")
+        return None
+
+    bundle_path = os.path.join(bundles_dir, version)
+    try:
+        with open(os.path.join(bundle_path, BUNDLE_MANIFEST_NAME), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except Exception as e:
+        bundle_logger.error(f"Ошибка при чтении манифеста версии {version}: {e}")
+        return None
+
+    embeddings = CustomEmbeddings()
+    if manifest["model"] != embeddings.model_name or manifest["normalize"] != EMBEDDINGS_NORMALIZE:
+        bundle_logger.error(f"Версия {version} собрана для модели {manifest['model']} "
+                            f"(normalize={manifest['normalize']}), несовместимой с текущей")
+        return None
+    if verify and not verify_bundle(bundle_path, manifest):
+        return None
+
+    bundle = IndexBundle(version=version, path=bundle_path, manifest=manifest)
+    unified_info = manifest.get("unified")
+    if search_mode == 'unified' and unified_info:
+        unified_store = load_store(bundle_path, unified_info["index_name"], embeddings, use_mmap)
+        bundle.mapped_files.extend(mapped_store_files(bundle_path, unified_info["index_name"], unified_store))
+        compressed = is_compressed(unified_info.get("index_type", "flat"))
+        vectors_path = os.path.join(bundle_path, UNIFIED_VECTORS_FILE_NAME)
+        vectors = None
+        if compressed and os.path.exists(vectors_path):
+            # Отображенные полные векторы не загружаются в память: читаются только строки кандидатов
+            vectors = np.load(vectors_path, mmap_mode='r' if use_mmap else None)
+            if use_mmap:
+                bundle.mapped_files.append(vectors_path)
+        bundle.unified = UnifiedIndex(unified_store, unified_info["ranges"], compressed=compressed, vectors=vectors)
+    else:
+        # Хранилища категорий нужны только для поиска по категориям (и для версий без общего индекса)
+        for category, info in manifest["categories"].items():
+            bundle.stores[category] = load_store(bundle_path, info["index_name"], embeddings, use_mmap)
+            bundle.mapped_files.extend(mapped_store_files(bundle_path, info["index_name"], bundle.stores[category]))
+    if manifest.get("routing"):
+        bundle.router = CategoryRouter.load(bundle_path, manifest["routing"])
+    warm_up_files(bundle.mapped_files, warmup)
+
+    memory = process_memory()
+    bundle_logger.info(f"Загружена версия индексов {version}: {len(manifest['categories'])} категорий, "
+                       f"режим поиска {'unified' if bundle.unified else 'category'}, "
+                       f"отображено в память файлов: {len(bundle.mapped_files)}"
+                       + (f", RSS {memory['rss'] / 1024:.1f} МБ (PSS {memory['pss'] / 1024:.1f} МБ)" if memory else ""))
+    return bundle
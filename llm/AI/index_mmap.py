@@ -0,0 +1,102 @@
+import os
+import mmap
+import faiss
+from typing import Dict, Iterable, Optional
+from ann_index import is_index_mapped, is_ivf_index
+from logging_config import setup_logger
+
+# Инициализация логгера
+rag_logger = setup_logger('index_mmap', 'RAG_LOGGING')
+
+# Загрузка индексов через отображение файлов в память: страницы разделяются процессами через кеш страниц
+INDEX_MMAP = bool(int(os.getenv('INDEX_MMAP', '1')))
+# Прогрев отображенных файлов при загрузке: none, madvise (MADV_WILLNEED) или touch (чтение файла)
+INDEX_WARMUP = os.getenv('INDEX_WARMUP', 'madvise')
+
+WARMUP_MODES = ('none', 'madvise', 'touch')
+TOUCH_BLOCK_SIZE = 1 << 20  # Размер блока чтения при прогреве touch
+MMAP_IFC_SUPPORTED = hasattr(faiss, 'IO_FLAG_MMAP_IFC')  # Отображение кодов Flat/HNSW (faiss >= 1.11)
+
+
+def read_index(index_path: str, use_mmap: bool = INDEX_MMAP) -> faiss.Index:
+    """
+    Читает индекс faiss; при use_mmap данные индекса отображаются из файла только для чтения.
+
+    Инвертированные списки IVF (ivf_flat и сжатые типы) отображаются флагом IO_FLAG_MMAP, коды
+    Flat и HNSW - флагом IO_FLAG_MMAP_IFC (faiss >= 1.11). В старых версиях faiss Flat и HNSW
+    читаются в память процесса, о чем выводится предупреждение. Если отображение не поддерживается,
+    индекс читается обычным способом.
+    """
+    if use_mmap:
+        try:
+            if MMAP_IFC_SUPPORTED:
+                index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+                if not is_ivf_index(index):
+                    index.codes_mapped = True
+                    return index
+            # Инвертированные списки IVF отображаются только читателем файла (без IO_FLAG_MMAP_IFC)
+            index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+            if not is_index_mapped(index):
+                rag_logger.warning(f"Индекс {index_path} прочитан в память процесса: faiss {faiss.__version__} "
+                                   f"отображает только инвертированные списки IVF (Flat и HNSW - с faiss 1.11)")
+            return index
+        except RuntimeError as e:
+            rag_logger.warning(f"Не удалось отобразить {index_path} в память, обычное чтение: {e}")
+    return faiss.read_index(index_path)
+
+
+def warm_up_files(paths: Iterable[str], mode: str = INDEX_WARMUP):
+    """
+    Заранее загружает файлы в кеш страниц, чтобы первый запрос не ждал чтения с диска.
+
+    - madvise: асинхронная подсказка ядру (MADV_WILLNEED), загрузка не блокирует запуск;
+    - touch: последовательное чтение файлов, после которого все страницы гарантированно в кеше.
+    """
+    if mode not in WARMUP_MODES:
+        raise ValueError(f"Неизвестный режим прогрева: {mode} (допустимы: {', '.join(WARMUP_MODES)})")
+    if mode == 'none':
+        return
+    for path in paths:
+        with open(path, 'rb') as f:
+            if mode == 'touch':
+                while f.read(TOUCH_BLOCK_SIZE):
+                    pass
+            elif os.fstat(f.fileno()).st_size > 0:
+                if hasattr(mmap, 'MADV_WILLNEED'):
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                        mapped.madvise(mmap.MADV_WILLNEED)
+                elif hasattr(os, 'posix_fadvise'):
+                    os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+        rag_logger.info(f"Прогрев ({mode}): {path}")
+
+
+def evict_from_page_cache(paths: Iterable[str]):
+    """Просит ядро вытеснить файлы из кеша страниц (для измерения холодного запуска)"""
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    for path in paths:
+        with open(path, 'rb') as f:
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+def process_memory() -> Optional[Dict[str, int]]:
+    """
+    Память текущего процесса в КБ (Linux): rss, pss и разделяемая часть rss.
+
+    PSS делит разделяемые страницы между процессами, поэтому сумма PSS рабочих процессов
+    показывает реальный расход памяти. Возвращает None, если /proc недоступен.
+    """
+    try:
+        memory = {}
+        with open('/proc/self/smaps_rollup', 'r') as f:
+            for line in f:
+                name, _, value = line.partition(':')
+                if name in ('Rss', 'Pss', 'Shared_Clean', 'Shared_Dirty'):
+                    memory[name.lower()] = int(value.split()[0])
+        return {
+            "rss": memory.get("rss", 0),
+            "pss": memory.get("pss", 0),
+            "shared": memory.get("shared_clean", 0) + memory.get("shared_dirty", 0),
+        }
+    except OSError:
+        return None
@@ -0,0 +1,157 @@
+import os
+import signal
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Iterator, List, Optional
+from index_bundle import INDEX_BUNDLES_DIR, IndexBundle, get_current_version, load_index_bundle
+from logging_config import setup_logger
+
+# Инициализация логгера
+rag_logger = setup_logger('index_registry', 'RAG_LOGGING')
+
+# Период проверки указателя активной версии в секундах (0 - новые версии загружаются только по запросу)
+INDEX_RELOAD_INTERVAL = float(os.getenv('INDEX_RELOAD_INTERVAL', '30'))
+
+
+@dataclass
+class _RegistryEntry:
+    """Загруженная версия и количество поисков, которые ее используют"""
+    bundle: Optional[IndexBundle]
+    loaded_at: str = field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
+    refs: int = 0
+    retired: bool = False
+
+    @property
+    def version(self) -> Optional[str]:
+        return self.bundle.version if self.bundle else None
+
+
+class IndexRegistry:
+    """
+        Активная версия индексов с заменой без остановки сервера.
+
+        Новая версия загружается в фоне (наблюдатель за указателем CURRENT, сигнал SIGHUP или запрос
+        на перезагрузку) и подменяет активную атомарно. Поиск захватывает версию через acquire():
+        начатые поиски завершаются на прежней версии, которая освобождается, когда ее перестают
+        использовать. Модель эмбеддингов и сессии диалогов при замене не затрагиваются.
+    """
+
+    def __init__(self, bundles_dir: str = INDEX_BUNDLES_DIR):
+        self.bundles_dir = bundles_dir
+        self._lock = threading.Lock()  # Защищает активную версию и счетчики ссылок
+        self._reload_lock = threading.Lock()  # Одновременно выполняется одна загрузка
+        self._active = _RegistryEntry(bundle=None)
+        self._retired: List[_RegistryEntry] = []
+        self._failed_version: Optional[str] = None
+        self._stop = threading.Event()
+        self._watcher: Optional[threading.Thread] = None
+
+    @contextmanager
+    def acquire(self) -> Iterator[Optional[IndexBundle]]:
+        """Активная версия на время поиска (None, если версии нет)"""
+        with self._lock:
+            entry = self._active
+            entry.refs += 1
+        try:
+            yield entry.bundle
+        finally:
+            with self._lock:
+                entry.refs -= 1
+                if entry.retired and entry.refs == 0:
+                    self._release(entry)
+
+    def _release(self, entry: _RegistryEntry):
+        """Освобождает выведенную из работы версию (вызывается под self._lock)"""
+        self._retired.remove(entry)
+        rag_logger.info(f"Версия индексов {entry.version} освобождена")
+        entry.bundle = None
+
+    def reload(self, version: str = None, force: bool = False) -> dict:
+        """
+        Загружает версию и делает ее активной.
+
+        Аргументы:
+        - version: Имя версии (по умолчанию та, на которую указывает CURRENT).
+        - force: Перезагрузить, даже если версия уже активна.
+
+        Возвращает:
+        - Состояние реестра и результат перезагрузки (reloaded, error).
+        """
+        with self._reload_lock:
+            version = version or get_current_version(self.bundles_dir)
+            if version is None:
+                return {**self.status(), "reloaded": False, "error": "Активная версия индексов не найдена"}
+            if version == self._active.version and not force:
+                return {**self.status(), "reloaded": False, "error": None}
+            # Имя версии может прийти из запроса: допускается только каталог внутри bundles_dir
+            if os.path.basename(version) != version or version.startswith('.'):
+                return {**self.status(), "reloaded": False, "error": f"Недопустимое имя версии: {version}"}
+
+            # Загрузка выполняется без блокировки: поиск продолжает работать на текущей версии
+            bundle = load_index_bundle(version=version, bundles_dir=self.bundles_dir)
+            if bundle is None:
+                self._failed_version = version
+                rag_logger.error(f"Не удалось загрузить версию индексов {version}, активной остается "
+                                 f"{self._active.version}")
+                return {**self.status(), "reloaded": False, "error": f"Не удалось загрузить версию {version}"}
+
+            with self._lock:
+                previous, self._active = self._active, _RegistryEntry(bundle=bundle)
+                previous_version = previous.version
+                self._failed_version = None
+                if previous.bundle is not None:
+                    previous.retired = True
+                    self._retired.append(previous)
+                    if previous.refs == 0:
+                        self._release(previous)
+            rag_logger.info(f"Активная версия индексов: {version} (была {previous_version})")
+            return {**self.status(), "reloaded": True, "error": None}
+
+    def status(self) -> dict:
+        """Активная версия, количество выполняющихся поисков и версии, ожидающие освобождения"""
+        with self._lock:
+            return {
+                "version": self._active.version,
+                "loaded_at": self._active.loaded_at,
+                "in_flight": self._active.refs,
+                "draining": {entry.version: entry.refs for entry in self._retired},
+            }
+
+    def _watch(self, interval: float):
+        """Фоновая проверка указателя CURRENT"""
+        while not self._stop.wait(interval):
+            try:
+                version = get_current_version(self.bundles_dir)
+                # Версию, которую не удалось загрузить, повторно не загружаем до смены указателя
+                if version and version != self._active.version and version != self._failed_version:
+                    rag_logger.info(f"Обнаружена новая версия индексов: {version}")
+                    self.reload(version)
+            except Exception as e:
+                rag_logger.error(f"Ошибка при проверке новой версии индексов: {e}")
+
+    def start_watcher(self, interval: float = INDEX_RELOAD_INTERVAL):
+        """Запускает фоновое наблюдение за указателем активной версии"""
+        if interval <= 0 or self._watcher is not None:
+            return
+        self._watcher = threading.Thread(target=self._watch, args=(interval,), name='index-watcher', daemon=True)
+        self._watcher.start()
+        rag_logger.info(f"Наблюдение за версиями индексов в {self.bundles_dir} (каждые {interval:g} сек)")
+
+    def stop_watcher(self):
+        self._stop.set()
+        if self._watcher is not None:
+            self._watcher.join()
+            self._watcher = None
+
+    def install_signal_handler(self):
+        """Перезагрузка по сигналу SIGHUP (загрузка выполняется в отдельном потоке)"""
+        if not hasattr(signal, 'SIGHUP') or threading.current_thread() is not threading.main_thread():
+            return
+
+        def handle(signum, frame):
+            rag_logger.info("Получен SIGHUP: перезагрузка версии индексов")
+            threading.Thread(target=self.reload, name='index-reload', daemon=True).start()
+
+        signal.signal(signal.SIGHUP, handle)
@@ -0,0 +1,148 @@
+import os
+import json
+import time
+import shutil
+import numpy as np
+from typing import Callable, List, Tuple
+from langchain_core.documents import Document
+from logging_config import setup_logger
+
+# Инициализация логгера
+pdf_logger = setup_logger('ingestion_checkpoint', 'PDF_PROCESSING_LOGGING')
+
+# Периодичность контрольных точек: по количеству чанков или по времени (0 - отключено)
+INGESTION_CHECKPOINT_CHUNKS = int(os.getenv('INGESTION_CHECKPOINT_CHUNKS', '1024'))
+INGESTION_CHECKPOINT_SECONDS = float(os.getenv('INGESTION_CHECKPOINT_SECONDS', '60'))
+
+STATE_FILE_NAME = "state.json"
+
+
+def _fsync_replace(tmp_path: str, path: str):
+    """Сбрасывает файл на диск и атомарно переименовывает его"""
+    with open(tmp_path, 'rb+') as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class IngestionCheckpoint:
+    """
+        Контрольные точки обработки одного PDF.
+
+        Обработанные чанки сохраняются сегментами (эмбеддинги .npy, тексты и метаданные .json);
+        state.json перечисляет сегменты и счетчики и заменяется атомарно, поэтому сегменты,
+        записанные после последней контрольной точки, игнорируются. Точки ставятся только на
+        границах пакетов модели, поэтому после продолжения пакеты формируются так же, как без
+        прерывания, и итоговый индекс совпадает.
+    """
+
+    def __init__(self, directory: str, key: dict,
+                 every_chunks: int = INGESTION_CHECKPOINT_CHUNKS,
+                 every_seconds: float = INGESTION_CHECKPOINT_SECONDS):
+        """
+        Аргументы:
+        - directory: Каталог контрольных точек файла.
+        - key: Параметры, при изменении которых сохраненный прогресс недействителен.
+        - every_chunks: Записывать точку каждые every_chunks чанков.
+        - every_seconds: Записывать точку не реже, чем раз в every_seconds секунд.
+        """
+        self.directory = directory
+        self.key = key
+        self.every_chunks = every_chunks
+        self.every_seconds = every_seconds
+        self.state = self._load_state()
+        self._buffer: List[Tuple[List[Document], np.ndarray]] = []
+        self._buffered_chunks = 0
+        self._last_flush = time.monotonic()
+
+    @property
+    def enabled(self) -> bool:
+        return self.every_chunks > 0 or self.every_seconds > 0
+
+    def _empty_state(self) -> dict:
+        return {"key": self.key, "segments": [], "pages_done": 0, "chunks_in_done_pages": 0, "chunks_done": 0}
+
+    def _load_state(self) -> dict:
+        """Загружает состояние; прогресс с другими параметрами сборки отбрасывается"""
+        state_path = os.path.join(self.directory, STATE_FILE_NAME)
+        if os.path.exists(state_path):
+            try:
+                with open(state_path, 'r', encoding='utf-8') as f:
+                    state = json.load(f)
+                if state.get("key") == self.key:
+                    return state
+                pdf_logger.info(f"Контрольная точка {self.directory} создана с другими параметрами и будет удалена")
+            except Exception as e:
+                pdf_logger.error(f"Ошибка при чтении контрольной точки {state_path}: {e}")
+        shutil.rmtree(self.directory, ignore_errors=True)
+        return self._empty_state()
+
+    def resume(self, sink: Callable[[List[Document], np.ndarray], None]) -> Tuple[int, int, int]:
+        """
+        Передает потребителю сохраненные чанки.
+
+        Возвращает:
+        - Кортеж (первая страница для извлечения, сколько чанков этой страницы пропустить, чанков восстановлено).
+        """
+        self.read_segments(sink)
+        if self.state["chunks_done"]:
+            pdf_logger.info(f"Продолжение с контрольной точки: {self.state['chunks_done']} чанков, "
+                            f"страница {self.state['pages_done'] + 1}")
+        return (self.state["pages_done"],
+                self.state["chunks_done"] - self.state["chunks_in_done_pages"],
+                self.state["chunks_done"])
+
+    def read_segments(self, sink: Callable[[List[Document], np.ndarray], None]):
+        """Передает потребителю сохраненные сегменты по одному (в памяти находится один сегмент)"""
+        for segment in self.state["segments"]:
+            with open(os.path.join(self.directory, f"{segment}.json"), 'r', encoding='utf-8') as f:
+                records = json.load(f)
+            vectors = np.load(os.path.join(self.directory, f"{segment}.npy"))
+            sink([Document(page_content=text, metadata=metadata) for text, metadata in records], vectors)
+
+    def record(self, chunks: List[Document], vectors: np.ndarray):
+        """Учитывает обработанный пакет и записывает контрольную точку при достижении порога"""
+        if not self.enabled:
+            return
+        self._buffer.append((chunks, vectors))
+        self._buffered_chunks += len(chunks)
+        by_count = self.every_chunks > 0 and self._buffered_chunks >= self.every_chunks
+        by_time = self.every_seconds > 0 and time.monotonic() - self._last_flush >= self.every_seconds
+        if by_count or by_time:
+            self.flush()
+
+    def flush(self):
+        """Записывает накопленные пакеты новым сегментом и атомарно обновляет состояние"""
+        if not self._buffer:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        chunks = [chunk for batch, _ in self._buffer for chunk in batch]
+        segment = f"segment_{len(self.state['segments']):05d}"
+
+        vectors_path = os.path.join(self.directory, f"{segment}.npy")
+        with open(vectors_path + '.tmp', 'wb') as f:
+            np.save(f, np.vstack([vectors for _, vectors in self._buffer]))
+        _fsync_replace(vectors_path + '.tmp', vectors_path)
+        records_path = os.path.join(self.directory, f"{segment}.json")
+        with open(records_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump([(chunk.page_content, chunk.metadata) for chunk in chunks], f, ensure_ascii=False)
+        _fsync_replace(records_path + '.tmp', records_path)
+
+        # Страницы до страницы последнего чанка обработаны полностью (страницы идут по порядку)
+        state = self.state
+        for chunk in chunks:
+            page = chunk.metadata["page"]
+            if page > state["pages_done"]:
+                state["pages_done"] = page
+                state["chunks_in_done_pages"] = state["chunks_done"]
+            state["chunks_done"] += 1
+        state["segments"].append(segment)
+
+        state_path = os.path.join(self.directory, STATE_FILE_NAME)
+        with open(state_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False)
+        _fsync_replace(state_path + '.tmp', state_path)
+
+        self._buffer = []
+        self._buffered_chunks = 0
+        self._last_flush = time.monotonic()
+        pdf_logger.info(f"Контрольная точка {self.directory}: {state['chunks_done']} чанков")
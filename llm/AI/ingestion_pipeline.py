@@ -0,0 +1,239 @@
+import os
+import queue
+import threading
+import copy
+import time
+import itertools
+import faiss
+import numpy as np
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from text_preprocessing import clean_text, create_medical_text_splitter, add_token_counts
+from pdf_extraction import extract_pages
+from ingestion_checkpoint import IngestionCheckpoint
+from chunk_dedup import CHUNK_DEDUP_ENABLED, NearDuplicateFilter, DedupStats, dedup_chunks, log_dedup_savings
+from embeddings_handler import CustomEmbeddings
+from logging_config import setup_logger
+
+# Инициализация логгера
+pdf_logger = setup_logger('ingestion_pipeline', 'PDF_PROCESSING_LOGGING')
+
+# Параметры потоковой обработки
+INGESTION_QUEUE_SIZE = int(os.getenv('INGESTION_QUEUE_SIZE', '16'))  # Емкость очередей между этапами
+INGESTION_EMBED_BATCH = int(os.getenv('INGESTION_EMBED_BATCH', '128'))  # Чанков в одном вызове модели
+
+QUEUE_POLL_SECONDS = 0.5  # Период проверки флага остановки при ожидании очереди
+_DONE = object()  # Маркер завершения этапа
+
+
+class _StageFailure:
+    """Ошибка этапа, передаваемая по конвейеру вниз до потребителя"""
+    def __init__(self, error: Exception):
+        self.error = error
+
+
+def _put(out_queue: queue.Queue, item, stop: threading.Event) -> bool:
+    """Кладет элемент в очередь, ожидая место; возвращает False, если конвейер остановлен"""
+    while not stop.is_set():
+        try:
+            out_queue.put(item, timeout=QUEUE_POLL_SECONDS)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _iterate(in_queue: queue.Queue, stop: threading.Event) -> Iterator:
+    """Читает элементы очереди до маркера завершения; ошибки предыдущего этапа пробрасываются"""
+    while not stop.is_set():
+        try:
+            item = in_queue.get(timeout=QUEUE_POLL_SECONDS)
+        except queue.Empty:
+            continue
+        if item is _DONE:
+            return
+        if isinstance(item, _StageFailure):
+            raise item.error
+        yield item
+
+
+def _run_stage(items: Callable[[], Iterable], out_queue: queue.Queue, stop: threading.Event):
+    """Выполняет этап конвейера в отдельном потоке и передает результаты в очередь"""
+    try:
+        for item in items():
+            if not _put(out_queue, item, stop):
+                return
+        _put(out_queue, _DONE, stop)
+    except Exception as e:
+        _put(out_queue, _StageFailure(e), stop)
+
+
+def split_pages(pages: Iterable[Document], tokenizer) -> Iterator[Document]:
+    """Этап 2: очистка текста страницы и разбиение на чанки по бюджету токенов"""
+    text_splitter = create_medical_text_splitter(tokenizer)
+    for page in pages:
+        page.page_content = clean_text(page.page_content)
+        yield from add_token_counts(text_splitter.split_documents([page]), tokenizer)
+
+
+def embed_chunks(chunks: Iterable[Document], embeddings: CustomEmbeddings,
+                 batch_size: int) -> Iterator[Tuple[List[Document], np.ndarray]]:
+    """Этап 3: пакетное вычисление эмбеддингов чанков"""
+    batch = []
+    for chunk in chunks:
+        batch.append(chunk)
+        if len(batch) >= batch_size:
+            yield batch, _embed_batch(batch, embeddings)
+            batch = []
+    if batch:
+        yield batch, _embed_batch(batch, embeddings)
+
+
+def _embed_batch(batch: List[Document], embeddings: CustomEmbeddings) -> np.ndarray:
+    """Вычисляет эмбеддинги пакета чанков"""
+    vectors = embeddings.embed_documents_matrix([chunk.page_content for chunk in batch])
+    if len(vectors) != len(batch):
+        raise RuntimeError("Не удалось вычислить эмбеддинги пакета чанков")
+    return vectors
+
+
+def run_ingestion_pipeline(pdf_path: str, sink: Callable[[List[Document], np.ndarray], None],
+                           batch_size: int = INGESTION_EMBED_BATCH,
+                           checkpoint: Optional[IngestionCheckpoint] = None, concurrent_files: int = 1) -> int:
+    """
+    Потоковая обработка PDF: извлечение → очистка и разбиение → отбрасывание почти одинаковых чанков →
+    эмбеддинги → запись в индекс.
+
+    Этапы работают одновременно в отдельных потоках и связаны очередями ограниченной емкости,
+    поэтому пиковое потребление памяти не зависит от размера книги.
+
+    Аргументы:
+    - pdf_path: Путь к PDF файлу.
+    - sink: Потребитель пакетов (чанки, матрица эмбеддингов), вызывается в текущем потоке.
+    - batch_size: Количество чанков в одном вызове модели.
+    - checkpoint: Контрольные точки; сохраненный прогресс передается в sink, обработка продолжается с места остановки.
+    - concurrent_files: Количество файлов, обрабатываемых одновременно (ядра для извлечения делятся между ними).
+
+    Возвращает:
+    - Количество обработанных чанков.
+    """
+    embeddings = CustomEmbeddings()
+    # Этапы разбиения и эмбеддингов работают в разных потоках: быстрый токенизатор нельзя использовать одновременно
+    splitter_tokenizer = copy.deepcopy(embeddings.tokenizer)
+    dedup_filter = NearDuplicateFilter() if CHUNK_DEDUP_ENABLED else None
+    dedup_stats = DedupStats()
+    start_page, skip_chunks, total_chunks = _resume(checkpoint, sink, dedup_filter) if checkpoint else (0, 0, 0)
+    stop = threading.Event()
+    pages_queue = queue.Queue(maxsize=INGESTION_QUEUE_SIZE)
+    chunks_queue = queue.Queue(maxsize=INGESTION_QUEUE_SIZE * batch_size)
+    batches_queue = queue.Queue(maxsize=2)
+
+    stages = [
+        # Постраничное извлечение: весь файл в память не загружается
+        (lambda: extract_pages(pdf_path, start_page=start_page, concurrent_files=concurrent_files), pages_queue),
+        # Чанки первой страницы, уже сохраненные в контрольной точке, пропускаются
+        (lambda: itertools.islice(
+            _dedup(split_pages(_iterate(pages_queue, stop), splitter_tokenizer), dedup_filter, dedup_stats),
+            skip_chunks, None
+        ), chunks_queue),
+        (lambda: embed_chunks(_iterate(chunks_queue, stop), embeddings, batch_size), batches_queue),
+    ]
+    threads = [
+        threading.Thread(target=_run_stage, args=(items, out_queue, stop), daemon=True,
+                         name=f"ingestion-stage-{i}")
+        for i, (items, out_queue) in enumerate(stages, 1)
+    ]
+
+    pdf_logger.info(f"Потоковая обработка файла {pdf_path}")
+    start = time.perf_counter()
+    session_chunks = 0
+    session_tokens = 0
+    for thread in threads:
+        thread.start()
+    try:
+        for chunks, vectors in _iterate(batches_queue, stop):
+            sink(chunks, vectors)
+            if checkpoint:
+                checkpoint.record(chunks, vectors)
+            total_chunks += len(chunks)
+            session_chunks += len(chunks)
+            session_tokens += sum(chunk.metadata.get('token_count', 0) for chunk in chunks)
+            _log_progress(pdf_path, chunks[-1].metadata, start_page, total_chunks, session_chunks,
+                          time.perf_counter() - start)
+        if checkpoint:
+            checkpoint.flush()
+    finally:
+        stop.set() # Останавливаем этапы и при ошибке потребителя
+        for thread in threads:
+            thread.join()
+
+    if total_chunks:
+        pdf_logger.info(f"Файл {pdf_path} разбит на {total_chunks} чанков")
+    if session_chunks:
+        pdf_logger.info(f"Средний размер чанка: {session_tokens / session_chunks:.0f} токенов")
+        log_dedup_savings(pdf_path, dedup_stats, vectors.shape[1], session_tokens / (time.perf_counter() - start))
+    return total_chunks
+
+
+def _dedup(chunks: Iterable[Document], dedup_filter: Optional[NearDuplicateFilter],
+           stats: DedupStats) -> Iterable[Document]:
+    """Подключает этап дедупликации, если он включен"""
+    return dedup_chunks(chunks, dedup_filter, stats) if dedup_filter else chunks
+
+
+def _resume(checkpoint: IngestionCheckpoint, sink: Callable[[List[Document], np.ndarray], None],
+            dedup_filter: Optional[NearDuplicateFilter]) -> Tuple[int, int, int]:
+    """
+    Передает потребителю сохраненный прогресс и восстанавливает состояние дедупликации.
+
+    Фильтр заполняется чанками страниц, обработанных полностью: первая страница обрабатывается
+    заново, и решения по ее чанкам совпадают с решениями до прерывания.
+    """
+    restored = []
+
+    def restore(chunks: List[Document], vectors: np.ndarray):
+        sink(chunks, vectors)
+        restored.extend(chunks)
+
+    start_page, skip_chunks, chunks_done = checkpoint.resume(restore)
+    if dedup_filter:
+        for chunk in restored[:chunks_done - skip_chunks]:
+            dedup_filter.add(dedup_filter.signature(chunk.page_content))
+    return start_page, skip_chunks, chunks_done
+
+
+def _log_progress(pdf_path: str, last_metadata: dict, start_page: int, total_chunks: int,
+                  session_chunks: int, elapsed: float):
+    """Логирует прогресс обработки файла: страницы, скорость и оценку оставшегося времени"""
+    pages_done = last_metadata.get('page', 0) + 1
+    total_pages = last_metadata.get('total_pages')
+    pages_rate = (pages_done - start_page) / max(elapsed, 1e-9)
+    message = (f"{pdf_path}: записано {total_chunks} чанков ({session_chunks / max(elapsed, 1e-9):.1f} чанков/сек, "
+               f"{pages_rate:.1f} страниц/сек)")
+    if total_pages:
+        eta = (total_pages - pages_done) / max(pages_rate, 1e-9)
+        message += f", страница {pages_done}/{total_pages}, осталось ~{eta:.0f} сек"
+    pdf_logger.info(message)
+
+
+class VectorStoreSink:
+    """Потребитель конвейера, пополняющий индекс FAISS пакет за пакетом"""
+
+    def __init__(self, embeddings: CustomEmbeddings):
+        self.embeddings = embeddings
+        self.vector_store: Optional[FAISS] = None
+
+    def __call__(self, chunks: List[Document], vectors: np.ndarray):
+        texts = [chunk.page_content for chunk in chunks]
+        metadatas = [chunk.metadata for chunk in chunks]
+        if self.vector_store is None:
+            self.vector_store = FAISS(
+                embedding_function=self.embeddings,
+                index=faiss.IndexFlatL2(vectors.shape[1]),
+                docstore=InMemoryDocstore(),
+                index_to_docstore_id={},
+            )
+        self.vector_store.add_embeddings(zip(texts, vectors), metadatas=metadatas)
+
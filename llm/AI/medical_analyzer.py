@@ -1,12 +1,27 @@
-from dataclasses import dataclass
-from typing import List, Dict, Any
+import os
+import re
 import json
+import threading
+import time
+from dataclasses import dataclass
+from typing import List, Dict, Any, Optional, Set
 from logging_config import setup_logger
 
 # Инициализация логгеров
 med_logger = setup_logger('medical_analyzer', 'MEDICAL_ANALYZER_LOGGING')
 file_logger = setup_logger('medical_analyzer_file', 'FILE_OPERATIONS_LOGGING')
 
+MEDICAL_TERMS_PATH = os.getenv(
+    'MEDICAL_TERMS_PATH',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'medical_terms.json')
+)
+# Сколько букв может следовать за термином в слове (падежные окончания: "боль" -> "болью")
+MEDICAL_TERMS_MAX_SUFFIX = int(os.getenv('MEDICAL_TERMS_MAX_SUFFIX', '3'))
+# Период проверки изменения файла терминов в секундах (0 - файл загружается один раз)
+MEDICAL_TERMS_CHECK_INTERVAL = float(os.getenv('MEDICAL_TERMS_CHECK_INTERVAL', '5'))
+
+WORD_PATTERN = re.compile(r'\w+')
+
 @dataclass
 class SearchResult:
     """Структура для хранения результата поиска"""
@@ -19,60 +34,170 @@ class SearchResult:
     diagnostic_match: bool = False
     treatment_match: bool = False
 
+class MedicalTermMatcher:
+    """
+        Поиск медицинских терминов за один проход по словам текста.
+
+        Термин находится только с начала слова, за ним может следовать не больше max_suffix букв
+        окончания: "кт" не находится внутри "эффект", а "терапия" — внутри "химиотерапия".
+        Составные термины ("лучевая терапия") сопоставляются по последовательности слов.
+        Время поиска зависит от длины текста, а не от количества терминов.
+    """
+
+    def __init__(self, terms: Dict[str, List[str]], max_suffix: int = MEDICAL_TERMS_MAX_SUFFIX):
+        self.terms = terms
+        self.max_suffix = max_suffix
+        # (категория, термин, нормализованный термин) в порядке файла
+        self._order = [(category, term, ' '.join(term.lower().split()))
+                       for category, category_terms in terms.items() for term in category_terms]
+        normalized = {key for _, _, key in self._order if key}
+        self._single = {key for key in normalized if ' ' not in key}
+        self._compound: Dict[str, List[List[str]]] = {}  # Первое слово -> слова составных терминов
+        for key in normalized:
+            if ' ' in key:
+                words = key.split()
+                self._compound.setdefault(words[0], []).append(words)
+        self._min_length = min((len(key.split()[0]) for key in normalized), default=1)
+
+    def _word_matches(self, word: str, term: str) -> bool:
+        return word.startswith(term) and len(word) - len(term) <= self.max_suffix
+
+    def _stem(self, word: str, candidates) -> Optional[str]:
+        """Самый длинный термин из candidates, которым начинается слово"""
+        for cut in range(0, min(self.max_suffix, len(word) - self._min_length) + 1):
+            stem = word[:len(word) - cut]
+            if stem in candidates:
+                return stem
+        return None
+
+    def match(self, text: str) -> Set[str]:
+        """Термины, найденные в тексте"""
+        words = WORD_PATTERN.findall(text.lower())
+        found = set()
+        starts = {}  # Слова текста, с которых может начинаться составной термин
+        for word in set(words):  # Повторяющиеся слова проверяются один раз
+            term = self._stem(word, self._single)
+            if term is not None:
+                found.add(term)
+            if self._compound:
+                first = self._stem(word, self._compound)
+                if first is not None:
+                    starts[word] = first
+        if starts:
+            for i, word in enumerate(words):
+                if word not in starts:
+                    continue
+                for term_words in self._compound[starts[word]]:
+                    following = words[i + 1:i + len(term_words)]
+                    if len(following) == len(term_words) - 1 and all(
+                            self._word_matches(next_word, term_word)
+                            for next_word, term_word in zip(following, term_words[1:])):
+                        found.add(' '.join(term_words))
+        return found
+
+    def find_terms(self, text: str) -> Dict[str, List[str]]:
+        """Найденные термины по категориям {категория: [термины]} в порядке файла терминов"""
+        found = self.match(text)
+        result: Dict[str, List[str]] = {}
+        if found:
+            for category, term, key in self._order:
+                if key in found:
+                    result.setdefault(category, []).append(term)
+        return result
+
+
+def load_medical_terms(path: str = MEDICAL_TERMS_PATH) -> Dict[str, List[str]]:
+    """Загружает медицинские термины из JSON файла"""
+    try:
+        file_logger.info(f"Загрузка медицинских терминов из файла {path}")
+        with open(path, 'r', encoding='utf-8') as f:
+            terms = json.load(f)
+        file_logger.info(f"Загружено {sum(len(v) for v in terms.values())} терминов из {len(terms)} категорий")
+        return terms
+    except Exception as e:
+        file_logger.error(f"Ошибка при загрузке medical_terms.json: {e}")
+        return {}
+
+
+def _file_signature(path: str):
+    try:
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+    except OSError:
+        return None
+
+
+_matcher: Optional[MedicalTermMatcher] = None
+_matcher_signature = None
+_matcher_checked_at = 0.0
+_matcher_lock = threading.Lock()
+
+
+def get_term_matcher() -> MedicalTermMatcher:
+    """
+    Общий для процесса поиск терминов. Файл терминов проверяется не чаще раза
+    в MEDICAL_TERMS_CHECK_INTERVAL секунд и при изменении загружается заново;
+    если новый файл прочитать не удалось, остаются прежние термины.
+    """
+    global _matcher, _matcher_signature, _matcher_checked_at
+    matcher = _matcher
+    if matcher is not None and (MEDICAL_TERMS_CHECK_INTERVAL <= 0
+                                or time.monotonic() - _matcher_checked_at < MEDICAL_TERMS_CHECK_INTERVAL):
+        return matcher
+    with _matcher_lock:
+        if _matcher is not None and time.monotonic() - _matcher_checked_at < MEDICAL_TERMS_CHECK_INTERVAL:
+            return _matcher
+        _matcher_checked_at = time.monotonic()
+        signature = _file_signature(MEDICAL_TERMS_PATH)
+        if _matcher is None or signature != _matcher_signature:
+            terms = load_medical_terms(MEDICAL_TERMS_PATH)
+            if terms or _matcher is None:
+                _matcher = MedicalTermMatcher(terms)
+                med_logger.info("Поиск медицинских терминов перестроен")
+            _matcher_signature = signature
+        return _matcher
+
+
 class MedicalContextAnalyzer:
     """Анализатор медицинского контекста"""
-    
+
     def __init__(self):
-        """Инициализация анализатора и загрузка медицинских терминов"""
-        med_logger.info("Инициализация медицинского анализатора")
-        self.medical_terms = self._load_medical_terms()
-    
-    @staticmethod
-    def _load_medical_terms() -> Dict[str, List[str]]:
-        """Загружает медицинские термины из JSON файла"""
-        try:
-            file_logger.info("Загрузка медицинских терминов из файла")
-            with open('../medical_terms.json', 'r', encoding='utf-8') as f:
-                terms = json.load(f)
-            file_logger.info(f"Загружено {sum(len(v) for v in terms.values())} терминов из {len(terms)} категорий")
-            return terms
-        except Exception as e:
-            file_logger.error(f"Ошибка при загрузке medical_terms.json: {e}")
-            return {}
-    
+        """Инициализация анализатора: термины берутся из общего для процесса поиска терминов"""
+        self.matcher = get_term_matcher()
+
+    @property
+    def medical_terms(self) -> Dict[str, List[str]]:
+        return self.matcher.terms
+
+    def find_terms(self, text: str) -> Dict[str, List[str]]:
+        """Находит медицинские термины в тексте по категориям {категория: [термины]}"""
+        return self.matcher.find_terms(text)
+
     def find_medical_terms(self, text: str) -> List[str]:
-        """Находит медицинские термины в тексте"""
-        found_terms = []
-        text_lower = text.lower()
-        
-        med_logger.info("Поиск медицинских терминов в тексте")
-        for category, terms in self.medical_terms.items():
-            category_terms = []
-            for term in terms:
-                if term in text_lower:
-                    category_terms.append(term)
-            if category_terms:
-                med_logger.info(f"Найдены термины в категории {category}: {', '.join(category_terms)}")
-                found_terms.extend(category_terms)
-        
+        """Находит медицинские термины в тексте (каждый термин один раз)"""
+        found_terms = list(dict.fromkeys(term for terms in self.find_terms(text).values() for term in terms))
         if found_terms:
-            med_logger.info(f"Всего найдено терминов: {len(found_terms)}")
+            med_logger.info(f"Найдено терминов: {len(found_terms)} ({', '.join(found_terms)})")
         else:
             med_logger.info("Медицинские термины не найдены")
         return found_terms
 
-    def calculate_medical_relevance(self, text: str, query: str) -> float:
-        """Рассчитывает медицинскую релевантность текста"""
-        text_terms = set(self.find_medical_terms(text))
-        query_terms = set(self.find_medical_terms(query))
-        
+    def calculate_medical_relevance(self, text: str, query: str, text_terms: List[str] = None,
+                                    query_terms: List[str] = None) -> float:
+        """
+        Рассчитывает медицинскую релевантность текста.
+        Уже найденные термины текста и запроса можно передать, чтобы не искать их повторно.
+        """
+        text_terms = set(self.find_medical_terms(text) if text_terms is None else text_terms)
+        query_terms = set(self.find_medical_terms(query) if query_terms is None else query_terms)
+
         if not text_terms:
             med_logger.info("Текст не содержит медицинских терминов")
             return 0.0
-            
+
         term_overlap = len(text_terms.intersection(query_terms))
         term_score = term_overlap / len(text_terms) if text_terms else 0
-        
+
         med_logger.info(f"Релевантность текста: {term_score:.2%} "
                        f"(совпадение {term_overlap} из {len(text_terms)} терминов)")
-        return term_score
\ No newline at end of file
+        return term_score
@@ -0,0 +1,33 @@
+"""
+Перевод хранилищ чанков собранных версий индексов из pickle (InMemoryDocstore) в компактный формат.
+
+Новые версии сразу собираются в компактном формате; перевод нужен для версий, собранных раньше.
+Каждый документ после перевода сверяется с исходным, затем обновляется манифест версии.
+
+Запуск (из каталога llm):
+    PYTHONPATH=. python AI/migrate_docstore.py --remove-pkl
+"""
+import os
+import argparse
+from index_bundle import INDEX_BUNDLES_DIR, migrate_bundle_docstore
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Перевод хранилищ чанков версий индексов в компактный формат")
+    parser.add_argument('versions', nargs='*', help="Версии для перевода (по умолчанию все)")
+    parser.add_argument('--bundles-dir', default=INDEX_BUNDLES_DIR, help="Каталог версий индексов")
+    parser.add_argument('--remove-pkl', action='store_true', help="Удалить файлы .pkl после перевода")
+    args = parser.parse_args()
+
+    versions = args.versions or sorted(
+        name for name in os.listdir(args.bundles_dir)
+        if not name.startswith('.') and os.path.isdir(os.path.join(args.bundles_dir, name))
+    )
+    for version in versions:
+        sizes = migrate_bundle_docstore(os.path.join(args.bundles_dir, version), args.remove_pkl)
+        for index_name, (pickle_bytes, compact_bytes) in sizes.items():
+            print(f"{version} {index_name}: {pickle_bytes / 2**20:.2f} МБ → {compact_bytes / 2**20:.2f} МБ")
+
+
+if __name__ == '__main__':
+    main()
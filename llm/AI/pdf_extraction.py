@@ -0,0 +1,127 @@
+import os
+import time
+import multiprocessing
+import fitz
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Tuple
+from pypdf import PdfReader
+from langchain_core.documents import Document
+from logging_config import setup_logger
+
+# Инициализация логгера
+file_logger = setup_logger('pdf_extraction', 'FILE_OPERATIONS_LOGGING')
+
+# Способ извлечения текста: pymupdf (быстрый, параллельный по страницам) или pypdf (запасной)
+PDF_EXTRACTOR = os.getenv('PDF_EXTRACTOR', 'pymupdf')
+PDF_EXTRACTION_WORKERS = int(os.getenv('PDF_EXTRACTION_WORKERS', '0'))  # Процессов на файл (0 - автоподбор)
+PDF_EXTRACTION_PAGES_PER_TASK = int(os.getenv('PDF_EXTRACTION_PAGES_PER_TASK', '32'))  # Страниц в одной задаче
+
+
+def resolve_extraction_workers(page_count: int, concurrent_files: int = 1) -> int:
+    """
+    Количество процессов извлечения: внутри процесса ингестии страницы читаются последовательно,
+    а ядра делятся между файлами, которые обрабатываются одновременно (потоки ингестии).
+    """
+    if PDF_EXTRACTION_WORKERS > 0:
+        return PDF_EXTRACTION_WORKERS
+    if multiprocessing.parent_process() is not None: # Параллелизм уже обеспечен пулом ингестии
+        return 1
+    cpu_share = multiprocessing.cpu_count() // max(1, concurrent_files)
+    return max(1, min(cpu_share, -(-page_count // PDF_EXTRACTION_PAGES_PER_TASK)))
+
+
+def _extract_page_range(pdf_path: str, start: int, end: int) -> List[Tuple[int, str]]:
+    """Извлекает текст страниц [start, end) в отдельном процессе"""
+    with fitz.open(pdf_path) as document:
+        return [(page_num, document.load_page(page_num).get_text("text")) for page_num in range(start, end)]
+
+
+def _page_document(pdf_path: str, page_num: int, text: str, page_count: int) -> Document:
+    """Создает документ страницы (метаданные одинаковы для всех способов извлечения)"""
+    return Document(page_content=text, metadata={"source": pdf_path, "page": page_num, "total_pages": page_count})
+
+
+def extract_pages_pymupdf(pdf_path: str, workers: int = None, start_page: int = 0,
+                          concurrent_files: int = 1) -> Iterator[Document]:
+    """
+    Постраничное извлечение текста PyMuPDF; диапазоны страниц распределяются между процессами.
+
+    Аргументы:
+    - pdf_path: Путь к PDF файлу.
+    - workers: Количество процессов (по умолчанию подбирается автоматически).
+    - start_page: Номер первой извлекаемой страницы (продолжение прерванной обработки).
+    - concurrent_files: Количество файлов, извлекаемых одновременно (для автоподбора процессов).
+
+    Возвращает:
+    - Итератор документов страниц в порядке следования.
+    """
+    with fitz.open(pdf_path) as document:
+        page_count = len(document)
+    workers = workers or resolve_extraction_workers(page_count - start_page, concurrent_files)
+    ranges = [(start, min(start + PDF_EXTRACTION_PAGES_PER_TASK, page_count))
+              for start in range(start_page, page_count, PDF_EXTRACTION_PAGES_PER_TASK)]
+
+    start_time = time.perf_counter()
+    if workers <= 1 or len(ranges) <= 1:
+        with fitz.open(pdf_path) as document:
+            for page_num in range(start_page, page_count):
+                yield _page_document(pdf_path, page_num, document.load_page(page_num).get_text("text"), page_count)
+    else:
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            # Отправляем задачи окнами, чтобы в памяти не накапливался текст всей книги
+            window = workers * 2
+            pending = [executor.submit(_extract_page_range, pdf_path, *page_range) for page_range in ranges[:window]]
+            next_range = window
+            while pending:
+                pages = pending.pop(0).result()
+                if next_range < len(ranges):
+                    pending.append(executor.submit(_extract_page_range, pdf_path, *ranges[next_range]))
+                    next_range += 1
+                for page_num, text in pages:
+                    yield _page_document(pdf_path, page_num, text, page_count)
+
+    elapsed = time.perf_counter() - start_time
+    extracted = page_count - start_page
+    file_logger.info(f"PyMuPDF: извлечено {extracted} страниц из {pdf_path} в {workers} процессах "
+                     f"({extracted / max(elapsed, 1e-9):.1f} страниц/сек)")
+
+
+def extract_pages_pypdf(pdf_path: str, start_page: int = 0, end_page: int = None) -> Iterator[Document]:
+    """
+    Постраничное извлечение текста pypdf (медленный запасной вариант).
+
+    Разбираются только страницы [start_page, end_page): pypdf читает содержимое страницы
+    при обращении к ней, поэтому пропущенные страницы не обрабатываются.
+    """
+    start_time = time.perf_counter()
+    extracted = 0
+    reader = PdfReader(pdf_path)
+    page_count = len(reader.pages)
+    end_page = page_count if end_page is None else min(end_page, page_count)
+    for page_num in range(start_page, end_page):
+        yield _page_document(pdf_path, page_num, reader.pages[page_num].extract_text(), page_count)
+        extracted += 1
+    elapsed = time.perf_counter() - start_time
+    file_logger.info(f"PyPDF: извлечено {extracted} страниц из {pdf_path} "
+                     f"({extracted / max(elapsed, 1e-9):.1f} страниц/сек)")
+
+
+def extract_pages(pdf_path: str, extractor: str = None, start_page: int = 0,
+                  concurrent_files: int = 1) -> Iterator[Document]:
+    """
+    Постраничное извлечение текста выбранным способом.
+
+    Аргументы:
+    - pdf_path: Путь к PDF файлу.
+    - extractor: pymupdf или pypdf (по умолчанию PDF_EXTRACTOR).
+    - start_page: Номер первой извлекаемой страницы.
+    - concurrent_files: Количество файлов, извлекаемых одновременно.
+
+    Возвращает:
+    - Итератор документов страниц с метаданными source и page.
+    """
+    extractor = extractor or PDF_EXTRACTOR
+    if extractor == 'pypdf':
+        return extract_pages_pypdf(pdf_path, start_page=start_page)
+    return extract_pages_pymupdf(pdf_path, start_page=start_page, concurrent_files=concurrent_files)
@@ -1,14 +1,21 @@
 import os
 import glob
-import threading
-import hashlib
-from concurrent.futures import ThreadPoolExecutor
+import json
+import shutil
+import functools
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 import multiprocessing
-from typing import Dict, Tuple, Optional
-from langchain_community.document_loaders import PyPDFLoader
+from dataclasses import dataclass
+from typing import Dict, List, Tuple, Optional
 from langchain_community.vectorstores import FAISS
-from text_preprocessing import clean_text, create_medical_text_splitter
+from text_preprocessing import TEXT_SPLITTER_CHUNK_TOKENS, TEXT_SPLITTER_OVERLAP_TOKENS
+from ingestion_pipeline import run_ingestion_pipeline, VectorStoreSink, INGESTION_EMBED_BATCH
+from ingestion_checkpoint import IngestionCheckpoint
+from pdf_extraction import PDF_EXTRACTOR
+from chunk_dedup import get_dedup_params
+from file_manifest import FileManifest
 from embeddings_handler import CustomEmbeddings
+from embedding_backends import set_default_num_threads
 from logging_config import setup_logger
 
 # Инициализация логгеров
@@ -16,7 +23,16 @@ pdf_logger = setup_logger('pdf_processor', 'PDF_PROCESSING_LOGGING')
 file_logger = setup_logger('pdf_processor_file', 'FILE_OPERATIONS_LOGGING')
 
 NUMBER_OF_CORES = max(1, multiprocessing.cpu_count() - 1)
+
+# Режим ингестии: process - пул процессов с собственной копией модели, thread - пул потоков в текущем процессе
+INGESTION_MODE = os.getenv('INGESTION_MODE', 'process')
+INGESTION_WORKERS = int(os.getenv('INGESTION_WORKERS', '0'))  # Количество процессов (0 - автоподбор)
+INGESTION_THREADS_PER_WORKER = int(os.getenv('INGESTION_THREADS_PER_WORKER', '0'))  # Потоки torch на процесс (0 - автоподбор)
 VECTOR_STORE_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "vector_stores")
+MANIFEST_FILE_NAME = "manifest.json"
+FILE_MANIFEST_PATH = os.path.join(VECTOR_STORE_DIR, "files_manifest.json")
+CHECKPOINTS_DIR_NAME = "checkpoints"  # Контрольные точки незавершенной обработки файлов
+WORKER_SEGMENT_CHUNKS = 1024  # Чанков в сегменте процесса ингестии, если контрольные точки отключены
 PDF_CATEGORIES = {
     'акушерство': os.path.join(os.path.dirname(os.path.dirname(__file__)), 'medical_books/obstetrics/*.pdf'),
     'кардиология': os.path.join(os.path.dirname(os.path.dirname(__file__)), 'medical_books/cardiology/*.pdf'),
@@ -28,154 +44,344 @@ PDF_CATEGORIES = {
     'хирургия': os.path.join(os.path.dirname(os.path.dirname(__file__)), 'medical_books/surgery/*.pdf')
 }
 
-def calculate_files_hash(file_paths: list) -> str:
-    """Вычисляет общий хеш для списка файлов"""
-    hasher = hashlib.md5()
-    file_logger.info(f"Вычисление хеша для {len(file_paths)} файлов")
-    for file_path in sorted(file_paths):  # Сортируем для стабильности хеша
+TRANSLIT_MAP = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'yo',
+    'ж': 'zh', 'з': 'z', 'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm',
+    'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u',
+    'ф': 'f', 'х': 'h', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'sch',
+    'ъ': '', 'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya'
+}
+
+@dataclass
+class ShardTask:
+    """Задача построения индекса (шарда) для одного PDF файла"""
+    category: str
+    pdf_path: str
+    file_name: str
+    file_hash: str
+
+def get_category_index_name(category: str) -> str:
+    """Возвращает имя индекса категории (транслитерация названия категории)"""
+    return ''.join(TRANSLIT_MAP.get(c.lower(), c) for c in category)
+
+def get_category_dir(category: str) -> str:
+    """Возвращает каталог шардов категории"""
+    return os.path.join(VECTOR_STORE_DIR, get_category_index_name(category))
+
+def get_checkpoint_dir(task: 'ShardTask') -> str:
+    """Возвращает каталог контрольных точек обработки файла"""
+    return os.path.join(VECTOR_STORE_DIR, CHECKPOINTS_DIR_NAME, get_category_index_name(task.category),
+                        task.file_hash[:16])
+
+def get_build_params() -> dict:
+    """Параметры сборки: при их изменении все шарды перестраиваются"""
+    return {
+        "embeddings": CustomEmbeddings().cache_namespace,
+        "extractor": PDF_EXTRACTOR,
+        "chunk_tokens": TEXT_SPLITTER_CHUNK_TOKENS,
+        "overlap_tokens": TEXT_SPLITTER_OVERLAP_TOKENS,
+        "dedup": get_dedup_params(),
+    }
+
+def load_category_manifest(category: str) -> dict:
+    """Загружает манифест категории (список шардов и хешей исходных файлов)"""
+    manifest_path = os.path.join(get_category_dir(category), MANIFEST_FILE_NAME)
+    if os.path.exists(manifest_path):
         try:
-            with open(file_path, 'rb') as f:
-                # Читаем файл блоками для экономии памяти
-                for chunk in iter(lambda: f.read(4096), b''):
-                    hasher.update(chunk)
-            file_logger.info(f"Обработан файл: {file_path}")
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
         except Exception as e:
-            file_logger.error(f"Ошибка при чтении файла {file_path}: {e}")
-    return hasher.hexdigest()
-
-def get_category_hash(category: str, file_paths: list) -> str:
-    """Создает уникальный идентификатор для категории на основе содержимого файлов"""
-    files_hash = calculate_files_hash(file_paths)
-    
-    # Транслитерация категории
-    translit_map = {
-        'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'yo',
-        'ж': 'zh', 'з': 'z', 'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm',
-        'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u',
-        'ф': 'f', 'х': 'h', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'sch',
-        'ъ': '', 'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya'
-    }
-    
-    category_en = ''.join(translit_map.get(c.lower(), c) for c in category)
-    
-    # Создаем идентификатор только из хеша файлов
-    category_id = f"{category_en}_{files_hash[:8]}"
-    file_logger.info(f"Создан идентификатор для категории {category}: {category_id}")
-    return category_id
-
-def process_single_pdf(args: Tuple[str, str, str]) -> Optional[Tuple[str, FAISS]]:
-    """Обрабатывает один PDF файл и возвращает его векторное хранилище"""
-    category, pdf_path, category_id = args
-    vector_store_path = os.path.join(VECTOR_STORE_DIR, f"{category_id}.faiss")
-    index_path = os.path.join(VECTOR_STORE_DIR, f"{category_id}.pkl")
-    embeddings = CustomEmbeddings()
-    
+            file_logger.error(f"Ошибка при чтении манифеста {manifest_path}: {e}")
+    return {"category": category, "build_params": None, "shards": {}}
+
+def save_category_manifest(category: str, manifest: dict):
+    """Атомарно сохраняет манифест категории"""
+    category_dir = get_category_dir(category)
+    os.makedirs(category_dir, exist_ok=True)
+    manifest_path = os.path.join(category_dir, MANIFEST_FILE_NAME)
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+def shard_files(category: str, shard_id: str) -> Tuple[str, str]:
+    """Пути к файлам индекса и docstore шарда"""
+    category_dir = get_category_dir(category)
+    return os.path.join(category_dir, f"{shard_id}.faiss"), os.path.join(category_dir, f"{shard_id}.pkl")
+
+def shard_exists(category: str, shard_id: Optional[str]) -> bool:
+    """Проверяет наличие обоих файлов шарда (шард без текста не имеет файлов)"""
+    if shard_id is None:
+        return True
+    return all(os.path.exists(path) for path in shard_files(category, shard_id))
+
+def remove_shard(category: str, shard_id: Optional[str]):
+    """Удаляет файлы шарда"""
+    if shard_id is None:
+        return
+    for path in shard_files(category, shard_id):
+        try:
+            os.remove(path)
+            file_logger.info(f"Удален файл шарда: {path}")
+        except FileNotFoundError:
+            pass
+
+def open_checkpoint(checkpoint_dir: Optional[str], required: bool = False) -> Optional[IngestionCheckpoint]:
+    """
+    Открывает контрольные точки файла; прогресс действителен только при тех же параметрах сборки.
+
+    Аргументы:
+    - checkpoint_dir: Каталог контрольных точек файла.
+    - required: Сегменты передают результат процесса ингестии, поэтому запись не отключается.
+    """
+    if checkpoint_dir is None:
+        return None
+    checkpoint = IngestionCheckpoint(checkpoint_dir, {"build_params": get_build_params(), "batch_size": INGESTION_EMBED_BATCH})
+    if required and not checkpoint.enabled:
+        checkpoint.every_chunks = WORKER_SEGMENT_CHUNKS
+    return checkpoint
+
+def embed_pdf_to_segments(pdf_path: str, checkpoint_dir: str) -> int:
+    """
+    Извлекает текст из PDF, разбивает его на чанки и вычисляет эмбеддинги (потоковый конвейер).
+
+    Эмбеддинги не накапливаются в памяти: пакеты записываются сегментами в каталог контрольных точек,
+    индекс собирается из них функцией vector_store_from_segments.
+
+    Аргументы:
+    - pdf_path: Путь к PDF файлу.
+    - checkpoint_dir: Каталог контрольных точек (обработка продолжается с последней точки).
+
+    Возвращает:
+    - Количество чанков (0, если текст не найден).
+    """
+    checkpoint = open_checkpoint(checkpoint_dir, required=True)
+    return run_ingestion_pipeline(pdf_path, lambda chunks, vectors: None, checkpoint=checkpoint)
+
+def build_pdf_vector_store(pdf_path: str, checkpoint_dir: str = None, concurrent_files: int = 1) -> Optional[FAISS]:
+    """Строит индекс PDF, пополняя его по мере вычисления эмбеддингов (None, если текст не найден)"""
+    sink = VectorStoreSink(CustomEmbeddings())
+    run_ingestion_pipeline(pdf_path, sink, checkpoint=open_checkpoint(checkpoint_dir), concurrent_files=concurrent_files)
+    return sink.vector_store
+
+def vector_store_from_segments(checkpoint_dir: str) -> Optional[FAISS]:
+    """Создает индекс из сегментов, записанных процессом ингестии (сегменты читаются по одному)"""
+    sink = VectorStoreSink(CustomEmbeddings())
+    open_checkpoint(checkpoint_dir).read_segments(sink)
+    return sink.vector_store
+
+def save_shard(category: str, shard_id: str, vector_store: FAISS):
+    """Сохраняет индекс шарда на диск"""
+    vector_store.save_local(folder_path=get_category_dir(category), index_name=shard_id)
+    pdf_logger.info(f"Сохранен шард {shard_id} категории {category} ({vector_store.index.ntotal} чанков)")
+
+def load_shard(category: str, shard_id: str) -> Optional[FAISS]:
+    """Загружает шард; поврежденные файлы удаляются, чтобы шард был перестроен при следующем запуске"""
     try:
-        # Проверяем существование обоих файлов
-        if not (os.path.exists(vector_store_path) and os.path.exists(index_path)):
-            pdf_logger.info(f"Обработка файла {pdf_path}")
-            loader = PyPDFLoader(pdf_path)
-            documents = loader.load()
-            
-            if documents:
-                # Очищаем и подготавливаем текст
-                for doc in documents:
-                    doc.page_content = clean_text(doc.page_content)
-                
-                # Используем оптимизированный разделитель
-                text_splitter = create_medical_text_splitter()
-                texts = text_splitter.split_documents(documents)
-                
-                pdf_logger.info(f"Файл {pdf_path} разбит на {len(texts)} чанков")
-                pdf_logger.info(f"Средний размер чанка: {sum(len(t.page_content) for t in texts) / len(texts):.0f} символов")
-                
-                vector_store = FAISS.from_documents(texts, embeddings)
-                # Сохраняем оба файла
-                vector_store.save_local(
-                    folder_path=VECTOR_STORE_DIR,
-                    index_name=category_id
-                )
-                pdf_logger.info(f"Сохранены эмбеддинги для {category_id}")
-                
-                return category, vector_store
+        return FAISS.load_local(
+            folder_path=get_category_dir(category),
+            index_name=shard_id,
+            embeddings=CustomEmbeddings(),
+            allow_dangerous_deserialization=True
+        )
+    except Exception as e:
+        pdf_logger.error(f"Ошибка при загрузке шарда {shard_id} категории {category}: {e}")
+        remove_shard(category, shard_id)
+        return None
+
+def plan_category(category: str, pdf_files: List[str], manifest: dict, file_manifest: FileManifest) -> List[ShardTask]:
+    """
+    Сравнивает PDF файлы категории с манифестом.
+
+    Удаляет шарды исчезнувших файлов и возвращает задачи только для новых и измененных файлов.
+    """
+    build_params = get_build_params()
+    if manifest.get("build_params") != build_params:
+        if manifest["shards"]:
+            pdf_logger.info(f"Параметры сборки категории {category} изменились, шарды будут перестроены")
+        for entry in manifest["shards"].values():
+            remove_shard(category, entry["shard"])
+        manifest["shards"] = {}
+        manifest["build_params"] = build_params
+
+    tasks = []
+    current_files = {}
+    unreadable_files = set()
+    for pdf_path in sorted(pdf_files):
+        file_name = os.path.basename(pdf_path)
+        try:
+            current_files[file_name] = file_manifest.file_hash(pdf_path)
+        except Exception as e:
+            file_logger.error(f"Ошибка при чтении файла {pdf_path}: {e}")
+            unreadable_files.add(file_name) # Шард такого файла сохраняется до следующей попытки
+            continue
+        entry = manifest["shards"].get(file_name)
+        if entry is None or entry["hash"] != current_files[file_name] or not shard_exists(category, entry["shard"]):
+            tasks.append(ShardTask(category, pdf_path, file_name, current_files[file_name]))
+
+    # Удаляем шарды файлов, которые были удалены или изменены
+    for file_name in list(manifest["shards"]):
+        entry = manifest["shards"][file_name]
+        if file_name not in unreadable_files and current_files.get(file_name) != entry["hash"]:
+            del manifest["shards"][file_name]
+            still_used = any(other["shard"] == entry["shard"] for other in manifest["shards"].values())
+            if not still_used:
+                remove_shard(category, entry["shard"])
+            pdf_logger.info(f"Шард файла {file_name} категории {category} удален")
+    return tasks
+
+def build_shard(task: ShardTask, vector_store: Optional[FAISS], manifest: dict):
+    """Сохраняет построенный шард и регистрирует его в манифесте категории"""
+    shard_id = None
+    chunks = 0
+    if vector_store is not None:
+        shard_id = task.file_hash[:16] # Имя шарда определяется содержимым файла
+        save_shard(task.category, shard_id, vector_store)
+        chunks = vector_store.index.ntotal
+    manifest["shards"][task.file_name] = {"hash": task.file_hash, "shard": shard_id, "chunks": chunks}
+    save_category_manifest(task.category, manifest)
+
+def assemble_category(category: str, manifest: dict) -> Optional[FAISS]:
+    """Собирает векторное хранилище категории из ее шардов"""
+    vector_store = None
+    for file_name in sorted(manifest["shards"]):
+        shard_id = manifest["shards"][file_name]["shard"]
+        if shard_id is None:
+            continue
+        shard = load_shard(category, shard_id)
+        if shard is None:
+            continue
+        if vector_store is None:
+            vector_store = shard
         else:
-            pdf_logger.info(f"Загрузка существующих эмбеддингов для {category_id}")
+            vector_store.merge_from(shard)
+    return vector_store
+
+def remove_checkpoint(checkpoint_dir: str):
+    """Удаляет контрольные точки файла и опустевший каталог категории"""
+    shutil.rmtree(checkpoint_dir, ignore_errors=True)
+    try:
+        os.rmdir(os.path.dirname(checkpoint_dir))
+    except OSError:
+        pass
+
+def prune_checkpoints(tasks: List[ShardTask]):
+    """Удаляет контрольные точки файлов, которые больше не требуют обработки"""
+    checkpoints_root = os.path.join(VECTOR_STORE_DIR, CHECKPOINTS_DIR_NAME)
+    keep = {get_checkpoint_dir(task) for task in tasks}
+    for checkpoint_dir in glob.glob(os.path.join(checkpoints_root, '*', '*')):
+        if checkpoint_dir not in keep:
+            remove_checkpoint(checkpoint_dir)
+            file_logger.info(f"Удалена устаревшая контрольная точка: {checkpoint_dir}")
+
+def plan_ingestion_workers(task_count: int) -> Tuple[int, int]:
+    """
+    Подбирает количество процессов и потоков torch на процесс.
+
+    Произведение не превышает числа ядер, поэтому процессы не конкурируют за ядра.
+    При малом числе файлов каждому процессу достается больше потоков.
+
+    Возвращает:
+    - Кортеж (количество процессов, потоков на процесс).
+    """
+    cpu_count = multiprocessing.cpu_count()
+    threads_per_worker = INGESTION_THREADS_PER_WORKER or max(1, cpu_count // max(1, min(task_count, cpu_count)))
+    workers = INGESTION_WORKERS or max(1, min(task_count, cpu_count // threads_per_worker))
+    return workers, threads_per_worker
+
+def _init_ingestion_worker(threads_per_worker: int):
+    """Инициализация процесса ингестии: фиксированный бюджет потоков и собственная копия модели"""
+    os.environ['TOKENIZERS_PARALLELISM'] = 'false' # Токенизатор не должен запускать свои потоки сверх бюджета
+    set_default_num_threads(threads_per_worker)
+    CustomEmbeddings()
+
+def _embed_pdf_in_worker(pdf_path: str, checkpoint_dir: str) -> int:
+    """Задача процесса ингестии: записывает эмбеддинги сегментами и возвращает количество чанков"""
+    return embed_pdf_to_segments(pdf_path, checkpoint_dir)
+
+def _run_shard_tasks(tasks: List[ShardTask], manifests: Dict[str, dict]):
+    """Строит шарды в пуле процессов (или потоков) и регистрирует их в манифестах"""
+    if INGESTION_MODE == 'process':
+        workers, threads_per_worker = plan_ingestion_workers(len(tasks))
+        pdf_logger.info(f"Запуск {workers} процессов ингестии по {threads_per_worker} потоков torch")
+        context = multiprocessing.get_context('spawn') # Без fork: состояние torch родителя не копируется
+        executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=context,
+            initializer=_init_ingestion_worker,
+            initargs=(threads_per_worker,)
+        )
+        worker_fn = _embed_pdf_in_worker
+    else:
+        pdf_logger.info(f"Обработка в {NUMBER_OF_CORES} потоков")
+        executor = ThreadPoolExecutor(max_workers=NUMBER_OF_CORES)
+        # Процессы извлечения PyMuPDF делятся между одновременно обрабатываемыми файлами
+        worker_fn = functools.partial(build_pdf_vector_store, concurrent_files=min(len(tasks), NUMBER_OF_CORES))
+
+    completed_tasks = 0
+    with executor:
+        futures = {executor.submit(worker_fn, task.pdf_path, get_checkpoint_dir(task)): task for task in tasks}
+        for future in as_completed(futures):
+            task = futures[future]
             try:
-                vector_store = FAISS.load_local(
-                    folder_path=VECTOR_STORE_DIR,
-                    index_name=category_id,
-                    embeddings=embeddings,
-                    allow_dangerous_deserialization=True
-                )
-                return category, vector_store
+                result = future.result()
+                if INGESTION_MODE == 'process': # Процесс ингестии записал сегменты, индекс собирается здесь
+                    result = vector_store_from_segments(get_checkpoint_dir(task)) if result else None
+                build_shard(task, result, manifests[task.category])
+                remove_checkpoint(get_checkpoint_dir(task)) # Шард сохранен, прогресс больше не нужен
             except Exception as e:
-                pdf_logger.error(f"Ошибка при загрузке эмбеддингов {category_id}: {e}")
-                # Если не удалось загрузить, удаляем поврежденные файлы
-                try:
-                    os.remove(vector_store_path)
-                    os.remove(index_path)
-                    file_logger.info(f"Удалены поврежденные файлы: {vector_store_path}, {index_path}")
-                except:
-                    pass
-                return None
-            
-    except Exception as e:
-        pdf_logger.error(f"Ошибка при обработке {pdf_path}: {e}")
-        return None
+                pdf_logger.error(f"Ошибка при обработке {task.pdf_path}: {e}")
+            completed_tasks += 1
+            pdf_logger.info(f"Прогресс построения шардов: {completed_tasks}/{len(tasks)} файлов "
+                            f"({completed_tasks/len(tasks)*100:.1f}%)")
 
 def load_and_process_pdfs() -> Dict[str, FAISS]:
-    """Загружает PDF файлы по категориям и создает векторные хранилища"""
+    """
+    Загружает PDF файлы по категориям и создает векторные хранилища.
+
+    Для каждого PDF строится отдельный шард; манифест категории хранит хеши файлов, поэтому
+    добавление или удаление книги перестраивает только ее шард. Хранилища категорий
+    собираются из шардов.
+    """
     vector_stores = {}
-    processing_tasks = []
-    
-    pdf_logger.info(f"Запуск обработки PDF файлов в {NUMBER_OF_CORES} потоков")
+    manifests = {}
+    tasks = []
+
+    pdf_logger.info(f"Запуск обработки PDF файлов (режим {INGESTION_MODE})")
     os.makedirs(VECTOR_STORE_DIR, exist_ok=True)
-    
-    # Собираем все задачи для обработки
+    file_manifest = FileManifest(FILE_MANIFEST_PATH, os.path.dirname(VECTOR_STORE_DIR))
+    all_pdf_files = []
+
+    # Сравниваем файлы категорий с манифестами
     for category, path_pattern in PDF_CATEGORIES.items():
         pdf_files = glob.glob(path_pattern)
-        
         if not pdf_files:
             pdf_logger.warning(f"PDF файлы не найдены для категории {category}")
-            continue
-        
-        # Получаем уникальный идентификатор для категории
-        category_id = get_category_hash(category, pdf_files)
-        
-        # Добавляем задачу для каждого файла
-        for pdf_path in pdf_files:
-            processing_tasks.append((category, pdf_path, category_id))
-    
-    total_tasks = len(processing_tasks)
-    pdf_logger.info(f"Всего файлов для обработки: {total_tasks}")
-    
-    # Создаем словарь для хранения мьютексов по категориям
-    category_locks = {category: threading.Lock() for category in PDF_CATEGORIES.keys()}
-    
-    def process_result(result: Optional[Tuple[str, FAISS]]):
-        if result is None:
-            return
-        
-        category, vector_store = result
-        with category_locks[category]:
-            if category not in vector_stores:
-                vector_stores[category] = vector_store
-            else:
-                vector_stores[category].merge_from(vector_store)
-    
-    # Запускаем обработку в пуле потоков
-    completed_tasks = 0
-    with ThreadPoolExecutor(max_workers=NUMBER_OF_CORES) as executor:
-        futures = [executor.submit(process_single_pdf, task) for task in processing_tasks]
-        for future in futures:
-            try:
-                result = future.result()
-                if result:
-                    process_result(result)
-                completed_tasks += 1
-                pdf_logger.info(f"Прогресс обработки: {completed_tasks}/{total_tasks} файлов ({completed_tasks/total_tasks*100:.1f}%)")
-            except Exception as e:
-                pdf_logger.error(f"Ошибка при обработке задачи: {e}")
-    
+        all_pdf_files.extend(pdf_files)
+
+        manifest = load_category_manifest(category)
+        category_tasks = plan_category(category, pdf_files, manifest, file_manifest)
+        if pdf_files or os.path.isdir(get_category_dir(category)):
+            save_category_manifest(category, manifest)
+        manifests[category] = manifest
+        tasks.extend(category_tasks)
+
+    file_manifest.retain(all_pdf_files)
+    file_manifest.save()
+    pdf_logger.info(f"Проверено файлов: {len(all_pdf_files)}, пересчитано хешей: {file_manifest.rehashed}")
+
+    prune_checkpoints(tasks)
+    pdf_logger.info(f"Шардов к построению: {len(tasks)}")
+    if tasks:
+        _run_shard_tasks(tasks, manifests)
+
+    # Собираем хранилища категорий из шардов
+    for category, manifest in manifests.items():
+        vector_store = assemble_category(category, manifest)
+        if vector_store is not None:
+            vector_stores[category] = vector_store
+            pdf_logger.info(f"Категория {category}: {vector_store.index.ntotal} векторов из "
+                            f"{len(manifest['shards'])} шардов")
+
     pdf_logger.info("Обработка PDF файлов завершена")
-    return vector_stores 
\ No newline at end of file
+    return vector_stores
@@ -0,0 +1,111 @@
+import os
+import queue
+import threading
+import time
+import numpy as np
+from concurrent.futures import Future
+from typing import Callable, List
+from logging_config import setup_logger
+
+# Инициализация логгера
+emb_logger = setup_logger('query_batcher', 'EMBEDDINGS_LOGGING')
+
+# Параметры микро-пакетирования запросов
+EMBEDDINGS_BATCH_WINDOW_MS = float(os.getenv('EMBEDDINGS_BATCH_WINDOW_MS', '5'))  # Окно ожидания (0 - отключено)
+EMBEDDINGS_QUERY_BATCH_SIZE = int(os.getenv('EMBEDDINGS_QUERY_BATCH_SIZE', '32'))  # Максимальный размер пакета
+
+
+class QueryMicroBatcher:
+    """
+        Объединяет одновременные запросы на эмбеддинг из разных потоков в один пакет.
+
+        Отдельный поток забирает запросы из очереди. Одиночный запрос отправляется в модель сразу;
+        если запросы приходят одновременно, поток ждет остальные не дольше окна или до заполнения
+        пакета. Каждый вызывающий поток получает свой вектор.
+    """
+
+    def __init__(self, encode: Callable[[List[str]], np.ndarray],
+                 window_ms: float = EMBEDDINGS_BATCH_WINDOW_MS,
+                 max_batch_size: int = EMBEDDINGS_QUERY_BATCH_SIZE):
+        """
+        Аргументы:
+        - encode: Функция пакетной генерации эмбеддингов (список текстов -> матрица).
+        - window_ms: Максимальное время ожидания пакета в миллисекундах.
+        - max_batch_size: Максимальное количество запросов в пакете.
+        """
+        self._encode = encode
+        self.window = window_ms / 1000
+        self.max_batch_size = max(1, max_batch_size)
+        self._queue = queue.Queue()
+        self._pending = 0  # Зарегистрированные вызовы, еще не забранные из очереди
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='query-micro-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, text: str) -> np.ndarray:
+        """
+        Ставит текст в очередь и ожидает его эмбеддинг.
+
+        Аргументы:
+        - text: Текст запроса.
+
+        Возвращает:
+        - Вектор float32.
+        """
+        future = Future()
+        with self._lock:
+            self._pending += 1
+        self._queue.put((text, future))
+        return future.result()
+
+    def _take(self, timeout: float = None):
+        """Забирает запрос из очереди (None, если очередь пуста по истечении timeout)"""
+        try:
+            item = self._queue.get(timeout=timeout) if timeout is None or timeout > 0 else self._queue.get_nowait()
+        except queue.Empty:
+            return None
+        with self._lock:
+            self._pending -= 1
+        return item
+
+    def _collect_batch(self) -> list:
+        """Собирает пакет: первый запрос ждем без ограничения, остальные — в пределах окна"""
+        batch = [self._take()]
+        deadline = time.monotonic() + self.window
+
+        while len(batch) < self.max_batch_size:
+            # Забираем все, что уже в очереди, без ожидания
+            item = self._take(timeout=0)
+            if item is not None:
+                batch.append(item)
+                continue
+
+            # Ждем только при признаках одновременной нагрузки: одиночный запрос не задерживается
+            with self._lock:
+                concurrent = self._pending > 0 or len(batch) > 1
+            remaining = deadline - time.monotonic()
+            if not concurrent or remaining <= 0:
+                break
+            item = self._take(timeout=remaining)
+            if item is None:
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        """Цикл обработки пакетов"""
+        while True:
+            batch = self._collect_batch()
+            texts = [text for text, _ in batch]
+            try:
+                vectors = self._encode(texts)
+                if len(vectors) != len(texts):
+                    raise RuntimeError("Не удалось вычислить эмбеддинги пакета запросов")
+                for (_, future), vector in zip(batch, vectors):
+                    future.set_result(vector)
+                if len(batch) > 1:
+                    emb_logger.info(f"Микро-пакет из {len(batch)} запросов обработан за один проход модели")
+            except Exception as e:
+                emb_logger.error(f"Ошибка при обработке пакета запросов: {e}")
+                for _, future in batch:
+                    future.set_exception(e)
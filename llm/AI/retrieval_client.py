@@ -0,0 +1,132 @@
+import os
+import hmac
+import json
+import socket
+import threading
+import http.client
+from typing import List, Optional
+from urllib.parse import urlparse
+from logging_config import setup_logger
+
+# Инициализация логгера
+rag_logger = setup_logger('retrieval_client', 'RAG_LOGGING')
+
+# Адрес сервиса поиска (AI/retrieval_service.py): unix:///путь/к/сокету или http://127.0.0.1:порт.
+# Если задан, API не загружает модель и индексы, а запрашивает контекст у сервиса
+RETRIEVAL_SIDECAR_URL = os.getenv('RETRIEVAL_SIDECAR_URL')
+RETRIEVAL_SIDECAR_TIMEOUT = float(os.getenv('RETRIEVAL_SIDECAR_TIMEOUT', '30'))  # Таймаут запроса, сек
+# Токен для служебных запросов (перезагрузка индексов); если не задан, служебные запросы отклоняются
+INDEX_ADMIN_TOKEN = os.getenv('INDEX_ADMIN_TOKEN')
+ADMIN_TOKEN_HEADER = 'X-Admin-Token'
+
+
+def is_valid_admin_token(token: Optional[str]) -> bool:
+    """Проверка токена служебного запроса (сравнение за постоянное время)"""
+    if not INDEX_ADMIN_TOKEN or not token:
+        return False
+    return hmac.compare_digest(token.encode('utf-8'), INDEX_ADMIN_TOKEN.encode('utf-8'))
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP-соединение через Unix-сокет"""
+
+    def __init__(self, socket_path: str, timeout: float):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+class RetrievalClient:
+    """
+        Клиент сервиса поиска. Не зависит от torch и faiss, поэтому процесс API запускается
+        без загрузки модели и индексов. Соединение с сервисом переиспользуется в каждом потоке.
+    """
+
+    def __init__(self, url: str = RETRIEVAL_SIDECAR_URL, timeout: float = RETRIEVAL_SIDECAR_TIMEOUT):
+        parsed = urlparse(url)
+        if parsed.scheme not in ('unix', 'http'):
+            raise ValueError(f"Неподдерживаемый адрес сервиса поиска: {url} (ожидается unix:// или http://)")
+        self.url = url
+        self.timeout = timeout
+        self._parsed = parsed
+        self._local = threading.local()
+
+    def _connection(self) -> http.client.HTTPConnection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            if self._parsed.scheme == 'unix':
+                connection = UnixHTTPConnection(self._parsed.path, self.timeout)
+            else:
+                connection = http.client.HTTPConnection(self._parsed.hostname, self._parsed.port or 80,
+                                                        timeout=self.timeout)
+            self._local.connection = connection
+        return connection
+
+    def _request(self, method: str, path: str, payload: dict = None, headers: dict = None) -> dict:
+        """Выполняет запрос; при разрыве соединения запрос повторяется один раз через новое соединение"""
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8') if payload is not None else None
+        headers = dict(headers or {})
+        if body is not None:
+            headers["Content-Type"] = "application/json"
+        for attempt in range(2):
+            connection = self._connection()
+            try:
+                connection.request(method, path, body=body, headers=headers)
+                response = connection.getresponse()
+                data = json.loads(response.read().decode('utf-8') or '{}')
+                break
+            except (http.client.HTTPException, OSError):
+                connection.close()
+                self._local.connection = None
+                if attempt:
+                    raise
+        if response.status == 403:
+            raise PermissionError("Сервис поиска отклонил служебный запрос: неверный токен")
+        if response.status >= 500:
+            raise RuntimeError(f"Сервис поиска вернул ошибку {response.status}: {data.get('error')}")
+        return data
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """Эмбеддинги запросов"""
+        return self._request('POST', '/embed', {"texts": texts})["vectors"]
+
+    def search(self, query: str, k: int = 5, categories: Optional[List[str]] = None) -> List[dict]:
+        """Ближайшие чанки: [{content, metadata, distance, category}] по возрастанию расстояния"""
+        return self._request('POST', '/search', {"query": query, "k": k, "categories": categories})["results"]
+
+    def search_batch(self, queries: List[str], k: int = 5,
+                     categories: Optional[List[str]] = None) -> List[List[dict]]:
+        """Пакетный поиск: для каждого запроса список чанков по возрастанию расстояния"""
+        return self._request('POST', '/search-batch', {"queries": queries, "k": k, "categories": categories})["results"]
+
+    def context(self, query: str, n_results: int = 5) -> str:
+        """Готовый контекст для промпта (как get_relevant_context)"""
+        return self._request('POST', '/context', {"query": query, "n_results": n_results})["context"]
+
+    def status(self) -> dict:
+        """Активная версия индексов сервиса"""
+        return self._request('GET', '/index-version')
+
+    def reload(self, version: str = None, force: bool = False, admin_token: str = None) -> dict:
+        """Перезагрузка версии индексов в сервисе (admin_token — токен из исходного служебного запроса)"""
+        return self._request('POST', '/reload-index', {"version": version, "force": force},
+                             headers={ADMIN_TOKEN_HEADER: admin_token or ''})
+
+
+_client: Optional[RetrievalClient] = None
+_client_lock = threading.Lock()
+
+
+def get_retrieval_client() -> RetrievalClient:
+    """Общий клиент сервиса поиска процесса"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = RetrievalClient()
+            rag_logger.info(f"Поиск выполняется сервисом {RETRIEVAL_SIDECAR_URL}")
+        return _client
@@ -0,0 +1,145 @@
+"""
+Сервис поиска: модель эмбеддингов и индексы загружаются один раз и обслуживают все процессы API.
+
+Процессы API с заданным RETRIEVAL_SIDECAR_URL не загружают модель и индексы: get_relevant_context
+запрашивает контекст у сервиса. Одновременные запросы обрабатываются потоками waitress, а их
+эмбеддинги объединяются в пакеты микробатчером запросов (EMBEDDINGS_BATCH_WINDOW_MS).
+Новые версии индексов подхватываются без перезапуска (наблюдатель, SIGHUP, /reload-index).
+
+Запуск (из каталога llm):
+    RETRIEVAL_SIDECAR_URL=unix:///tmp/medicine-retrieval.sock PYTHONPATH=. python AI/retrieval_service.py
+"""
+import os
+import json
+from urllib.parse import urlparse
+from flask import Flask, request, Response
+from waitress import serve
+from embeddings_handler import CustomEmbeddings
+from index_registry import IndexRegistry
+from context_manager import get_relevant_context, search_chunks, search_chunks_batch
+from text_preprocessing import clean_text
+from retrieval_client import RETRIEVAL_SIDECAR_URL, ADMIN_TOKEN_HEADER, is_valid_admin_token
+from logging_config import setup_logger
+
+# Инициализация логгера
+api_logger = setup_logger('retrieval_service', 'API_LOGGING')
+
+RETRIEVAL_SIDECAR_THREADS = int(os.getenv('RETRIEVAL_SIDECAR_THREADS', '8'))  # Потоков обработки запросов
+DEFAULT_SIDECAR_URL = "http://127.0.0.1:5001"
+
+app = Flask(__name__)
+
+embeddings = CustomEmbeddings()
+index_registry = IndexRegistry()
+index_registry.reload()
+index_registry.start_watcher()
+index_registry.install_signal_handler()
+
+
+def _json_response(data: dict, status: int = 200) -> Response:
+    return Response(json.dumps(data, ensure_ascii=False), status=status, mimetype='application/json')
+
+
+def _serialize_results(candidates) -> list:
+    return [
+        {"content": doc.page_content, "metadata": doc.metadata, "distance": float(distance), "category": category}
+        for doc, distance, category in candidates
+    ]
+
+
+@app.route('/embed', methods=['POST'])
+def embed():
+    """Эмбеддинги запросов: {"texts": [...]} → {"vectors": [[...], ...]}"""
+    try:
+        texts = request.get_json().get('texts', [])
+        vectors = embeddings.embed_queries_matrix(texts).tolist()
+        return _json_response({"vectors": vectors})
+    except Exception as e:
+        api_logger.error(f"Ошибка в embed: {str(e)}")
+        return _json_response({"error": "Internal server error"}, 500)
+
+
+@app.route('/search', methods=['POST'])
+def search():
+    """Ближайшие чанки: {"query", "k", "categories"} → {"results": [...], "version"}"""
+    try:
+        data = request.get_json()
+        k = int(data.get('k', 5))
+        with index_registry.acquire() as bundle:
+            candidates = []
+            if bundle is not None:
+                candidates = search_chunks(clean_text(data['query']), k, bundle.stores, bundle.unified,
+                                           data.get('categories'))
+            version = bundle.version if bundle else None
+        return _json_response({"results": _serialize_results(candidates), "version": version})
+    except Exception as e:
+        api_logger.error(f"Ошибка в search: {str(e)}")
+        return _json_response({"error": "Internal server error"}, 500)
+
+
+@app.route('/search-batch', methods=['POST'])
+def search_batch():
+    """Пакетный поиск: {"queries": [...], "k", "categories"} → {"results": [[...], ...], "version"}"""
+    try:
+        data = request.get_json()
+        k = int(data.get('k', 5))
+        clean_queries = [clean_text(query) for query in data.get('queries', [])]
+        with index_registry.acquire() as bundle:
+            batch = [[] for _ in clean_queries]
+            if bundle is not None:
+                batch = search_chunks_batch(clean_queries, k, bundle.stores, bundle.unified, data.get('categories'))
+            version = bundle.version if bundle else None
+        return _json_response({"results": [_serialize_results(candidates) for candidates in batch], "version": version})
+    except Exception as e:
+        api_logger.error(f"Ошибка в search_batch: {str(e)}")
+        return _json_response({"error": "Internal server error"}, 500)
+
+
+@app.route('/context', methods=['POST'])
+def context():
+    """Контекст для промпта: {"query", "n_results"} → {"context", "version"}"""
+    try:
+        data = request.get_json()
+        n_results = int(data.get('n_results', 5))
+        with index_registry.acquire() as bundle:
+            if bundle is None:
+                text = get_relevant_context(data['query'], {}, n_results)
+            else:
+                text = get_relevant_context(data['query'], bundle.stores, n_results,
+                                            unified_index=bundle.unified, router=bundle.router)
+            version = bundle.version if bundle else None
+        return _json_response({"context": text, "version": version})
+    except Exception as e:
+        api_logger.error(f"Ошибка в context: {str(e)}")
+        return _json_response({"error": "Internal server error"}, 500)
+
+
+@app.route('/index-version', methods=['GET'])
+def get_index_version():
+    """Активная версия индексов сервиса"""
+    return _json_response(index_registry.status())
+
+
+@app.route('/reload-index', methods=['POST'])
+def reload_index():
+    """Перезагрузка версии индексов (процессы API передают сюда свои запросы на перезагрузку)"""
+    if not is_valid_admin_token(request.headers.get(ADMIN_TOKEN_HEADER)):
+        api_logger.error("Запрос на перезагрузку индексов без верного токена")
+        return _json_response({"error": "Forbidden"}, 403)
+    try:
+        data = request.get_json(silent=True) or {}
+        result = index_registry.reload(version=data.get('version'), force=bool(data.get('force', False)))
+        return _json_response(result, 200 if result["error"] is None else 409)
+    except Exception as e:
+        api_logger.error(f"Ошибка в reload_index: {str(e)}")
+        return _json_response({"error": "Internal server error"}, 500)
+
+
+if __name__ == '__main__':
+    url = urlparse(RETRIEVAL_SIDECAR_URL or DEFAULT_SIDECAR_URL)
+    api_logger.info(f"Запуск сервиса поиска: {RETRIEVAL_SIDECAR_URL or DEFAULT_SIDECAR_URL}")
+    if url.scheme == 'unix':
+        # Сокет доступен только пользователю сервиса
+        serve(app, unix_socket=url.path, unix_socket_perms='600', threads=RETRIEVAL_SIDECAR_THREADS)
+    else:
+        serve(app, host=url.hostname, port=url.port, threads=RETRIEVAL_SIDECAR_THREADS)
@@ -1,10 +1,28 @@
+import os
 import re
+from typing import List
 from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_core.documents import Document
 from logging_config import setup_logger
 
 # Инициализация логгера
 text_logger = setup_logger('text_preprocessing', 'FILE_OPERATIONS_LOGGING')
 
+# Размер чанка и перекрытия в токенах модели эмбеддингов (с учетом служебных токенов [CLS]/[SEP])
+TEXT_SPLITTER_CHUNK_TOKENS = int(os.getenv('TEXT_SPLITTER_CHUNK_TOKENS', '256'))
+TEXT_SPLITTER_OVERLAP_TOKENS = int(os.getenv('TEXT_SPLITTER_OVERLAP_TOKENS', '32'))
+SPECIAL_TOKENS_COUNT = 2
+
+# Иерархия разделителей (регулярные выражения): предложения, части предложений, слова.
+# Переносов строк в тексте нет: clean_text заменяет их пробелами (в PDF это переносы верстки, а не абзацы)
+MEDICAL_TEXT_SEPARATORS = [
+    r"(?<=[.!?…])\s+(?=[А-ЯЁA-Z0-9«\"(])",  # Граница предложения: знак конца и заглавная буква
+    r"(?<=[;:])\s+",
+    r"(?<=,)\s+",
+    r"\s+",
+    r"",
+]
+
 def clean_text(text: str) -> str:
     """Очищает текст от лишних пробелов и специальных символов.
 
@@ -34,26 +52,50 @@ def clean_text(text: str) -> str:
     text_logger.info(f"Очистка текста завершена. Размер уменьшен с {original_length} до {cleaned_length} символов")
     return text
 
-def create_medical_text_splitter() -> RecursiveCharacterTextSplitter:
-    """Создает оптимизированный разделитель текста для медицинских документов.
+def create_medical_text_splitter(tokenizer,
+                                 chunk_tokens: int = TEXT_SPLITTER_CHUNK_TOKENS,
+                                 overlap_tokens: int = TEXT_SPLITTER_OVERLAP_TOKENS) -> RecursiveCharacterTextSplitter:
+    """Создает разделитель текста для медицинских документов с размером чанка в токенах модели.
+
+    Args:
+        tokenizer: Токенизатор модели эмбеддингов (длина чанка считается в его токенах)
+        chunk_tokens (int): Максимальный размер чанка в токенах, включая служебные
+        overlap_tokens (int): Перекрытие соседних чанков в токенах
 
     Returns:
         RecursiveCharacterTextSplitter: Настроенный экземпляр разделителя
 
     Особенности:
-        - Использует иерархию разделителей от абзацев до отдельных слов
-        - Большой размер чанка (4000 символов) для сохранения контекста
-        - Значительное перекрытие чанков (600 символов) для сохранения связности
+        - Чанк не длиннее окна, которое модель реально учитывает, поэтому текст не обрезается молча
+        - Границы выбираются по предложениям русского текста, затем по частям предложений и словам
     """
     text_logger.info("Создание разделителя текста для медицинских документов")
 
-    # Инициализация разделителя с особыми параметрами для медицинских текстов
-    splitter = RecursiveCharacterTextSplitter(
-        separators=["\n\n", "\n", ".", ";", ":", " ", ""], # Иерархия разделителей
-        chunk_size=4000,     # Оптимально для длинных медицинских документов
-        chunk_overlap=600,   # Большое перекрытие для сохранения контекста
-        length_function=len, # Использование стандартной длины строки
-        is_separator_regex=False
+    # Инициализация разделителя с длиной в токенах модели эмбеддингов
+    splitter = RecursiveCharacterTextSplitter.from_huggingface_tokenizer(
+        tokenizer,
+        separators=MEDICAL_TEXT_SEPARATORS, # Иерархия разделителей
+        chunk_size=chunk_tokens - SPECIAL_TOKENS_COUNT, # Длина без [CLS]/[SEP]
+        chunk_overlap=overlap_tokens, # Перекрытие для сохранения связности
+        is_separator_regex=True,
+        keep_separator=True # Знаки препинания остаются в тексте чанка
     )
-    text_logger.info(f"Разделитель создан с размером чанка {4000} и перекрытием {600}")
-    return splitter 
\ No newline at end of file
+    text_logger.info(f"Разделитель создан с размером чанка {chunk_tokens} и перекрытием {overlap_tokens} токенов")
+    return splitter
+
+def add_token_counts(chunks: List[Document], tokenizer) -> List[Document]:
+    """Записывает в метаданные каждого чанка количество токенов (с учетом служебных).
+
+    Args:
+        chunks (List[Document]): Чанки после разделения
+        tokenizer: Токенизатор модели эмбеддингов
+
+    Returns:
+        List[Document]: Те же чанки с полем metadata['token_count']
+    """
+    if not chunks:
+        return chunks
+    encodings = tokenizer([chunk.page_content for chunk in chunks], add_special_tokens=True)
+    for chunk, input_ids in zip(chunks, encodings['input_ids']):
+        chunk.metadata['token_count'] = len(input_ids)
+    return chunks
@@ -0,0 +1,168 @@
+import os
+import bisect
+import faiss
+import numpy as np
+from typing import Dict, Iterable, List, Optional, Tuple
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from embeddings_handler import CustomEmbeddings
+from ann_index import RAG_INDEX_TYPE, RAG_RERANK_FACTOR, create_index, configure_search, search_parameters, rerank_exact
+from logging_config import setup_logger
+
+# Инициализация логгера
+rag_logger = setup_logger('unified_index', 'RAG_LOGGING')
+
+# Режим поиска: unified - один поиск по общему индексу, category - отдельный поиск в каждой категории
+RAG_SEARCH_MODE = os.getenv('RAG_SEARCH_MODE', 'unified')
+
+UNIFIED_INDEX_NAME = "unified"
+UNIFIED_VECTORS_FILE_NAME = "unified_vectors.npy"  # Полные векторы для переранжирования сжатого индекса
+
+
+def build_unified_store(vector_stores: Dict[str, FAISS],
+                        index_type: str = RAG_INDEX_TYPE) -> Tuple[FAISS, Dict[str, List[int]], np.ndarray]:
+    """
+    Объединяет хранилища категорий в один индекс выбранного типа (см. ann_index.INDEX_TYPES).
+
+    Векторы каждой категории занимают непрерывный диапазон идентификаторов, поэтому фильтр
+    по категории — это IDSelectorRange.
+
+    Возвращает:
+    - Общее хранилище, диапазоны идентификаторов категорий {категория: [начало, конец)} и матрицу полных векторов.
+    """
+    texts, metadatas, vectors = [], [], []
+    ranges = {}
+    for category, store in vector_stores.items():
+        start = len(texts)
+        for position in range(store.index.ntotal):
+            doc = store.docstore.search(store.index_to_docstore_id[position])
+            texts.append(doc.page_content)
+            metadatas.append({**doc.metadata, "category": category})
+        vectors.append(store.index.reconstruct_n(0, store.index.ntotal))
+        ranges[category] = [start, len(texts)]
+    matrix = np.ascontiguousarray(np.vstack(vectors), dtype=np.float32)
+    unified_store = FAISS(
+        embedding_function=CustomEmbeddings(),
+        index=create_index(matrix, index_type),
+        docstore=InMemoryDocstore(),
+        index_to_docstore_id={},
+    )
+    unified_store.add_embeddings(zip(texts, matrix), metadatas=metadatas)
+    rag_logger.info(f"Построен общий индекс {index_type}: {unified_store.index.ntotal} векторов, {len(ranges)} категорий")
+    return unified_store, ranges, matrix
+
+
+class UnifiedIndex:
+    """
+        Общий индекс всех категорий: один эмбеддинг запроса и один поиск с глобальным top-k.
+
+        Поиск по части категорий выполняется тем же индексом с селектором диапазонов идентификаторов.
+        Для сжатого индекса (PQ) выбирается k * RAG_RERANK_FACTOR кандидатов, которые переранжируются
+        по полным векторам (отображенным в память) или, если их нет, по заново вычисленным эмбеддингам.
+    """
+
+    def __init__(self, store: FAISS, ranges: Dict[str, List[int]], compressed: bool = False,
+                 vectors: Optional[np.ndarray] = None):
+        """
+        Аргументы:
+        - store: Общее хранилище FAISS.
+        - ranges: Диапазоны идентификаторов категорий {категория: [начало, конец)}.
+        - compressed: Индекс возвращает приближенные расстояния и требует переранжирования.
+        - vectors: Полные векторы корпуса для переранжирования.
+        """
+        self.store = store
+        self.ranges = ranges
+        self.compressed = compressed
+        self.vectors = vectors
+        configure_search(store.index)
+        self.categories = sorted(ranges, key=lambda category: ranges[category][0])
+        self._starts = [ranges[category][0] for category in self.categories]
+
+    def category_of(self, vector_id: int) -> str:
+        """Категория по идентификатору вектора"""
+        return self.categories[bisect.bisect_right(self._starts, vector_id) - 1]
+
+    def _selectors(self, categories: List[str]) -> List[faiss.IDSelector]:
+        """
+        Селекторы идентификаторов выбранных категорий; последний объединяет все остальные.
+
+        Все промежуточные селекторы возвращаются, чтобы они жили до окончания поиска:
+        IDSelectorOr хранит на них только указатели.
+        """
+        selectors = []
+        for category in categories:
+            start, end = self.ranges[category]
+            selectors.append(faiss.IDSelectorRange(start, end))
+            if len(selectors) > 1:
+                selectors.append(faiss.IDSelectorOr(selectors[-2], selectors[-1]))
+        return selectors
+
+    def search(self, query_vector: np.ndarray, k: int,
+               categories: Iterable[str] = None) -> List[Tuple[Document, float, str]]:
+        """
+        Поиск ближайших чанков.
+
+        Аргументы:
+        - query_vector: Эмбеддинг запроса.
+        - k: Количество результатов.
+        - categories: Категории для поиска (по умолчанию все).
+
+        Возвращает:
+        - Список (документ, расстояние L2, категория) по возрастанию расстояния.
+        """
+        return self.search_batch(np.asarray(query_vector, dtype=np.float32).reshape(1, -1), k, categories)[0]
+
+    def search_batch(self, query_vectors: np.ndarray, k: int,
+                     categories: Iterable[str] = None) -> List[List[Tuple[Document, float, str]]]:
+        """
+        Пакетный поиск: один вызов индекса с матрицей запросов (nq × d).
+
+        Аргументы:
+        - query_vectors: Эмбеддинги запросов построчно.
+        - k: Количество результатов на запрос.
+        - categories: Категории для поиска (по умолчанию все), общие для всех запросов.
+
+        Возвращает:
+        - Для каждого запроса список (документ, расстояние L2, категория) по возрастанию расстояния.
+        """
+        queries = np.ascontiguousarray(query_vectors, dtype=np.float32)
+        params = None
+        selectors = []
+        if categories is not None:
+            categories = [category for category in categories if category in self.ranges]
+            if not categories:
+                return [[] for _ in range(len(queries))]
+            if len(categories) < len(self.categories):
+                selectors = self._selectors(categories)
+                params = search_parameters(self.store.index, selectors[-1])
+        if not len(queries):
+            return []
+        fetch_k = k * RAG_RERANK_FACTOR if self.compressed else k
+        all_distances, all_ids = self.store.index.search(queries, fetch_k, params=params)
+
+        batch_results = []
+        for query, distances, ids in zip(queries, all_distances, all_ids):
+            if self.compressed:
+                distances, ids = self._rerank(query, ids[ids >= 0], k)
+            results = []
+            for distance, vector_id in zip(distances, ids):
+                if vector_id < 0:
+                    continue
+                results.append((self._document(int(vector_id)), float(distance), self.category_of(int(vector_id))))
+            batch_results.append(results)
+        return batch_results
+
+    def _document(self, vector_id: int) -> Document:
+        return self.store.docstore.search(self.store.index_to_docstore_id[vector_id])
+
+    def _rerank(self, query: np.ndarray, ids: np.ndarray, k: int):
+        """Точные расстояния до кандидатов сжатого индекса"""
+        if self.vectors is not None:
+            order = np.argsort(ids)  # Последовательное чтение отображенного файла
+            ids = ids[order]
+            candidate_vectors = self.vectors[ids]
+        else:
+            texts = [self._document(int(vector_id)).page_content for vector_id in ids]
+            candidate_vectors = CustomEmbeddings().embed_documents_matrix(texts)
+        return rerank_exact(query, ids, candidate_vectors, k)